@@ -1 +1,21 @@
 from .metrics import SegmentationMetrics
+from .batch import batch_metrics, slice_metrics
+from .cohort import CohortMetrics
+from .encoded import CoordinateMask, RunLengthMask
+from .instances import InstanceMetrics
+from .timeseries import frame_metrics, temporal_summary
+from .screening import approximate_surface_metrics, qa_gate
+from .incremental import IncrementalMetrics
+from .parallel import parallel_metrics
+from .pipeline import metrics_pipeline
+from .registry import (MetricEvaluator, available_metrics,
+                       register_intermediate, register_metric)
+from .planner import (compute_surface_distances_planned,
+                      plan_surface_distances)
+from .local import (local_overlap_maps, local_surface_error_map,
+                    surface_error_map)
+from .bootstrap import bootstrap_ci, bootstrap_paired_ci, bootstrap_pooled_ci
+from .grids import CrossGridMetrics
+from .summary import MaskIndex, mask_hash, summarise_mask
+from .storage import ChunkedMask
+from .multiclass import MultiClassMetrics
@@ -0,0 +1,133 @@
+import numpy as np
+
+from . import surface_distance as sd
+from .metrics import (_as_bool_mask, _dice, _jaccard, _sensitivity,
+                      _specificity, _precision, _accuracy)
+
+
+def batch_metrics(prediction, truth, zoom, percentile=95, symmetric=True):
+    """
+    Calculate the segmentation accuracy metrics of a batch of masks at once.
+
+    Equivalent to creating a SegmentationMetrics instance for each pair
+    ``(prediction[i], truth[i])`` but the overlap counts come from axis
+    reductions and the surface distances of the whole batch are computed in
+    a few vectorized calls.
+
+    Parameters
+    ----------
+    prediction : np.ndarray
+        An (N, X, Y) or (N, X, Y, Z) array of bools or ints (0 and 1)
+        representing the predicted masks, stacked along the first axis.
+    truth : np.ndarray
+        An array of the same shape as ``prediction`` representing the ground
+        truth masks.
+    zoom : tuple
+        The length of each voxel dimension of a single mask in millimeters.
+    percentile : int, default 95
+        The percentile of surface distances to define as the Hausdorff
+        distance.
+    symmetric : bool, default True
+        If true, the symmetric mean surface distance is calculated. If false,
+        the mean surface distance of each mask is a pair of values, one for
+        each direction.
+
+    Returns
+    -------
+    metrics : dict
+        The same keys as ``SegmentationMetrics.get_dict`` with an array
+        holding the score of each mask in the batch.
+    """
+    prediction = _as_bool_mask(prediction)
+    truth = _as_bool_mask(truth)
+    return _batch_metrics(prediction, truth, zoom, percentile, symmetric)
+
+
+def _batch_metrics(prediction, truth, zoom, percentile, symmetric):
+    """batch_metrics for masks that have already been thresholded."""
+    spatial_axes = tuple(range(1, prediction.ndim))
+    tp = np.count_nonzero(prediction & truth, axis=spatial_axes)
+    fp = np.count_nonzero(prediction, axis=spatial_axes) - tp
+    fn = np.count_nonzero(truth, axis=spatial_axes) - tp
+    tn = np.prod(prediction.shape[1:]) - tp - fp - fn
+    counts = {'tp': tp, 'fp': fp, 'fn': fn, 'tn': tn}
+
+    surface_dist = sd.compute_surface_distances_batch(prediction, truth, zoom)
+    msd = sd.compute_average_surface_distance_batch(surface_dist)
+    if symmetric:
+        msd = np.mean(msd, axis=0)
+    else:
+        msd = np.stack(msd, axis=-1)
+
+    true_volume = (tp + fn) * np.prod(zoom) / 1000
+    predicted_volume = (tp + fp) * np.prod(zoom) / 1000
+    return {'dice': _dice(**counts),
+            'jaccard': _jaccard(**counts),
+            'sensitivity': _sensitivity(**counts),
+            'specificity': _specificity(**counts),
+            'precision': _precision(**counts),
+            'accuracy': _accuracy(**counts),
+            'mean_surface_distance': msd,
+            'hausdorff_distance': sd.compute_robust_hausdorff_batch(
+                surface_dist, percentile),
+            'volume_difference': predicted_volume - true_volume,
+            'true_volume': true_volume,
+            'predicted_volume': predicted_volume}
+
+
+def slice_metrics(prediction, truth, zoom, axis=2, percentile=95,
+                  symmetric=True):
+    """
+    Calculate the segmentation accuracy metrics of every slice of a pair of
+    3D masks in a single pass.
+
+    Only slices where either mask has foreground are scored, their 2D
+    surface distances are computed together with ``batch_metrics``.
+
+    Parameters
+    ----------
+    prediction : np.ndarray
+        A 3D array of bools or ints (0 and 1) representing the predicted
+        mask.
+    truth : np.ndarray
+        A 3D array of bools or ints (0 and 1) representing the ground truth
+        mask.
+    zoom : tuple
+        The length of each voxel dimension in millimeters.
+    axis : int, default 2
+        The axis to slice along.
+    percentile : int, default 95
+        The percentile of surface distances to define as the Hausdorff
+        distance.
+    symmetric : bool, default True
+        Whether to calculate the symmetric mean surface distance.
+
+    Returns
+    -------
+    metrics : dict
+        ``slice`` holds the index of each non-empty slice, the remaining keys
+        are the same as ``SegmentationMetrics.get_dict`` with an array
+        holding the score of each of those slices. Volumes are the area of
+        the slice in square millimeters divided by 1000, as for 2D masks in
+        SegmentationMetrics.
+    """
+    return _slice_metrics(_as_bool_mask(prediction), _as_bool_mask(truth),
+                          zoom, axis, percentile, symmetric)
+
+
+def _slice_metrics(prediction, truth, zoom, axis, percentile, symmetric):
+    """slice_metrics for masks that have already been thresholded."""
+    if prediction.ndim != 3 or truth.shape != prediction.shape:
+        raise ValueError('Slice metrics need a pair of 3D masks of the same '
+                         'shape, not {} and {}.'.format(prediction.shape,
+                                                        truth.shape))
+    axis = axis % 3
+    prediction = np.moveaxis(prediction, axis, 0)
+    truth = np.moveaxis(truth, axis, 0)
+    in_plane_zoom = tuple(z for i, z in enumerate(zoom) if i != axis)
+    slices = np.flatnonzero(np.any(prediction, axis=(1, 2)) |
+                            np.any(truth, axis=(1, 2)))
+    metrics = {'slice': slices}
+    metrics.update(_batch_metrics(prediction[slices], truth[slices],
+                                  in_plane_zoom, percentile, symmetric))
+    return metrics
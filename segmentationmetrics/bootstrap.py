@@ -0,0 +1,182 @@
+import numpy as np
+import pandas as pd
+
+from .metrics import (_dice, _jaccard, _sensitivity, _specificity,
+                      _precision, _accuracy)
+
+_POOLED_METRICS = {'dice': _dice, 'jaccard': _jaccard,
+                   'sensitivity': _sensitivity, 'specificity': _specificity,
+                   'precision': _precision, 'accuracy': _accuracy}
+# The resamples are drawn in chunks with at most this many case weights
+_CHUNK_SIZE = 2 ** 22
+
+
+def bootstrap_ci(metrics, n_resamples=10000, confidence=0.95, seed=None):
+    """
+    Bootstrap confidence intervals of the mean of per case metrics.
+
+    All resamples are drawn at once as a matrix of how many times each case
+    is picked, and the means of every metric and resample come from a single
+    matrix product, rather than resampling the cases in a Python loop.
+
+    Parameters
+    ----------
+    metrics : pd.DataFrame, dict or np.ndarray
+        The metrics of each case, one column (or key) per metric e.g. a
+        DataFrame built from the ``get_dict`` of each case. A 1D array is a
+        single metric.
+    n_resamples : int, default 10000
+        The number of bootstrap resamples.
+    confidence : float, default 0.95
+        The confidence level of the (percentile) intervals.
+    seed : int or np.random.Generator, optional
+        Seeds the resampling, so the intervals can be reproduced.
+
+    Returns
+    -------
+    ci : pd.DataFrame
+        The ``Estimate`` (mean over all cases), ``Lower`` and ``Upper``
+        bounds of each metric, indexed by metric.
+    """
+    values, names = _as_columns(metrics)
+    means = _resample_sums(values, n_resamples, seed) / len(values)
+    return _intervals(names, values.mean(axis=0), means, confidence)
+
+
+def bootstrap_pooled_ci(counts, n_resamples=10000, confidence=0.95,
+                        seed=None):
+    """
+    Bootstrap confidence intervals of pooled (micro-averaged) overlap
+    metrics, resampling cases and summing their confusion counts.
+
+    Parameters
+    ----------
+    counts : pd.DataFrame or dict
+        The number of true positive (``tp``), false positive (``fp``), false
+        negative (``fn``) and true negative (``tn``) voxels of each case,
+        e.g. from ``confusion_counts``.
+    n_resamples : int, default 10000
+        The number of bootstrap resamples.
+    confidence : float, default 0.95
+        The confidence level of the (percentile) intervals.
+    seed : int or np.random.Generator, optional
+        Seeds the resampling, so the intervals can be reproduced.
+
+    Returns
+    -------
+    ci : pd.DataFrame
+        The ``Estimate`` (from the counts of all cases), ``Lower`` and
+        ``Upper`` bounds of the pooled Dice, Jaccard, sensitivity,
+        specificity, precision and accuracy, indexed by metric.
+    """
+    values = np.column_stack([np.asarray(counts[key], np.float64)
+                              for key in ('tp', 'fp', 'fn', 'tn')])
+    sums = _resample_sums(values, n_resamples, seed)
+
+    def pooled(totals):
+        tp, fp, fn, tn = np.moveaxis(totals, -1, 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.stack([metric(tp, fp, fn, tn)
+                             for metric in _POOLED_METRICS.values()], -1)
+
+    return _intervals(list(_POOLED_METRICS), pooled(values.sum(axis=0)),
+                      pooled(sums), confidence)
+
+
+def bootstrap_paired_ci(metrics_a, metrics_b, n_resamples=10000,
+                        confidence=0.95, seed=None):
+    """
+    Bootstrap confidence intervals of the difference in mean metrics between
+    two models evaluated on the same cases.
+
+    Each resample picks the same cases for both models, so the intervals
+    account for the pairing.
+
+    Parameters
+    ----------
+    metrics_a : pd.DataFrame, dict or np.ndarray
+        The metrics of each case for the first model, as in
+        ``bootstrap_ci``.
+    metrics_b : pd.DataFrame, dict or np.ndarray
+        The metrics of the same cases, in the same order, for the second
+        model.
+    n_resamples : int, default 10000
+        The number of bootstrap resamples.
+    confidence : float, default 0.95
+        The confidence level of the (percentile) intervals.
+    seed : int or np.random.Generator, optional
+        Seeds the resampling, so the intervals can be reproduced.
+
+    Returns
+    -------
+    ci : pd.DataFrame
+        The ``Estimate`` (mean of the first model minus mean of the second),
+        ``Lower`` and ``Upper`` bounds of each metric and the two-sided
+        bootstrap ``P-value`` of there being no difference, indexed by
+        metric.
+    """
+    values_a, names = _as_columns(metrics_a)
+    values_b, names_b = _as_columns(metrics_b)
+    if values_a.shape != values_b.shape or names != names_b:
+        raise ValueError('Both models must have the same metrics of the same '
+                         'number of cases, not {} and {}.'.format(
+                             dict(zip(names, values_a.shape)),
+                             dict(zip(names_b, values_b.shape))))
+    differences = values_a - values_b
+    means = _resample_sums(differences, n_resamples, seed) / len(differences)
+    ci = _intervals(names, differences.mean(axis=0), means, confidence)
+    tail = np.minimum(np.mean(means <= 0, axis=0), np.mean(means >= 0, axis=0))
+    ci['P-value'] = np.minimum(2 * tail, 1)
+    return ci
+
+
+def _as_columns(metrics):
+    """A (cases, metrics) float array and the names of the metrics."""
+    if isinstance(metrics, pd.DataFrame):
+        return metrics.to_numpy(np.float64), list(metrics.columns)
+    if isinstance(metrics, dict):
+        return (np.column_stack([np.asarray(metrics[name], np.float64)
+                                 for name in metrics]), list(metrics))
+    values = np.asarray(metrics, np.float64)
+    if values.ndim == 1:
+        return values[:, np.newaxis], ['metric']
+    if values.ndim != 2:
+        raise ValueError('The metrics should be one column per metric, not '
+                         'an array of shape {}.'.format(values.shape))
+    return values, ['metric_{}'.format(i) for i in range(values.shape[1])]
+
+
+def _resample_sums(values, n_resamples, seed):
+    """
+    The sum of ``values`` over the cases of each bootstrap resample, an
+    (n_resamples, metrics) array.
+    """
+    n_cases = len(values)
+    if n_cases == 0:
+        raise ValueError('At least one case is needed to bootstrap.')
+    if n_resamples < 1:
+        raise ValueError('n_resamples must be at least 1, not '
+                         '{}.'.format(n_resamples))
+    rng = np.random.default_rng(seed)
+    chunk = max(_CHUNK_SIZE // n_cases, 1)
+    sums = np.empty((n_resamples, values.shape[1]))
+    for start in range(0, n_resamples, chunk):
+        stop = min(start + chunk, n_resamples)
+        # The cases picked by each resample, turned into how many times each
+        # case is picked so every sum is one matrix product
+        picks = rng.integers(0, n_cases, (stop - start, n_cases))
+        picks += np.arange(stop - start)[:, np.newaxis] * n_cases
+        weights = np.bincount(picks.ravel(),
+                              minlength=(stop - start) * n_cases)
+        sums[start:stop] = weights.reshape(stop - start, n_cases) @ values
+    return sums
+
+
+def _intervals(names, estimate, resampled, confidence):
+    if not 0 < confidence < 1:
+        raise ValueError('confidence must be between 0 and 1, not '
+                         '{}.'.format(confidence))
+    alpha = (1 - confidence) / 2
+    lower, upper = np.quantile(resampled, [alpha, 1 - alpha], axis=0)
+    return pd.DataFrame({'Estimate': estimate, 'Lower': lower,
+                         'Upper': upper}, index=names)
@@ -0,0 +1,333 @@
+import numpy as np
+import pandas as pd
+
+from . import surface_distance as sd
+from .metrics import (confusion_counts, _threshold_to_bounding_box, _dice,
+                      _jaccard, _sensitivity, _specificity, _precision,
+                      _accuracy)
+from .surface_distance.metrics import _histogram_bin_index
+
+
+class _DistanceHistogram:
+    """
+    Area weighted histogram of surface distances in one direction e.g. from
+    the ground truth surface to the predicted surface.
+
+    Bin ``i`` holds the surfel area with distances in
+    ``((i - 1) * bin_width, i * bin_width]`` so bin 0 only holds surfels
+    that lie exactly on the other surface. Surfels with an infinite distance
+    (i.e. the other surface is empty) are kept separately.
+    """
+    def __init__(self, bin_width):
+        self.bin_width = bin_width
+        self.areas = np.zeros(0)
+        self.inf_area = np.float64(0)
+        self.total_area = np.float64(0)
+        self.weighted_sum = np.float64(0)
+        self.max_distance = -np.inf
+
+    def add(self, distances, surfel_areas):
+        distances = np.asarray(distances, dtype=np.float64)
+        surfel_areas = np.asarray(surfel_areas, dtype=np.float64)
+        if distances.size == 0:
+            return
+        finite = np.isfinite(distances)
+        self.inf_area += np.sum(surfel_areas[~finite])
+        self.total_area += np.sum(surfel_areas)
+        self.weighted_sum += np.sum(distances * surfel_areas)
+        self.max_distance = max(self.max_distance, np.max(distances))
+        if finite.any():
+            idx = _histogram_bin_index(distances[finite], self.bin_width,
+                                       relative_resolution=None)
+            self._add_bins(np.bincount(idx, weights=surfel_areas[finite]))
+
+    def add_histogram(self, areas, total_area, weighted_sum, max_distance):
+        self._add_bins(areas)
+        if np.isinf(max_distance):
+            self.inf_area += total_area - np.sum(areas)
+        self.total_area += total_area
+        self.weighted_sum += weighted_sum
+        self.max_distance = max(self.max_distance, max_distance)
+
+    def merge(self, other):
+        self._add_bins(other.areas)
+        self.inf_area += other.inf_area
+        self.total_area += other.total_area
+        self.weighted_sum += other.weighted_sum
+        self.max_distance = max(self.max_distance, other.max_distance)
+
+    def mean(self):
+        return self.weighted_sum / self.total_area
+
+    def percentile(self, percent):
+        if self.total_area == 0:
+            return np.inf
+        cum_areas = np.cumsum(np.append(self.areas, self.inf_area)) / \
+            self.total_area
+        idx = np.searchsorted(cum_areas, percent / 100.0)
+        if idx >= len(self.areas):
+            # Either the percentile falls among the infinite distances or
+            # rounding stopped the cumulative sum just short of 1.
+            return self.max_distance
+        return min(idx * self.bin_width, self.max_distance)
+
+    def _add_bins(self, areas):
+        if len(areas) > len(self.areas):
+            self.areas = np.pad(self.areas, (0, len(areas) - len(self.areas)))
+        self.areas[:len(areas)] += areas
+
+
+class CohortMetrics:
+    """
+    Accumulates micro-averaged (pooled) segmentation accuracy metrics over a
+    cohort of cases.
+
+    Rather than averaging per case metrics (macro-averaging), the confusion
+    counts are summed over all cases and the surface distances of every case
+    are merged into area weighted distance histograms. Pooled metrics are
+    then calculated without storing or re-reading any of the volumes.
+    Accumulators built in separate processes can be combined with ``merge``
+    or ``+``.
+
+    Attributes
+    ----------
+    bin_width : float
+        The width of the surface distance histogram bins in millimeters. This
+        is the resolution of the pooled Hausdorff distance, the pooled mean
+        surface distance is exact.
+    n_cases : int
+        The number of cases added to the accumulator.
+    counts : dict
+        The pooled number of true positive (``tp``), false positive (``fp``),
+        false negative (``fn``) and true negative (``tn``) voxels.
+    """
+    def __init__(self, bin_width=0.1):
+        """
+        Initialises an empty CohortMetrics accumulator.
+
+        Parameters
+        ----------
+        bin_width : float, default 0.1
+            The width of the surface distance histogram bins in millimeters.
+        """
+        if bin_width <= 0:
+            raise ValueError('bin_width must be positive, not '
+                             '{}'.format(bin_width))
+        self.bin_width = bin_width
+        self.n_cases = 0
+        self.counts = {'tp': np.int64(0), 'fp': np.int64(0),
+                       'fn': np.int64(0), 'tn': np.int64(0)}
+        self._hist_gt_to_pred = _DistanceHistogram(bin_width)
+        self._hist_pred_to_gt = _DistanceHistogram(bin_width)
+
+    def add(self, prediction, truth, zoom):
+        """
+        Add a case to the accumulator.
+
+        Parameters
+        ----------
+        prediction : np.ndarray
+            An array of bools or ints (0 and 1) representing the predicted
+            mask.
+        truth : np.ndarray
+            An array of bools or ints (0 and 1) representing the ground truth
+            mask.
+        zoom : tuple
+            The length of each voxel dimension in millimeters.
+        """
+        size = np.size(truth)
+        prediction, truth = _threshold_to_bounding_box(prediction, truth)
+        self.add_counts(**confusion_counts(prediction, truth, size=size))
+        self.add_surface_distances(
+            sd.compute_surface_distances(prediction, truth, zoom))
+        self.n_cases += 1
+
+    def add_counts(self, tp, fp, fn, tn):
+        """
+        Add the confusion counts of a case without its surface distances.
+
+        Parameters
+        ----------
+        tp, fp, fn, tn : int
+            The number of true positive, false positive, false negative and
+            true negative voxels.
+        """
+        for key, value in zip(('tp', 'fp', 'fn', 'tn'), (tp, fp, fn, tn)):
+            self.counts[key] += np.int64(value)
+
+    def add_surface_distances(self, surface_distances):
+        """
+        Add the surface distances of a case without its confusion counts.
+
+        Parameters
+        ----------
+        surface_distances : dict
+            The output of ``surface_distance.compute_surface_distances``
+            with the predicted mask passed as ``mask_gt`` and the true mask
+            passed as ``mask_pred``, as in SegmentationMetrics. Or its
+            compact form from ``surface_distance.compact_surface_distances``
+            with fixed bins of ``bin_width``.
+        """
+        if 'histogram_gt_to_pred' not in surface_distances:
+            self._hist_gt_to_pred.add(
+                surface_distances['distances_gt_to_pred'],
+                surface_distances['surfel_areas_gt'])
+            self._hist_pred_to_gt.add(
+                surface_distances['distances_pred_to_gt'],
+                surface_distances['surfel_areas_pred'])
+            return
+        if surface_distances['bin_width_mm'] != self.bin_width or \
+                surface_distances['relative_resolution'] is not None:
+            raise ValueError('Compact surface distances must have fixed bins '
+                             'of the accumulator\'s bin width ({}).'.format(
+                                 self.bin_width))
+        for hist, side, direction in (
+                (self._hist_gt_to_pred, 'gt', 'gt_to_pred'),
+                (self._hist_pred_to_gt, 'pred', 'pred_to_gt')):
+            hist.add_histogram(surface_distances['histogram_' + direction],
+                               surface_distances['surface_area_' + side],
+                               surface_distances['distance_sum_' + direction],
+                               surface_distances['max_distance_' + direction])
+
+    def merge(self, other):
+        """
+        Merge another accumulator into this one.
+
+        Parameters
+        ----------
+        other : CohortMetrics
+            An accumulator with the same ``bin_width``.
+
+        Returns
+        -------
+        self : CohortMetrics
+            This accumulator, updated in place.
+        """
+        if other.bin_width != self.bin_width:
+            raise ValueError('Cannot merge accumulators with different bin '
+                             'widths ({} and {}).'.format(self.bin_width,
+                                                          other.bin_width))
+        self.add_counts(**other.counts)
+        self._hist_gt_to_pred.merge(other._hist_gt_to_pred)
+        self._hist_pred_to_gt.merge(other._hist_pred_to_gt)
+        self.n_cases += other.n_cases
+        return self
+
+    def __add__(self, other):
+        return CohortMetrics(self.bin_width).merge(self).merge(other)
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    @property
+    def dice(self):
+        return _dice(**self.counts)
+
+    @property
+    def jaccard(self):
+        return _jaccard(**self.counts)
+
+    @property
+    def sensitivity(self):
+        return _sensitivity(**self.counts)
+
+    @property
+    def specificity(self):
+        return _specificity(**self.counts)
+
+    @property
+    def precision(self):
+        return _precision(**self.counts)
+
+    @property
+    def accuracy(self):
+        return _accuracy(**self.counts)
+
+    def mean_surface_distance(self, symmetric=True):
+        """
+        The pooled mean surface distance.
+
+        Parameters
+        ----------
+        symmetric : bool, default True
+            If true, the average of the two directional pooled mean surface
+            distances is returned, otherwise a tuple of both.
+
+        Returns
+        -------
+        msd : float or tuple
+            The pooled mean surface distance in millimeters.
+        """
+        msd = (self._hist_gt_to_pred.mean(), self._hist_pred_to_gt.mean())
+        if symmetric:
+            return np.mean(msd)
+        return msd
+
+    def hausdorff_distance(self, percentile=95):
+        """
+        The pooled robust Hausdorff distance.
+
+        The result is the upper edge of the histogram bin containing the
+        percentile, so it overestimates the exact value by less than
+        ``bin_width``. The 100th percentile is exact.
+
+        Parameters
+        ----------
+        percentile : int, default 95
+            The percentile of surface distances to define as the Hausdorff
+            distance.
+
+        Returns
+        -------
+        hd : float
+            The pooled Hausdorff distance in millimeters.
+        """
+        return max(self._hist_gt_to_pred.percentile(percentile),
+                   self._hist_pred_to_gt.percentile(percentile))
+
+    def get_dict(self, percentile=95, symmetric=True):
+        """
+        Generate a dictionary of pooled segmentation accuracy metrics.
+
+        Parameters
+        ----------
+        percentile : int, default 95
+            The percentile of surface distances to define as the Hausdorff
+            distance.
+        symmetric : bool, default True
+            Whether to return the symmetric mean surface distance.
+
+        Returns
+        -------
+        metrics : dict
+            Pooled segmentation accuracy.
+        """
+        return {'dice': self.dice,
+                'jaccard': self.jaccard,
+                'sensitivity': self.sensitivity,
+                'specificity': self.specificity,
+                'precision': self.precision,
+                'accuracy': self.accuracy,
+                'mean_surface_distance': self.mean_surface_distance(
+                    symmetric),
+                'hausdorff_distance': self.hausdorff_distance(percentile),
+                'n_cases': self.n_cases}
+
+    def get_df(self, percentile=95, symmetric=True):
+        """
+        Generate a Pandas DataFrame containing the pooled segmentation
+        accuracy metrics.
+
+        Returns
+        -------
+        df : pd.DataFrame
+            DataFrame with metric in one column and score in the next column.
+        """
+        df = pd.DataFrame.from_dict(self.get_dict(percentile, symmetric),
+                                    orient='index',
+                                    columns=['Score'])
+        df['Metric'] = ['Dice', 'Jaccard', 'Sensitivity', 'Specificity',
+                        'Precision', 'Accuracy', 'Mean Surface Distance',
+                        'Hausdorff Distance', 'Number of Cases']
+        df = df[['Metric', 'Score']]
+        return df
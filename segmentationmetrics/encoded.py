@@ -0,0 +1,432 @@
+import numpy as np
+
+from . import surface_distance as sd
+from .surface_distance.metrics import (_check_masks,
+                                       _clustered_surface_distances,
+                                       _coarse_cluster_boxes)
+
+
+class EncodedMask:
+    """
+    Base class for binary masks stored in a compressed encoding rather than
+    as a dense array.
+
+    Subclasses only need to implement ``count``, ``bounding_box`` and
+    ``crop``, all of which should cost in proportion to the foreground
+    rather than the size of the canvas.
+
+    Attributes
+    ----------
+    shape : tuple
+        The shape of the dense mask the encoding represents.
+    """
+    shape = ()
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def count(self):
+        """
+        Returns
+        -------
+        count : int
+            The number of foreground voxels.
+        """
+        raise NotImplementedError
+
+    def bounding_box(self):
+        """
+        Returns
+        -------
+        bbox_min, bbox_max : np.ndarray or None
+            The smallest and greatest foreground coordinates on each axis or
+            ``None, None`` if the mask is empty.
+        """
+        raise NotImplementedError
+
+    def crop(self, bbox_min, bbox_max):
+        """
+        Decode the region of the mask between ``bbox_min`` and ``bbox_max``
+        (inclusive).
+
+        Returns
+        -------
+        crop : np.ndarray
+            A dense array of bools.
+        """
+        raise NotImplementedError
+
+    def argwhere(self):
+        """
+        The general case decodes the bounding box, subclasses override this
+        with methods that only expand the foreground.
+
+        Returns
+        -------
+        coordinates : np.ndarray
+            An (N, ndim) array of the foreground voxel coordinates.
+        """
+        bbox_min, bbox_max = self.bounding_box()
+        if bbox_min is None:
+            return np.zeros((0, self.ndim), np.int64)
+        return np.argwhere(self.crop(bbox_min, bbox_max)) + bbox_min
+
+    def intersection_count(self, other):
+        """
+        The number of voxels that are foreground in both masks.
+
+        The general case decodes both masks within the bounding box of their
+        union, subclasses override this with cheaper methods for pairs of the
+        same encoding.
+
+        Parameters
+        ----------
+        other : EncodedMask
+            A mask with the same shape.
+
+        Returns
+        -------
+        count : int
+            The number of voxels in the intersection.
+        """
+        bbox_min, bbox_max = union_bounding_box(self, other)
+        if bbox_min is None:
+            return 0
+        return np.count_nonzero(self.crop(bbox_min, bbox_max) &
+                                other.crop(bbox_min, bbox_max))
+
+    def to_dense(self):
+        """
+        Returns
+        -------
+        mask : np.ndarray
+            The full mask as a dense array of bools.
+        """
+        mask = np.zeros(self.shape, bool)
+        bbox_min, bbox_max = self.bounding_box()
+        if bbox_min is not None:
+            mask[_bbox_slices(bbox_min, bbox_max)] = self.crop(bbox_min,
+                                                               bbox_max)
+        return mask
+
+
+class RunLengthMask(EncodedMask):
+    """
+    A 2D binary mask stored as a COCO-style run-length encoding.
+
+    Runs are counted in column-major (Fortran) order, alternating between
+    background and foreground and starting with a (possibly zero length)
+    background run.
+    """
+    def __init__(self, counts, size):
+        """
+        Parameters
+        ----------
+        counts : list or str or bytes
+            The run lengths, either as a list of ints or as the compressed
+            string used by the COCO API.
+        size : tuple
+            The height and width of the mask.
+        """
+        if isinstance(counts, (str, bytes)):
+            counts = _decode_coco_string(counts)
+        counts = np.asarray(counts, dtype=np.int64)
+        self.shape = tuple(int(s) for s in size)
+        if len(self.shape) != 2:
+            raise ValueError('Run-length encoded masks must be 2D, not '
+                             '{}D.'.format(len(self.shape)))
+        if counts.sum() != self.size:
+            raise ValueError('The run lengths sum to {} but the mask has {} '
+                             'pixels.'.format(counts.sum(), self.size))
+        boundaries = np.cumsum(counts)
+        starts = boundaries[0::2][:len(counts) // 2]
+        ends = boundaries[1::2]
+        keep = ends > starts
+        self.starts = starts[keep]
+        self.ends = ends[keep]
+
+    @classmethod
+    def from_coco(cls, rle):
+        """
+        Create a mask from a COCO RLE dict with ``size`` and ``counts`` keys.
+        """
+        return cls(rle['counts'], rle['size'])
+
+    @classmethod
+    def from_dense(cls, mask):
+        """
+        Run-length encode a dense 2D mask.
+        """
+        flat = np.asarray(mask, dtype=bool).ravel(order='F')
+        changes = np.flatnonzero(np.diff(flat.astype(np.int8))) + 1
+        boundaries = np.concatenate([[0], changes, [flat.size]])
+        counts = np.diff(boundaries)
+        if flat.size and flat[0]:
+            counts = np.concatenate([[0], counts])
+        return cls(counts, mask.shape)
+
+    def count(self):
+        return int(np.sum(self.ends - self.starts))
+
+    def bounding_box(self):
+        if len(self.starts) == 0:
+            return None, None
+        height = self.shape[0]
+        first_col = self.starts // height
+        last_col = (self.ends - 1) // height
+        # Runs that wrap onto the next column reach both the top and the
+        # bottom row.
+        wraps = first_col != last_col
+        row_min = np.where(wraps, 0, self.starts % height)
+        row_max = np.where(wraps, height - 1, (self.ends - 1) % height)
+        return (np.array([row_min.min(), first_col[0]], np.int64),
+                np.array([row_max.max(), last_col[-1]], np.int64))
+
+    def crop(self, bbox_min, bbox_max):
+        height = self.shape[0]
+        lo = bbox_min[1] * height
+        hi = (bbox_max[1] + 1) * height
+        first = np.searchsorted(self.ends, lo, side='right')
+        last = np.searchsorted(self.starts, hi, side='left')
+        starts = np.maximum(self.starts[first:last], lo)
+        ends = np.minimum(self.ends[first:last], hi)
+        idx = _expand_runs(starts, ends)
+        rows, cols = idx % height, idx // height
+        inside = (rows >= bbox_min[0]) & (rows <= bbox_max[0])
+        crop = np.zeros(np.asarray(bbox_max) - bbox_min + 1, bool)
+        crop[rows[inside] - bbox_min[0], cols[inside] - bbox_min[1]] = True
+        return crop
+
+    def argwhere(self):
+        idx = _expand_runs(self.starts, self.ends)
+        height = self.shape[0]
+        return np.stack([idx % height, idx // height], axis=-1)
+
+    def intersection_count(self, other):
+        if not isinstance(other, RunLengthMask):
+            return super().intersection_count(other)
+        # For each of our runs find the range of the other mask's runs it
+        # overlaps, then sum the lengths of the pairwise intersections.
+        first = np.searchsorted(other.ends, self.starts, side='right')
+        last = np.searchsorted(other.starts, self.ends, side='left')
+        n_pairs = last - first
+        if n_pairs.sum() == 0:
+            return 0
+        idx_self = np.repeat(np.arange(len(self.starts)), n_pairs)
+        idx_other = _expand_runs(first, last)
+        overlap = (np.minimum(self.ends[idx_self], other.ends[idx_other]) -
+                   np.maximum(self.starts[idx_self],
+                              other.starts[idx_other]))
+        return int(np.sum(overlap))
+
+
+class CoordinateMask(EncodedMask):
+    """
+    A binary mask of any dimension stored as a list of foreground voxel
+    coordinates.
+    """
+    def __init__(self, coordinates, shape):
+        """
+        Parameters
+        ----------
+        coordinates : np.ndarray
+            An (N, ndim) array of integer foreground voxel coordinates.
+            Duplicate coordinates are ignored.
+        shape : tuple
+            The shape of the mask.
+        """
+        self.shape = tuple(int(s) for s in shape)
+        coordinates = np.asarray(coordinates, dtype=np.int64).reshape(
+            -1, len(self.shape))
+        # Keep the coordinates sorted and unique via their flat index
+        self.indices = np.unique(np.ravel_multi_index(coordinates.T,
+                                                      self.shape))
+        self.coordinates = np.stack(np.unravel_index(self.indices,
+                                                     self.shape), axis=-1)
+
+    @classmethod
+    def from_dense(cls, mask):
+        """
+        Create a coordinate list from a dense mask.
+        """
+        return cls(np.argwhere(mask), mask.shape)
+
+    def count(self):
+        return len(self.indices)
+
+    def bounding_box(self):
+        if len(self.indices) == 0:
+            return None, None
+        return self.coordinates.min(axis=0), self.coordinates.max(axis=0)
+
+    def crop(self, bbox_min, bbox_max):
+        inside = np.all((self.coordinates >= bbox_min) &
+                        (self.coordinates <= bbox_max), axis=1)
+        crop = np.zeros(np.asarray(bbox_max) - bbox_min + 1, bool)
+        crop[tuple((self.coordinates[inside] - bbox_min).T)] = True
+        return crop
+
+    def argwhere(self):
+        return self.coordinates
+
+    def intersection_count(self, other):
+        if not isinstance(other, CoordinateMask):
+            return super().intersection_count(other)
+        return len(np.intersect1d(self.indices, other.indices,
+                                  assume_unique=True))
+
+
+def as_encoded(mask):
+    """
+    Return ``mask`` unchanged if it is an EncodedMask, otherwise threshold a
+    dense array and store it as a CoordinateMask.
+    """
+    if isinstance(mask, EncodedMask):
+        return mask
+    return CoordinateMask.from_dense(np.asarray(mask) > 0.5)
+
+
+def union_bounding_box(mask_a, mask_b):
+    """
+    The bounding box containing the foreground of both encoded masks, or
+    ``None, None`` if both are empty.
+    """
+    boxes = [box for box in (mask_a.bounding_box(), mask_b.bounding_box())
+             if box[0] is not None]
+    if not boxes:
+        return None, None
+    return (np.min([box[0] for box in boxes], axis=0),
+            np.max([box[1] for box in boxes], axis=0))
+
+
+def encoded_confusion_counts(prediction, truth):
+    """
+    Count the true/false positive/negative voxels of a pair of encoded masks.
+
+    Parameters
+    ----------
+    prediction : EncodedMask
+        The predicted mask.
+    truth : EncodedMask
+        The ground truth mask, the same shape as ``prediction``.
+
+    Returns
+    -------
+    counts : dict
+        The number of true positive (``tp``), false positive (``fp``),
+        false negative (``fn``) and true negative (``tn``) voxels.
+    """
+    _check_shapes(prediction, truth)
+    tp = np.int64(prediction.intersection_count(truth))
+    fp = np.int64(prediction.count()) - tp
+    fn = np.int64(truth.count()) - tp
+    tn = np.int64(truth.size) - tp - fp - fn
+    return {'tp': tp, 'fp': fp, 'fn': fn, 'tn': tn}
+
+
+def encoded_surface_distances(mask_gt, mask_pred, spacing_mm, factor=4):
+    """
+    Computes the surface distances of a pair of encoded masks.
+
+    The foreground is split into clusters of nearby components, as in
+    ``surface_distance.compute_surface_distances_clustered``, and only the
+    bounding box of each cluster is decoded. The clusters are found on a
+    grid of bools downsampled by ``factor`` over the bounding box of the
+    union of the masks, from the foreground coordinates, so widely separated
+    parts (e.g. lesions at opposite corners of the scan) don't decode the
+    space between them. The result is the same as calling
+    ``surface_distance.compute_surface_distances`` on the dense masks.
+
+    Parameters
+    ----------
+    mask_gt : EncodedMask
+        The ground truth mask.
+    mask_pred : EncodedMask
+        The predicted mask.
+    spacing_mm : tuple
+        The length of each voxel dimension in millimeters.
+    factor : int or tuple, default 4
+        The downsampling factor of the grid the clusters are found on, for
+        all axes or for each axis.
+
+    Returns
+    -------
+    surface_distances : dict
+        As returned by ``surface_distance.compute_surface_distances``.
+    """
+    _check_shapes(mask_gt, mask_pred)
+    bbox_min, bbox_max = union_bounding_box(mask_gt, mask_pred)
+    if bbox_min is None:
+        # Defer to the dense code for the empty result, a single voxel is
+        # enough.
+        empty = np.zeros((1,) * mask_gt.ndim, bool)
+        return sd.compute_surface_distances(empty, empty, spacing_mm)
+    factor = np.broadcast_to(np.asarray(factor, np.int64), (mask_gt.ndim,))
+    if np.any(factor < 1):
+        raise ValueError('The downsampling factor must be at least 1, not '
+                         '{}.'.format(factor))
+    coarse = np.zeros((bbox_max - bbox_min) // factor + 1, bool)
+    for mask in (mask_gt, mask_pred):
+        coarse[tuple(((mask.argwhere() - bbox_min) // factor).T)] = True
+    boxes = _coarse_cluster_boxes(coarse, factor, bbox_max - bbox_min + 1)
+
+    def crops():
+        for box in boxes:
+            lo = bbox_min + [b.start for b in box]
+            hi = bbox_min + [b.stop - 1 for b in box]
+            crop_gt, crop_pred = mask_gt.crop(lo, hi), mask_pred.crop(lo, hi)
+            _check_masks(crop_gt, crop_pred, spacing_mm)
+            yield _bbox_slices(lo, hi), crop_gt, crop_pred
+
+    return _clustered_surface_distances(crops(),
+                                        np.asarray(spacing_mm, np.float64))
+
+
+def _check_shapes(mask_a, mask_b):
+    if mask_a.shape != mask_b.shape:
+        raise ValueError('The masks must be the same shape, not {} and '
+                         '{}.'.format(mask_a.shape, mask_b.shape))
+
+
+def _bbox_slices(bbox_min, bbox_max):
+    return tuple(slice(lo, hi + 1) for lo, hi in zip(bbox_min, bbox_max))
+
+
+def _expand_runs(starts, ends):
+    """Concatenate ``np.arange(start, end)`` for every run."""
+    lengths = ends - starts
+    total = int(np.sum(lengths))
+    if total == 0:
+        return np.zeros(0, np.int64)
+    offsets = np.cumsum(lengths) - lengths
+    return (np.arange(total, dtype=np.int64) -
+            np.repeat(offsets - starts, lengths))
+
+
+def _decode_coco_string(counts):
+    """Decode the compressed run lengths used by the COCO API."""
+    if isinstance(counts, bytes):
+        counts = counts.decode('ascii')
+    runs = []
+    p = 0
+    while p < len(counts):
+        x = 0
+        k = 0
+        more = True
+        while more:
+            c = ord(counts[p]) - 48
+            x |= (c & 0x1f) << (5 * k)
+            more = bool(c & 0x20)
+            p += 1
+            k += 1
+            if not more and c & 0x10:
+                x |= -1 << (5 * k)
+        if len(runs) > 2:
+            x += runs[-2]
+        runs.append(x)
+    return runs
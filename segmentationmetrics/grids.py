@@ -0,0 +1,273 @@
+import numpy as np
+import pandas as pd
+from scipy import spatial
+
+from . import surface_distance as sd
+from .metrics import (_as_bool_mask, _dice, _jaccard, _sensitivity,
+                      _specificity, _precision, _accuracy, _DEFAULT_METRICS)
+from .registry import metric_label
+from .surface_distance.metrics import (_compute_borders,
+                                       _compute_bounding_box,
+                                       _crop_to_bounding_box,
+                                       _get_surface_lookup,
+                                       _sort_distances_surfels)
+
+# The number of voxels of the truth grid sampled at once
+_CHUNK_SIZE = 2 ** 22
+
+
+class CrossGridMetrics:
+    """
+    Segmentation accuracy metrics of a predicted and a ground truth mask on
+    different voxel grids, e.g. a prediction made at 1.5 mm isotropic and a
+    ground truth at its native 0.7 x 0.7 x 3 mm, without resampling either
+    volume.
+
+    The surface elements of each mask are found on its own grid and placed
+    in world coordinates (mm), and the distances between the surfaces come
+    from a KD-tree, so the surface distances are those of the native masks.
+    The volumes are measured on each native grid too. Only the overlap
+    metrics need both masks on one grid: the prediction is sampled (nearest
+    neighbour) at the centres of the ground truth voxels within the bounding
+    box of both masks, any prediction outside the ground truth volume is not
+    counted.
+
+    With the same grid for both masks, the results are those of
+    SegmentationMetrics.
+
+    Attributes
+    ----------
+    dice, jaccard, sensitivity, specificity, precision, accuracy : float
+        The overlap metrics, on the ground truth grid.
+    mean_surface_distance : float or tuple
+        The mean surface distance, defaults to symmetric.
+    hausdorff_distance : float
+        The robust Hausdorff distance, defaults to 95th percentile.
+    true_volume, predicted_volume : float
+        The volume of each mask (in milliliters) on its own grid.
+    volume_difference : float
+        The predicted volume minus the true volume (in milliliters).
+    counts : dict
+        The number of true positive (``tp``), false positive (``fp``), false
+        negative (``fn``) and true negative (``tn``) ground truth voxels.
+    """
+    def __init__(self, prediction, truth, prediction_zoom=None,
+                 truth_zoom=None, prediction_affine=None, truth_affine=None,
+                 percentile=95, symmetric=True):
+        """
+        Initialises the CrossGridMetrics class instance.
+
+        Parameters
+        ----------
+        prediction : np.ndarray
+            An array of bools or ints (0 and 1) representing the predicted
+            mask.
+        truth : np.ndarray
+            An array of bools or ints (0 and 1) representing the ground truth
+            mask.
+        prediction_zoom : tuple, optional
+            The length of each voxel dimension of the predicted mask in
+            millimeters. Not needed if ``prediction_affine`` is given.
+        truth_zoom : tuple, optional
+            The length of each voxel dimension of the ground truth mask in
+            millimeters. Not needed if ``truth_affine`` is given.
+        prediction_affine : np.ndarray, optional
+            The (ndim + 1) x (ndim + 1) matrix taking the voxel indices of the
+            predicted mask to world coordinates in millimeters, e.g. from a
+            NIfTI header. The axes should be orthogonal. Defaults to the
+            grids sharing the corner of their first voxel, as when both masks
+            cover the same field of view.
+        truth_affine : np.ndarray, optional
+            The same for the ground truth mask.
+        percentile : int, default 95
+            The percentile of surface distances to define as the Hausdorff
+            distance.
+        symmetric : bool, default True
+            Whether to calculate the symmetric mean surface distance.
+        """
+        prediction, truth = _as_bool_mask(prediction), _as_bool_mask(truth)
+        if prediction.ndim != truth.ndim or prediction.ndim not in (2, 3):
+            raise ValueError('The masks must both be 2D or 3D, not {}D and '
+                             '{}D.'.format(prediction.ndim, truth.ndim))
+        self.prediction_affine, self.prediction_zoom = _grid(
+            prediction.ndim, prediction_zoom, prediction_affine)
+        self.truth_affine, self.truth_zoom = _grid(truth.ndim, truth_zoom,
+                                                   truth_affine)
+        self.percentile = percentile
+        self.symmetric = symmetric
+
+        self.counts = _resampled_counts(prediction, truth,
+                                        self.prediction_affine,
+                                        self.truth_affine)
+        for name, formula in (('dice', _dice), ('jaccard', _jaccard),
+                              ('sensitivity', _sensitivity),
+                              ('specificity', _specificity),
+                              ('precision', _precision),
+                              ('accuracy', _accuracy)):
+            setattr(self, name, formula(**self.counts))
+
+        # As compute_surface_distances(prediction, truth) in
+        # SegmentationMetrics
+        points, areas = {}, {}
+        for side, mask, affine, zoom in (
+                ('gt', prediction, self.prediction_affine,
+                 self.prediction_zoom),
+                ('pred', truth, self.truth_affine, self.truth_zoom)):
+            points[side], areas[side] = _world_surfels(mask, affine, zoom)
+        surface_distances = {}
+        for side, other, direction in (('gt', 'pred', 'gt_to_pred'),
+                                       ('pred', 'gt', 'pred_to_gt')):
+            if len(points[other]) == 0:
+                distances = np.full(len(points[side]), np.inf)
+            else:
+                tree = spatial.cKDTree(points[other], balanced_tree=False,
+                                       compact_nodes=False)
+                distances = tree.query(points[side], workers=-1)[0]
+            surface_distances['distances_' + direction], \
+                surface_distances['surfel_areas_' + side] = \
+                _sort_distances_surfels(distances, areas[side])
+        self.mean_surface_distance = sd.compute_average_surface_distance(
+            surface_distances)
+        if symmetric:
+            self.mean_surface_distance = np.mean(self.mean_surface_distance)
+        self.hausdorff_distance = sd.compute_robust_hausdorff(
+            surface_distances, percentile)
+
+        self.true_volume = np.count_nonzero(truth) * \
+            _voxel_volume(self.truth_affine) / 1000
+        self.predicted_volume = np.count_nonzero(prediction) * \
+            _voxel_volume(self.prediction_affine) / 1000
+        self.volume_difference = self.predicted_volume - self.true_volume
+
+    def get_dict(self):
+        """
+        Generate a dictionary of segmentation accuracy metrics.
+
+        Returns
+        -------
+        metrics : dict
+            Segmentation accuracy, the same keys as
+            ``SegmentationMetrics.get_dict``.
+        """
+        return {name: getattr(self, name) for name in _DEFAULT_METRICS}
+
+    def get_df(self):
+        """
+        Generate a Pandas DataFrame containing the segmentation accuracy
+        metrics.
+
+        Returns
+        -------
+        df : pd.DataFrame
+            DataFrame with metric in one column and score in the next column.
+        """
+        df = pd.DataFrame.from_dict(self.get_dict(),
+                                    orient='index',
+                                    columns=['Score'])
+        df['Metric'] = [metric_label(name) for name in _DEFAULT_METRICS]
+        df = df[['Metric', 'Score']]
+        return df
+
+
+def _grid(ndim, zoom, affine):
+    """The voxel to world affine of a mask and its voxel size."""
+    if affine is not None:
+        affine = np.asarray(affine, np.float64)
+        if affine.shape != (ndim + 1, ndim + 1):
+            raise ValueError('The affine of a {}D mask must be {} x {}, not '
+                             '{}.'.format(ndim, ndim + 1, ndim + 1,
+                                          affine.shape))
+        return affine, np.linalg.norm(affine[:ndim, :ndim], axis=0)
+    if zoom is None:
+        raise ValueError('Each mask needs either its zoom or its affine.')
+    if len(zoom) != ndim:
+        raise ValueError('The zoom of a {}D mask must have {} elements, not '
+                         '{}.'.format(ndim, ndim, len(zoom)))
+    zoom = np.asarray(zoom, np.float64)
+    affine = np.eye(ndim + 1)
+    affine[:ndim, :ndim] = np.diag(zoom)
+    # The corner of the first voxel at the origin
+    affine[:ndim, ndim] = zoom / 2
+    return affine, zoom
+
+
+def _to_world(affine, indices):
+    ndim = len(affine) - 1
+    return indices @ affine[:ndim, :ndim].T + affine[:ndim, ndim]
+
+
+def _voxel_volume(affine):
+    return abs(np.linalg.det(affine[:-1, :-1]))
+
+
+def _world_surfels(mask, affine, zoom):
+    """The world coordinates (mm) and areas of the surface elements."""
+    bbox_min, bbox_max = _compute_bounding_box(mask)
+    if bbox_min is None:
+        return np.zeros((0, mask.ndim)), np.zeros(0)
+    table, kernel, full_true_neighbours = _get_surface_lookup(zoom)
+    cropmask = _crop_to_bounding_box(mask, bbox_min, bbox_max)
+    neighbour_code_map, borders = _compute_borders(cropmask, kernel,
+                                                   full_true_neighbours)
+    # The neighbour code at i is for the corner between voxels i - 1 and i
+    indices = np.argwhere(borders) + (bbox_min - 0.5)
+    return _to_world(affine, indices), table[neighbour_code_map[borders]]
+
+
+def _resampled_counts(prediction, truth, prediction_affine, truth_affine):
+    """
+    The confusion counts of the prediction sampled at the centres of the
+    truth voxels, only within the bounding box of both masks.
+    """
+    ndim = truth.ndim
+    # From truth voxel indices to prediction voxel indices
+    transform = np.linalg.solve(prediction_affine, truth_affine)
+    boxes = []
+    truth_min, truth_max = _compute_bounding_box(truth)
+    if truth_min is not None:
+        boxes.append((truth_min, truth_max))
+    prediction_min, prediction_max = _compute_bounding_box(prediction)
+    if prediction_min is not None:
+        # The corners of the prediction box in truth voxel indices
+        corners = np.array(np.meshgrid(*zip(prediction_min - 0.5,
+                                            prediction_max + 0.5),
+                                       indexing='ij')).reshape(ndim, -1).T
+        corners = _to_world(np.linalg.inv(transform), corners)
+        box_min = np.maximum(np.floor(corners.min(axis=0)), 0)
+        box_max = np.minimum(np.ceil(corners.max(axis=0)),
+                             np.subtract(truth.shape, 1))
+        if np.all(box_min <= box_max):
+            boxes.append((box_min.astype(np.int64), box_max.astype(np.int64)))
+    counts = {'tp': np.int64(0), 'fp': np.int64(0), 'fn': np.int64(0)}
+    if boxes:
+        box_min = np.min([box[0] for box in boxes], axis=0)
+        box_max = np.max([box[1] for box in boxes], axis=0)
+        plane = np.prod(box_max[1:] - box_min[1:] + 1)
+        rows = max(_CHUNK_SIZE // plane, 1)
+        for start in range(box_min[0], box_max[0] + 1, rows):
+            stop = min(start + rows, box_max[0] + 1)
+            chunk = (slice(start, stop),) + tuple(
+                slice(lo, hi + 1) for lo, hi in zip(box_min[1:], box_max[1:]))
+            sampled = _sample(prediction, transform, chunk)
+            truth_chunk = truth[chunk]
+            tp = np.count_nonzero(sampled & truth_chunk)
+            counts['tp'] += tp
+            counts['fp'] += np.count_nonzero(sampled) - tp
+            counts['fn'] += np.count_nonzero(truth_chunk) - tp
+    counts['tn'] = truth.size - counts['tp'] - counts['fp'] - counts['fn']
+    return counts
+
+
+def _sample(mask, transform, region):
+    """
+    The mask at the (nearest) voxels of the points of a region of another
+    grid, false outside the mask.
+    """
+    shape = tuple(s.stop - s.start for s in region)
+    indices = np.indices(shape).reshape(len(shape), -1).T + \
+        [s.start for s in region]
+    indices = np.floor(_to_world(transform, indices) + 0.5).astype(np.int64)
+    inside = np.all((indices >= 0) & (indices < mask.shape), axis=1)
+    sampled = np.zeros(len(indices), bool)
+    sampled[inside] = mask[tuple(indices[inside].T)]
+    return sampled.reshape(shape)
@@ -0,0 +1,260 @@
+import numpy as np
+import pandas as pd
+from scipy import spatial
+
+from . import surface_distance as sd
+from .metrics import (confusion_counts, _as_bool_mask, _dice, _jaccard,
+                      _sensitivity, _specificity, _precision, _accuracy,
+                      _DEFAULT_METRICS)
+from .registry import metric_label
+from .surface_distance.metrics import (_check_masks, _compute_borders,
+                                       _get_surface_lookup,
+                                       _sort_distances_surfels)
+
+_SIDES = ('prediction', 'truth')
+
+
+class IncrementalMetrics:
+    """
+    Segmentation accuracy metrics of a pair of masks that are kept up to
+    date as small regions of the masks are edited, e.g. in an interactive
+    correction tool.
+
+    The confusion counts and the surface elements of each mask, with their
+    distance to the other surface, are kept between edits. An edit only
+    recomputes the counts and surface elements of the edited region (and a
+    one voxel halo around it) and the distances that can have changed,
+    found with a KD-tree of each surface. Every other surface element keeps
+    its distance, as its closest point on the edited surface is closer than
+    the edited region.
+
+    The results are the same as creating a new SegmentationMetrics instance
+    with the edited masks.
+    """
+    def __init__(self, prediction, truth, zoom, percentile=95, symmetric=True):
+        """
+        Initialises the IncrementalMetrics class instance.
+
+        Parameters
+        ----------
+        prediction : np.ndarray
+            An array of bools or ints (0 and 1) representing the predicted
+            mask.
+        truth : np.ndarray
+            An array of bools or ints (0 and 1) representing the ground truth
+            mask.
+        zoom : tuple
+            The length of each voxel dimension in millimeters.
+        percentile : int, default 95
+            The percentile of surface distances to define as the Hausdorff
+            distance.
+        symmetric : bool, default True
+            Whether to calculate the symmetric mean surface distance.
+        """
+        prediction, truth = _as_bool_mask(prediction), _as_bool_mask(truth)
+        if prediction.shape != truth.shape:
+            raise ValueError('The masks must be the same shape, not {} and '
+                             '{}.'.format(prediction.shape, truth.shape))
+        _check_masks(prediction, truth, zoom)
+        self.zoom = zoom
+        self.percentile = percentile
+        self.symmetric = symmetric
+        self.shape = prediction.shape
+        self._spacing = np.asarray(zoom, np.float64)
+        self._table, self._kernel, self._full_true_neighbours = \
+            _get_surface_lookup(zoom)
+
+        self._masks = {}
+        self._surfels = {}
+        self._trees = {}
+        for side, mask in zip(_SIDES, (prediction, truth)):
+            # Padded by a voxel at the end of each axis, as the masks cropped
+            # by compute_surface_distances are
+            padded = np.zeros(np.add(self.shape, 1), np.uint8)
+            padded[tuple(slice(0, n) for n in self.shape)] = mask
+            self._masks[side] = padded
+            self._surfels[side] = self._find_surfels(
+                padded, np.zeros(len(self.shape), np.int64))
+        for side, other in zip(_SIDES, _SIDES[::-1]):
+            surfels = self._surfels[side]
+            surfels['distances'] = self._nearest_distances(
+                other, surfels['coordinates'])
+        self._counts = confusion_counts(prediction, truth)
+
+    @property
+    def prediction(self):
+        """A read-only view of the current predicted mask."""
+        return self._view('prediction')
+
+    @property
+    def truth(self):
+        """A read-only view of the current ground truth mask."""
+        return self._view('truth')
+
+    def update(self, region, prediction=None, truth=None):
+        """
+        Edit a region of either or both masks and update the metrics.
+
+        Parameters
+        ----------
+        region : tuple of slice
+            The edited region, one slice per axis.
+        prediction : np.ndarray, optional
+            The new values of the predicted mask within ``region``, bools or
+            ints (0 and 1) broadcastable to the shape of the region.
+        truth : np.ndarray, optional
+            The new values of the ground truth mask within ``region``.
+        """
+        if len(region) != len(self.shape) or \
+                any(not isinstance(s, slice) for s in region):
+            raise ValueError('The region should be a slice for each of the {} '
+                             'axes, not {}.'.format(len(self.shape), region))
+        bounds = [s.indices(n) for s, n in zip(region, self.shape)]
+        if any(step != 1 for _, _, step in bounds):
+            raise ValueError('The region slices must have a step of 1.')
+        lo = np.array([start for start, _, _ in bounds], np.int64)
+        hi = np.array([stop for _, stop, _ in bounds], np.int64)
+        if np.any(hi <= lo):
+            return
+        region = tuple(slice(a, b) for a, b in zip(lo, hi))
+        for side, values in zip(_SIDES, (prediction, truth)):
+            if values is not None:
+                self._edit(side, region, lo, hi, values)
+
+    def get_dict(self):
+        """
+        Generate a dictionary of segmentation accuracy metrics.
+
+        Returns
+        -------
+        metrics : dict
+            Segmentation accuracy, the same keys as
+            ``SegmentationMetrics.get_dict``.
+        """
+        counts = self._counts
+        surface_dist = self._surface_distances()
+        msd = sd.compute_average_surface_distance(surface_dist)
+        if self.symmetric:
+            msd = np.mean(msd)
+        true_volume = (counts['tp'] + counts['fn']) * np.prod(self.zoom) / 1000
+        predicted_volume = (counts['tp'] + counts['fp']) * \
+            np.prod(self.zoom) / 1000
+        return {'dice': _dice(**counts),
+                'jaccard': _jaccard(**counts),
+                'sensitivity': _sensitivity(**counts),
+                'specificity': _specificity(**counts),
+                'precision': _precision(**counts),
+                'accuracy': _accuracy(**counts),
+                'mean_surface_distance': msd,
+                'hausdorff_distance': sd.compute_robust_hausdorff(
+                    surface_dist, self.percentile),
+                'volume_difference': predicted_volume - true_volume,
+                'true_volume': true_volume,
+                'predicted_volume': predicted_volume}
+
+    def get_df(self):
+        """
+        Generate a Pandas DataFrame containing the segmentation accuracy
+        metrics.
+
+        Returns
+        -------
+        df : pd.DataFrame
+            DataFrame with metric in one column and score in the next column.
+        """
+        df = pd.DataFrame.from_dict(self.get_dict(),
+                                    orient='index',
+                                    columns=['Score'])
+        df['Metric'] = [metric_label(name) for name in _DEFAULT_METRICS]
+        df = df[['Metric', 'Score']]
+        return df
+
+    def _view(self, side):
+        view = self._masks[side][tuple(slice(0, n) for n in self.shape)]
+        view = view.view(bool)
+        view.flags.writeable = False
+        return view
+
+    def _edit(self, side, region, lo, hi, values):
+        other = 'truth' if side == 'prediction' else 'prediction'
+        masks = {name: self._masks[name][region].view(bool)
+                 for name in _SIDES}
+        before = confusion_counts(masks['prediction'], masks['truth'])
+        self._masks[side][region] = np.broadcast_to(_as_bool_mask(values),
+                                                    masks[side].shape)
+        after = confusion_counts(masks['prediction'], masks['truth'])
+        for key in self._counts:
+            self._counts[key] += after[key] - before[key]
+
+        # The neighbour code at index i depends on the voxels i - 1 and i, so
+        # the codes from lo to hi (inclusive) change. One more voxel before
+        # lo is needed to compute them.
+        start = np.maximum(lo - 1, 0)
+        block = self._masks[side][tuple(slice(a, b + 1)
+                                        for a, b in zip(start, hi))]
+        new = self._find_surfels(block, start, lo - start)
+        surfels = self._surfels[side]
+        keep = ~_in_box(surfels['coordinates'], lo, hi)
+        new['distances'] = self._nearest_distances(other, new['coordinates'])
+        for key in surfels:
+            surfels[key] = np.concatenate([surfels[key][keep], new[key]])
+        self._trees.pop(side, None)
+
+        # Only surface elements of the other mask at least as far from their
+        # closest point as from the edited box can be affected
+        others = self._surfels[other]
+        affected = others['distances'] >= _distance_to_box(
+            others['coordinates'], lo, hi, self._spacing)
+        others['distances'][affected] = self._nearest_distances(
+            side, others['coordinates'][affected])
+
+    def _find_surfels(self, block, offset, skip=None):
+        """
+        The surface elements of a block of a padded mask, ignoring the first
+        ``skip`` codes along each axis.
+        """
+        neighbour_code_map, borders = _compute_borders(
+            block, self._kernel, self._full_true_neighbours)
+        if skip is not None:
+            inner = tuple(slice(s, None) for s in skip)
+            neighbour_code_map, borders = neighbour_code_map[inner], \
+                borders[inner]
+            offset = offset + skip
+        return {'coordinates': np.argwhere(borders) + offset,
+                'areas': self._table[neighbour_code_map[borders]]}
+
+    def _nearest_distances(self, side, coordinates):
+        """The distance (in mm) from each point to the surface of a mask."""
+        if len(self._surfels[side]['coordinates']) == 0:
+            return np.full(len(coordinates), np.inf)
+        if len(coordinates) == 0:
+            return np.zeros(0)
+        if side not in self._trees:
+            # Rebuilt after every edit, so favour a quick build
+            self._trees[side] = spatial.cKDTree(
+                self._surfels[side]['coordinates'] * self._spacing,
+                balanced_tree=False, compact_nodes=False)
+        return self._trees[side].query(coordinates * self._spacing)[0]
+
+    def _surface_distances(self):
+        # As returned by compute_surface_distances(prediction, truth)
+        surface_dist = {}
+        for side, direction, key in (('prediction', 'gt_to_pred', 'gt'),
+                                     ('truth', 'pred_to_gt', 'pred')):
+            surfels = self._surfels[side]
+            distances, areas = _sort_distances_surfels(surfels['distances'],
+                                                       surfels['areas'])
+            surface_dist['distances_' + direction] = distances
+            surface_dist['surfel_areas_' + key] = areas
+        return surface_dist
+
+
+def _in_box(coordinates, lo, hi):
+    """Whether each point is in the box from lo to hi, inclusive."""
+    return np.all((coordinates >= lo) & (coordinates <= hi), axis=1)
+
+
+def _distance_to_box(coordinates, lo, hi, spacing):
+    """The distance (in mm) from each point to the box from lo to hi."""
+    gap = np.maximum(np.maximum(lo - coordinates, coordinates - hi), 0)
+    return np.linalg.norm(gap * spacing, axis=1)
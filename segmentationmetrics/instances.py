@@ -0,0 +1,192 @@
+import numpy as np
+import pandas as pd
+from scipy import ndimage
+from scipy.optimize import linear_sum_assignment
+
+from . import surface_distance as sd
+from .metrics import _as_bool_mask
+
+
+class InstanceMetrics:
+    """
+    Instance level (e.g. per lesion) detection and segmentation accuracy
+    metrics.
+
+    The connected components of each mask are treated as separate instances.
+    Instances are matched by maximising the total intersection over union
+    of the matched pairs, using an overlap matrix built in a single pass over
+    the volume. Surface distances are only calculated for matched pairs,
+    within the bounding box of each pair.
+
+    Attributes
+    ----------
+    n_true : int
+        The number of instances in the ground truth mask.
+    n_predicted : int
+        The number of instances in the predicted mask.
+    true_positives : int
+        The number of matched instances.
+    false_positives : int
+        The number of predicted instances without a match.
+    false_negatives : int
+        The number of true instances without a match.
+    detection_precision : float
+        The fraction of predicted instances that were matched.
+    detection_sensitivity : float
+        The fraction of true instances that were matched.
+    detection_f1 : float
+        The F1 score of instance detection.
+    overlap : np.ndarray
+        An (n_true + 1, n_predicted + 1) array of the number of voxels in
+        each pair of true and predicted labels, label 0 is the background.
+    matches : np.ndarray
+        An (N, 2) array of the matched (true, predicted) labels.
+    """
+    def __init__(self, prediction, truth, zoom, iou_threshold=0.1,
+                 percentile=95, connectivity=None):
+        """
+        Initialises the InstanceMetrics class instance.
+
+        Parameters
+        ----------
+        prediction : np.ndarray
+            An array of bools or ints (0 and 1) representing the predicted
+            mask.
+        truth : np.ndarray
+            An array of bools or ints (0 and 1) representing the ground truth
+            mask.
+        zoom : tuple
+            The length of each voxel dimension in millimeters.
+        iou_threshold : float, default 0.1
+            The minimum intersection over union for a pair of instances to
+            count as a match.
+        percentile : int, default 95
+            The percentile of surface distances to define as the Hausdorff
+            distance of each matched pair.
+        connectivity : int, optional
+            The maximum number of orthogonal steps between neighbouring
+            voxels of an instance, as in ``skimage.measure.label``. Defaults
+            to full connectivity (i.e. diagonal neighbours are connected).
+        """
+        prediction = _as_bool_mask(prediction)
+        truth = _as_bool_mask(truth)
+        self.zoom = zoom
+        self.percentile = percentile
+        structure = ndimage.generate_binary_structure(
+            truth.ndim, connectivity or truth.ndim)
+        self._truth_labels, self.n_true = ndimage.label(truth, structure)
+        self._pred_labels, self.n_predicted = ndimage.label(prediction,
+                                                            structure)
+        self.overlap = self._overlap_matrix()
+        self.matches = self._match(iou_threshold)
+
+        self.true_positives = len(self.matches)
+        self.false_positives = self.n_predicted - self.true_positives
+        self.false_negatives = self.n_true - self.true_positives
+        self.detection_precision = self._ratio(self.true_positives,
+                                               self.n_predicted)
+        self.detection_sensitivity = self._ratio(self.true_positives,
+                                                 self.n_true)
+        self.detection_f1 = self._ratio(2 * self.true_positives,
+                                        self.n_true + self.n_predicted)
+        self._pair_metrics = self._matched_surface_metrics()
+
+    def get_dict(self):
+        """
+        Generate a dictionary of instance detection metrics.
+
+        Returns
+        -------
+        metrics : dict
+            Instance detection accuracy.
+        """
+        return {'n_true': self.n_true,
+                'n_predicted': self.n_predicted,
+                'true_positives': self.true_positives,
+                'false_positives': self.false_positives,
+                'false_negatives': self.false_negatives,
+                'detection_precision': self.detection_precision,
+                'detection_sensitivity': self.detection_sensitivity,
+                'detection_f1': self.detection_f1}
+
+    def get_df(self):
+        """
+        Generate a Pandas DataFrame with one row per instance.
+
+        Matched pairs share a row, unmatched instances have a label of 0 for
+        the other mask, a Dice score of 0 and no surface distances.
+
+        Returns
+        -------
+        df : pd.DataFrame
+            The labels, Dice score, intersection over union, surface
+            distances (in mm) and volumes (in milliliters) of each instance.
+        """
+        voxel_volume = np.prod(self.zoom) / 1000
+        true_sizes = self.overlap.sum(axis=1)
+        pred_sizes = self.overlap.sum(axis=0)
+        rows = []
+        for (t, p), (msd, hd) in zip(self.matches, self._pair_metrics):
+            rows.append((t, p, msd, hd))
+        unmatched_true = np.setdiff1d(np.arange(1, self.n_true + 1),
+                                      self.matches[:, 0])
+        unmatched_pred = np.setdiff1d(np.arange(1, self.n_predicted + 1),
+                                      self.matches[:, 1])
+        rows += [(t, 0, np.nan, np.nan) for t in unmatched_true]
+        rows += [(0, p, np.nan, np.nan) for p in unmatched_pred]
+
+        df = pd.DataFrame(rows, columns=['true_label', 'predicted_label',
+                                         'mean_surface_distance',
+                                         'hausdorff_distance'])
+        t, p = df['true_label'].to_numpy(), df['predicted_label'].to_numpy()
+        intersection = np.where((t > 0) & (p > 0), self.overlap[t, p], 0)
+        df['true_volume'] = np.where(t > 0, true_sizes[t], 0) * voxel_volume
+        df['predicted_volume'] = np.where(p > 0, pred_sizes[p], 0) * \
+            voxel_volume
+        total = (df['true_volume'] + df['predicted_volume']) / voxel_volume
+        df['dice'] = 2 * intersection / total
+        df['iou'] = intersection / (total - intersection)
+        return df[['true_label', 'predicted_label', 'dice', 'iou',
+                   'mean_surface_distance', 'hausdorff_distance',
+                   'true_volume', 'predicted_volume']]
+
+    def _overlap_matrix(self):
+        # One bincount over the paired labels gives every intersection
+        n_cols = self.n_predicted + 1
+        paired = self._truth_labels.ravel().astype(np.int64) * n_cols + \
+            self._pred_labels.ravel()
+        return np.bincount(paired, minlength=(self.n_true + 1) * n_cols
+                           ).reshape(self.n_true + 1, n_cols)
+
+    def _match(self, iou_threshold):
+        if self.n_true == 0 or self.n_predicted == 0:
+            return np.zeros((0, 2), np.int64)
+        intersection = self.overlap[1:, 1:]
+        union = self.overlap[1:, :].sum(axis=1)[:, np.newaxis] + \
+            self.overlap[:, 1:].sum(axis=0)[np.newaxis, :] - intersection
+        iou = intersection / union
+        rows, cols = linear_sum_assignment(iou, maximize=True)
+        keep = (iou[rows, cols] >= iou_threshold) & \
+            (intersection[rows, cols] > 0)
+        return np.stack([rows[keep] + 1, cols[keep] + 1], axis=1)
+
+    def _matched_surface_metrics(self):
+        true_boxes = ndimage.find_objects(self._truth_labels)
+        pred_boxes = ndimage.find_objects(self._pred_labels)
+        metrics = []
+        for t, p in self.matches:
+            box = tuple(slice(min(a.start, b.start), max(a.stop, b.stop))
+                        for a, b in zip(true_boxes[t - 1], pred_boxes[p - 1]))
+            surface_dist = sd.compute_surface_distances(
+                self._pred_labels[box] == p, self._truth_labels[box] == t,
+                self.zoom)
+            metrics.append((
+                np.mean(sd.compute_average_surface_distance(surface_dist)),
+                sd.compute_robust_hausdorff(surface_dist, self.percentile)))
+        return metrics
+
+    @staticmethod
+    def _ratio(numerator, denominator):
+        if denominator == 0:
+            return np.nan
+        return numerator / denominator
@@ -0,0 +1,214 @@
+import numpy as np
+from scipy import ndimage
+
+from . import surface_distance as sd
+from .metrics import _as_bool_mask
+from .surface_distance.metrics import _get_surface_lookup
+
+_SIDES = ('prediction', 'truth')
+
+
+def local_overlap_maps(prediction, truth, window=7):
+    """
+    Voxelwise maps of the overlap metrics within a sliding window centred on
+    each voxel, e.g. to show where a segmentation disagrees with the ground
+    truth.
+
+    The windowed counts come from separable moving sums
+    (``scipy.ndimage.uniform_filter``), so the cost per voxel is the same
+    whatever the window size. Windows are cut off at the edge of the volume.
+
+    Parameters
+    ----------
+    prediction : np.ndarray
+        An array of bools or ints (0 and 1) representing the predicted mask.
+    truth : np.ndarray
+        An array of bools or ints (0 and 1) representing the ground truth
+        mask.
+    window : int or tuple of int, default 7
+        The size of the window in voxels, along every axis or per axis.
+
+    Returns
+    -------
+    maps : dict
+        The number of true positive (``tp``), false positive (``fp``) and
+        false negative (``fn``) voxels in the window around each voxel and
+        the local ``dice`` and ``jaccard``, which are NaN where the window
+        holds no foreground in either mask.
+    """
+    prediction, truth = _as_bool_mask(prediction), _as_bool_mask(truth)
+    if prediction.shape != truth.shape:
+        raise ValueError('The masks must be the same shape, not {} and '
+                         '{}.'.format(prediction.shape, truth.shape))
+    window = _check_window(window, prediction.ndim)
+    # fp and fn follow from the foreground in each mask and tp
+    tp, positive, true = (_window_sum(mask, window)
+                          for mask in (prediction & truth, prediction, truth))
+    fp = positive - tp
+    fn = true - tp
+    return {'tp': tp, 'fp': fp, 'fn': fn,
+            'dice': _ratio(2 * tp, positive + true),
+            'jaccard': _ratio(tp, tp + fp + fn)}
+
+
+def surface_error_map(prediction, truth, zoom):
+    """
+    The distance of each surface element of each mask to the other surface,
+    at a voxel of the mask it lies on.
+
+    This is ``surface_distance.compute_surface_distances`` with
+    ``return_coordinates``, as in SegmentationMetrics, with each surface
+    element moved from the voxel corner it lies at to a voxel of its mask,
+    so the error can be shown on the image. Only the surface voxels are
+    stored.
+
+    Parameters
+    ----------
+    prediction : np.ndarray
+        An array of bools or ints (0 and 1) representing the predicted mask.
+    truth : np.ndarray
+        An array of bools or ints (0 and 1) representing the ground truth
+        mask.
+    zoom : tuple
+        The length of each voxel dimension in millimeters.
+
+    Returns
+    -------
+    errors : dict
+        For each of ``prediction`` and ``truth``, a dict of the
+        ``coordinates`` of its surface elements (an (N, ndim) array of voxel
+        indices), their ``distances`` in mm to the other surface (``inf`` if
+        the other mask is empty) and their ``areas`` in mm^2 (lengths in mm
+        in 2D). A voxel can hold several surface elements.
+    """
+    prediction, truth = _as_bool_mask(prediction), _as_bool_mask(truth)
+    if prediction.shape != truth.shape:
+        raise ValueError('The masks must be the same shape, not {} and '
+                         '{}.'.format(prediction.shape, truth.shape))
+    surface_distances = sd.compute_surface_distances(
+        prediction, truth, zoom, return_coordinates=True)
+    kernel = _get_surface_lookup(zoom)[1]
+    errors = {}
+    for side, mask, key, direction in (
+            ('prediction', prediction, 'gt', 'gt_to_pred'),
+            ('truth', truth, 'pred', 'pred_to_gt')):
+        corners = surface_distances['surfel_coordinates_' + key].astype(
+            np.int64)
+        codes = _neighbour_codes(mask, corners, kernel)
+        errors[side] = {'coordinates': corners +
+                        _foreground_offset(codes, kernel),
+                        'distances': surface_distances['distances_' +
+                                                       direction],
+                        'areas': surface_distances['surfel_areas_' + key]}
+    return errors
+
+
+def local_surface_error_map(prediction, truth, zoom, window=7):
+    """
+    A voxelwise map of the mean surface distance within a sliding window
+    centred on each voxel.
+
+    The surface elements of both masks from ``surface_error_map`` are
+    scattered onto the volume and averaged, weighted by their area, with
+    moving sums, so the cost per voxel is the same whatever the window size.
+
+    Parameters
+    ----------
+    prediction : np.ndarray
+        An array of bools or ints (0 and 1) representing the predicted mask.
+    truth : np.ndarray
+        An array of bools or ints (0 and 1) representing the ground truth
+        mask.
+    zoom : tuple
+        The length of each voxel dimension in millimeters.
+    window : int or tuple of int, default 7
+        The size of the window in voxels, along every axis or per axis.
+
+    Returns
+    -------
+    error : np.ndarray
+        The area weighted mean distance in mm of the surface elements of
+        both masks in the window around each voxel. NaN where the window
+        holds no surface and ``inf`` where it holds surface of one mask while
+        the other mask is empty.
+    """
+    window = _check_window(window, len(zoom))
+    errors = surface_error_map(prediction, truth, zoom)
+    shape = np.shape(prediction)
+    index = np.concatenate([np.ravel_multi_index(
+        errors[side]['coordinates'].T, shape) for side in _SIDES])
+    distances = np.concatenate([errors[side]['distances']
+                                for side in _SIDES])
+    areas = np.concatenate([errors[side]['areas'] for side in _SIDES])
+    finite = np.isfinite(distances)
+
+    def scatter(weights):
+        return np.bincount(index, weights, minlength=np.prod(shape)).reshape(
+            shape)
+
+    weighted = scatter(np.where(finite, distances, 0) * areas)
+    unmatched = scatter(~finite)
+    areas = scatter(areas)
+    error = _ratio(_window_sum(weighted, window, rint=False),
+                   _window_sum(areas, window, rint=False))
+    error[_window_sum(unmatched, window) > 0] = np.inf
+    return error
+
+
+def _check_window(window, ndim):
+    window = np.broadcast_to(window, (ndim,))
+    if np.any(window < 1):
+        raise ValueError('The window must be at least one voxel, not '
+                         '{}.'.format(tuple(window)))
+    return window
+
+
+def _neighbour_codes(mask, corners, kernel):
+    """
+    The neighbour code of the surface element at each voxel corner, from the
+    voxels from index - 1 to index along each axis.
+    """
+    codes = np.zeros(len(corners), np.int64)
+    for position in np.argwhere(np.ones(kernel.shape)):
+        voxels = corners + position - 1
+        inside = np.all((voxels >= 0) & (voxels < mask.shape), axis=1)
+        codes[inside] += kernel[tuple(position)] * \
+            mask[tuple(voxels[inside].T)]
+    return codes
+
+
+def _foreground_offset(codes, kernel):
+    """
+    The offset from the neighbour code index of each surface element to a
+    voxel of its mask, the one of its neighbourhood with the lowest bit.
+
+    The code at index i covers the voxels from i - 1 to i along each axis.
+    """
+    codes = codes.astype(np.int64)
+    bit = np.log2(codes & -codes).astype(np.int64)
+    positions = np.zeros((kernel.size, kernel.ndim), np.int64)
+    positions[np.log2(kernel.ravel()).astype(np.int64)] = \
+        np.argwhere(np.ones(kernel.shape))
+    return positions[bit] - 1
+
+
+def _window_sum(values, window, rint=True):
+    """The sum of the values in the window centred on each voxel."""
+    if rint:
+        # Counts, the moving sums accumulate in double precision so single
+        # precision output is exact enough to round
+        total = ndimage.uniform_filter(values.astype(np.float32), window,
+                                       mode='constant')
+        return np.rint(total * np.prod(window)).astype(np.int64)
+    total = ndimage.uniform_filter(values.astype(np.float64), window,
+                                   mode='constant') * np.prod(window)
+    # Rounding error can leave tiny non-zero sums where there is nothing
+    total[np.abs(total) < 1e-9] = 0
+    return total
+
+
+def _ratio(numerator, denominator):
+    """numerator / denominator, NaN where the denominator is 0."""
+    return np.divide(numerator, denominator,
+                     out=np.full(np.shape(numerator), np.nan),
+                     where=denominator != 0)
@@ -1,7 +1,301 @@
+import functools
+
 import numpy as np
 import pandas as pd
+from scipy import ndimage
 
 from . import surface_distance as sd
+from .surface_distance.metrics import (_check_masks, _compute_borders,
+                                       _compute_distance_map,
+                                       _crop_to_bounding_box,
+                                       _get_surface_lookup,
+                                       _sort_distances_surfels)
+from .encoded import (EncodedMask, as_encoded, encoded_confusion_counts,
+                      encoded_surface_distances, union_bounding_box,
+                      _bbox_slices, _check_shapes)
+from .registry import (MetricEvaluator, metric_label, register_intermediate,
+                       register_metric)
+
+
+def confusion_counts(prediction, truth, size=None):
+    """
+    Count the true/false positive/negative voxels of a pair of binary masks.
+
+    Parameters
+    ----------
+    prediction : np.ndarray
+        An array of bools representing the predicted mask.
+    truth : np.ndarray
+        An array of bools representing the ground truth mask.
+    size : int, optional
+        The number of voxels in the full masks, if ``prediction`` and
+        ``truth`` have been cropped to their foreground. Defaults to the size
+        of ``truth``.
+
+    Returns
+    -------
+    counts : dict
+        The number of true positive (``tp``), false positive (``fp``),
+        false negative (``fn``) and true negative (``tn``) voxels.
+    """
+    tp = np.int64(np.count_nonzero(prediction & truth))
+    fp = np.int64(np.count_nonzero(prediction)) - tp
+    fn = np.int64(np.count_nonzero(truth)) - tp
+    tn = np.int64(truth.size if size is None else size) - tp - fp - fn
+    return {'tp': tp, 'fp': fp, 'fn': fn, 'tn': tn}
+
+
+def _as_bool_mask(mask):
+    """
+    Threshold a mask at 0.5. Bool masks, and uint8 masks of 0 and 1, are
+    returned as views rather than copies and the memory layout of the input
+    is kept.
+    """
+    mask = np.asarray(mask)
+    if mask.dtype == bool:
+        return mask
+    if mask.dtype == np.uint8 and (mask.size == 0 or mask.max() <= 1):
+        return mask.view(bool)
+    return mask > 0.5
+
+
+def _dense_bool_mask(mask):
+    """An encoded mask decoded or a dense mask thresholded at 0.5."""
+    if isinstance(mask, EncodedMask):
+        return mask.to_dense()
+    return _as_bool_mask(mask)
+
+
+def _threshold_to_bounding_box(prediction, truth):
+    """
+    Threshold a pair of masks within the bounding box of their foreground.
+
+    The bounding box is found from max projections of the masks as given, so
+    the thresholded masks are only materialized inside it. If both masks are
+    empty a single background voxel is returned.
+    """
+    prediction, truth = np.asarray(prediction), np.asarray(truth)
+    box = _foreground_bounding_box(prediction, truth)
+    return _as_bool_mask(prediction[box]), _as_bool_mask(truth[box])
+
+
+def _foreground_bounding_box(prediction, truth):
+    """
+    The bounding box of the foreground of a pair of dense masks as a tuple of
+    slices, see ``_threshold_to_bounding_box``.
+    """
+    if prediction.shape != truth.shape:
+        raise ValueError('The masks must be the same shape, not {} and '
+                         '{}.'.format(prediction.shape, truth.shape))
+    # Project out the last axis once and reuse it for the other axes. fmax
+    # ignores NaNs, which are background.
+    box = []
+    planes = [np.fmax.reduce(mask, axis=-1) for mask in (prediction, truth)]
+    for axis in range(truth.ndim):
+        if axis == truth.ndim - 1:
+            projections = [np.fmax.reduce(mask, axis=tuple(range(axis)))
+                           for mask in (prediction, truth)]
+        else:
+            other_axes = tuple(a for a in range(truth.ndim - 1) if a != axis)
+            projections = [np.fmax.reduce(plane, axis=other_axes)
+                           for plane in planes]
+        idx = np.flatnonzero((projections[0] > 0.5) |
+                             (projections[1] > 0.5))
+        if len(idx) == 0:
+            return (slice(0, 1),) * truth.ndim
+        box.append(slice(idx[0], idx[-1] + 1))
+    return tuple(box)
+
+
+def _dice(tp, fp, fn, tn):
+    return tp * 2.0 / (2 * tp + fp + fn)
+
+
+def _jaccard(tp, fp, fn, tn):
+    return tp / (tp + fp + fn)
+
+
+def _sensitivity(tp, fp, fn, tn):
+    return tp / (tp + fn)
+
+
+def _specificity(tp, fp, fn, tn):
+    return tn / (tn + fp)
+
+
+def _precision(tp, fp, fn, tn):
+    return tp / (tp + fp)
+
+
+def _accuracy(tp, fp, fn, tn):
+    return (tp + tn) / (tp + fp + fn + tn)
+
+
+# Intermediates shared between the metrics, see registry.py. Dense masks are
+# only thresholded within their bounding box. Encoded masks are counted from
+# their encodings and their surfaces decoded around each cluster of
+# components, only the cropped masks (e.g. for the boundary IoU) decode the
+# whole bounding box.
+@register_intermediate('bounding_box', requires=('prediction', 'truth'))
+def _bounding_box(prediction, truth):
+    if isinstance(prediction, EncodedMask):
+        _check_shapes(prediction, truth)
+        bbox_min, bbox_max = union_bounding_box(prediction, truth)
+        if bbox_min is None:
+            return (slice(0, 1),) * truth.ndim
+        return _bbox_slices(bbox_min, bbox_max)
+    return _foreground_bounding_box(prediction, truth)
+
+
+@register_intermediate('masks', requires=('prediction', 'truth',
+                                          'bounding_box'))
+def _cropped_masks(prediction, truth, bounding_box):
+    if isinstance(prediction, EncodedMask):
+        bbox_min = [box.start for box in bounding_box]
+        bbox_max = [box.stop - 1 for box in bounding_box]
+        return (prediction.crop(bbox_min, bbox_max),
+                truth.crop(bbox_min, bbox_max))
+    return (_as_bool_mask(prediction[bounding_box]),
+            _as_bool_mask(truth[bounding_box]))
+
+
+def _counts_requires(prediction, truth, zoom):
+    # Encoded masks are counted from the encodings e.g. intersecting runs
+    if isinstance(prediction, EncodedMask):
+        return ('prediction', 'truth')
+    return ('masks', 'truth')
+
+
+@register_intermediate('counts', requires=_counts_requires)
+def _counts(truth, prediction=None, masks=None):
+    if masks is None:
+        return encoded_confusion_counts(prediction, truth)
+    # Everything outside the bounding box is a true negative
+    return confusion_counts(*masks, size=np.prod(truth.shape, dtype=np.int64))
+
+
+@register_intermediate('borders', requires=('masks', 'zoom'))
+def _borders(masks, zoom):
+    # The neighbour codes and surface voxels of each mask, as in
+    # surface_distance.compute_surface_distances
+    _check_masks(masks[0], masks[1], zoom)
+    _, kernel, full_true_neighbours = _get_surface_lookup(zoom)
+    borders = []
+    for mask in masks:
+        cropmask = _crop_to_bounding_box(mask, np.zeros(mask.ndim, np.int64),
+                                         np.array(mask.shape) - 1)
+        borders.append(_compute_borders(cropmask, kernel,
+                                        full_true_neighbours))
+    return borders
+
+
+@register_intermediate('distance_maps', requires=('borders', 'zoom'))
+def _distance_maps(borders, zoom):
+    return [_compute_distance_map(border_mask, zoom)
+            for _, border_mask in borders]
+
+
+def _surface_distances_requires(prediction, truth, zoom):
+    # Encoded masks are only decoded around each cluster of components
+    if isinstance(prediction, EncodedMask):
+        return ('prediction', 'truth', 'zoom')
+    return ('borders', 'distance_maps', 'zoom')
+
+
+@register_intermediate('surface_distances',
+                       requires=_surface_distances_requires)
+def _surface_distances(zoom, prediction=None, truth=None, borders=None,
+                       distance_maps=None):
+    # The same as surface_distance.compute_surface_distances(prediction,
+    # truth, zoom), i.e. the prediction takes the place of mask_gt
+    if borders is None:
+        return encoded_surface_distances(prediction, truth, zoom)
+    neighbour_code_to_surface_area = _get_surface_lookup(zoom)[0]
+    (codes_pred, borders_pred), (codes_truth, borders_truth) = borders
+    distmap_pred, distmap_truth = distance_maps
+    distances_pred, areas_pred = _sort_distances_surfels(
+        distmap_truth[borders_pred],
+        neighbour_code_to_surface_area[codes_pred[borders_pred]])
+    distances_truth, areas_truth = _sort_distances_surfels(
+        distmap_pred[borders_truth],
+        neighbour_code_to_surface_area[codes_truth[borders_truth]])
+    return {'distances_gt_to_pred': distances_pred,
+            'distances_pred_to_gt': distances_truth,
+            'surfel_areas_gt': areas_pred,
+            'surfel_areas_pred': areas_truth}
+
+
+def _from_counts(formula, counts):
+    return formula(**counts)
+
+
+for _name, _formula in (('dice', _dice), ('jaccard', _jaccard),
+                        ('sensitivity', _sensitivity),
+                        ('specificity', _specificity),
+                        ('precision', _precision), ('accuracy', _accuracy)):
+    register_metric(_name, requires=('counts',))(
+        functools.partial(_from_counts, _formula))
+
+
+@register_metric('mean_surface_distance', requires=('surface_distances',))
+def _mean_surface_distance(surface_distances, symmetric=True):
+    av_surf_dist = sd.compute_average_surface_distance(surface_distances)
+    if symmetric:
+        return np.mean(av_surf_dist)
+    return av_surf_dist
+
+
+@register_metric('hausdorff_distance', requires=('surface_distances',))
+def _hausdorff_distance(surface_distances, percentile=95):
+    return sd.compute_robust_hausdorff(surface_distances, percentile)
+
+
+@register_metric('volume_difference', requires=('counts', 'zoom'))
+def _volume_difference(counts, zoom):
+    return _predicted_volume(counts, zoom) - _true_volume(counts, zoom)
+
+
+@register_metric('true_volume', requires=('counts', 'zoom'))
+def _true_volume(counts, zoom):
+    return (counts['tp'] + counts['fn']) * np.prod(zoom) / 1000
+
+
+@register_metric('predicted_volume', requires=('counts', 'zoom'))
+def _predicted_volume(counts, zoom):
+    return (counts['tp'] + counts['fp']) * np.prod(zoom) / 1000
+
+
+@register_metric('relative_volume_error', requires=('counts',))
+def _relative_volume_error(counts):
+    return (counts['fp'] - counts['fn']) / (counts['tp'] + counts['fn'])
+
+
+@register_metric('surface_dice', requires=('surface_distances',))
+def _surface_dice(surface_distances, tolerance=1.0):
+    return sd.compute_surface_dice_at_tolerance(surface_distances, tolerance)
+
+
+@register_metric('boundary_iou', requires=('masks', 'zoom'),
+                 label='Boundary IoU')
+def _boundary_iou(masks, zoom, boundary_width=1.0):
+    # The IoU of the voxels of each mask within boundary_width (in mm) of
+    # the background, padded so voxels on the edge of the crop are next to
+    # background as they are in the surface distances
+    bands = []
+    for mask in masks:
+        padded = np.pad(mask, 1)
+        distmap = ndimage.distance_transform_edt(padded, sampling=zoom)
+        bands.append(padded & (distmap <= boundary_width))
+    union = np.count_nonzero(bands[0] | bands[1])
+    if union == 0:
+        return np.nan
+    return np.count_nonzero(bands[0] & bands[1]) / union
+
+
+_DEFAULT_METRICS = ('dice', 'jaccard', 'sensitivity', 'specificity',
+                    'precision', 'accuracy', 'mean_surface_distance',
+                    'hausdorff_distance', 'volume_difference', 'true_volume',
+                    'predicted_volume')
 
 
 class SegmentationMetrics:
@@ -33,19 +327,25 @@ class SegmentationMetrics:
         milliliters). Positive values show the predicted volume is larger 
         than the true volume, negative values show the true volume is larger
         than the predicted volume.
+    prediction, truth : np.ndarray
+        The masks as dense arrays of bools, thresholded at 0.5 (or decoded)
+        when first accessed.
+    metrics : list of str
+        The names of the calculated metrics, in the order of ``get_dict``.
     """
-    def __init__(self, prediction, truth, zoom, percentile=95, symmetric=True):
+    def __init__(self, prediction, truth, zoom, percentile=95, symmetric=True,
+                 metrics=None, **options):
         """
         Initialises the SegmentationMetrics class instance.
 
         Parameters
         ----------
-        prediction : np.ndarray
+        prediction : np.ndarray or EncodedMask
             An array of bools or ints (0 and 1) representing the predicted
-            mask.
-        truth : np.ndarray
+            mask, or an encoded mask e.g. a RunLengthMask or CoordinateMask.
+        truth : np.ndarray or EncodedMask
             An array of bools or ints (0 and 1) representing the ground truth
-            mask.
+            mask, or an encoded mask e.g. a RunLengthMask or CoordinateMask.
         zoom : tuple
             The length of each voxel dimension in millimeters.
         percentile : int, default 95
@@ -57,24 +357,43 @@ class SegmentationMetrics:
             surface distance from surface A to surface B and the mean
             surface distance from surface B to surface A. If false, a tuple
             is returned with both mean surface distances.
+        metrics : list of str, optional
+            The names of the metrics to calculate, any of
+            ``registry.available_metrics()`` e.g. ``surface_dice``. Each
+            becomes an attribute of the instance. Defaults to the attributes
+            listed above.
+        **options
+            Options of the requested metrics e.g. ``tolerance`` (in mm) for
+            ``surface_dice``.
         """
-        self.prediction = prediction > 0.5
-        self.truth = truth > 0.5
         self.zoom = zoom
-        self.dice = self._dice()
-        self.jaccard = self._jaccard()
-        self.sensitivity = self._sensitivity()
-        self.specificity = self._specificity()
-        self.precision = self._precision()
-        self.accuracy = self._accuracy()
-        self._surface_dist = sd.compute_surface_distances(self.prediction,
-                                                          self.truth,
-                                                          self.zoom)
-        self.mean_surface_distance = self._av_dist(symmetric)
-        self.hausdorff_distance = self._hausdorff_dist(percentile)
-        self.true_volume = self._true_volume()
-        self.predicted_volume = self._predicted_volume()
-        self.volume_difference = self._volume_difference()
+        # The inputs as given, thresholded (or decoded) only where needed,
+        # see the prediction and truth properties
+        if isinstance(prediction, EncodedMask) or \
+                isinstance(truth, EncodedMask):
+            self._prediction = as_encoded(prediction)
+            self._truth = as_encoded(truth)
+        else:
+            self._prediction = np.asarray(prediction)
+            self._truth = np.asarray(truth)
+        self.metrics = list(dict.fromkeys(metrics or _DEFAULT_METRICS))
+        # Each intermediate (e.g. the surface distances) is computed once
+        # however many metrics need it
+        evaluator = MetricEvaluator(self._prediction, self._truth, zoom,
+                                    percentile=percentile,
+                                    symmetric=symmetric, **options)
+        for name, value in evaluator.compute(self.metrics).items():
+            setattr(self, name, value)
+
+    @functools.cached_property
+    def prediction(self):
+        """The predicted mask as a dense array of bools."""
+        return _dense_bool_mask(self._prediction)
+
+    @functools.cached_property
+    def truth(self):
+        """The ground truth mask as a dense array of bools."""
+        return _dense_bool_mask(self._truth)
 
     def get_dict(self):
         """
@@ -85,17 +404,7 @@ class SegmentationMetrics:
         metrics : dict
             Segmentation accuracy.
         """
-        return {'dice': self.dice,
-                'jaccard': self.jaccard,
-                'sensitivity': self.sensitivity,
-                'specificity': self.specificity,
-                'precision': self.precision,
-                'accuracy': self.accuracy,
-                'mean_surface_distance': self.mean_surface_distance,
-                'hausdorff_distance': self.hausdorff_distance,
-                'volume_difference': self.volume_difference,
-                'true_volume': self.true_volume,
-                'predicted_volume': self.predicted_volume}
+        return {name: getattr(self, name) for name in self.metrics}
 
     def get_df(self):
         """
@@ -110,58 +419,31 @@ class SegmentationMetrics:
         df = pd.DataFrame.from_dict(self.get_dict(),
                                     orient='index',
                                     columns=['Score'])
-        df['Metric'] = ['Dice', 'Jaccard', 'Sensitivity', 'Specificity',
-                        'Precision', 'Accuracy', 'Mean Surface Distance',
-                        'Hausdorff Distance', 'Volume Difference',
-                        'True Volume', 'Predicted Volume']
+        df['Metric'] = [metric_label(name) for name in self.metrics]
         df = df[['Metric', 'Score']]
         return df
 
-    def _dice(self):
-        return np.sum(self.prediction[self.truth == 1]) * 2.0 / \
-               (np.sum(self.prediction) + np.sum(self.truth))
-
-    def _jaccard(self):
-        return np.sum(self.prediction[self.truth == 1]) / \
-               (np.sum(self.prediction[self.truth == 1]) +
-                np.sum(self.prediction != self.truth))
-
-    def _sensitivity(self):
-        return np.sum(self.prediction[self.truth == 1]) / \
-               (np.sum(self.prediction[self.truth == 1]) +
-                np.sum((self.truth == 1) & (self.prediction == 0)))
-
-    def _specificity(self):
-        return np.sum((self.truth == 0) & (self.prediction == 0)) / \
-               (np.sum((self.truth == 0) & (self.prediction == 0)) +
-                np.sum((self.truth == 0) & (self.prediction == 1)))
-
-    def _precision(self):
-        return np.sum(self.prediction[self.truth == 1]) / \
-               (np.sum(self.prediction[self.truth == 1]) +
-                np.sum((self.truth == 0) & (self.prediction == 1)))
-
-    def _accuracy(self):
-        return (np.sum(self.prediction[self.truth == 1]) +
-                np.sum((self.truth == 0) & (self.prediction == 0))) / \
-               self.truth.size
-
-    def _av_dist(self, symmetric=True):
-        av_surf_dist = sd.compute_average_surface_distance(self._surface_dist)
-        if symmetric:
-            msd = np.mean(av_surf_dist)
-        else:
-            msd = av_surf_dist
-        return msd
-
-    def _hausdorff_dist(self, percentile=95):
-        return sd.compute_robust_hausdorff(self._surface_dist, percentile)
-
-    def _true_volume(self):
-        return np.sum(self.truth) * np.prod(self.zoom) / 1000
+    def get_slice_metrics(self, axis=2, percentile=95, symmetric=True):
+        """
+        Calculate the segmentation accuracy metrics of every non-empty slice
+        of 3D masks, reusing the masks of this instance.
 
-    def _predicted_volume(self):
-        return np.sum(self.prediction) * np.prod(self.zoom) / 1000
+        Parameters
+        ----------
+        axis : int, default 2
+            The axis to slice along.
+        percentile : int, default 95
+            The percentile of surface distances to define as the Hausdorff
+            distance.
+        symmetric : bool, default True
+            Whether to calculate the symmetric mean surface distance.
 
-    def _volume_difference(self):
-        return self.predicted_volume - self.true_volume
+        Returns
+        -------
+        metrics : dict
+            The index of each non-empty slice under ``slice`` and an array of
+            scores for each metric, see ``batch.slice_metrics``.
+        """
+        from .batch import _slice_metrics
+        return _slice_metrics(self.prediction, self.truth, self.zoom, axis,
+                              percentile, symmetric)
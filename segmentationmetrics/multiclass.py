@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+
+from .metrics import (_dice, _jaccard, _sensitivity, _specificity,
+                      _precision)
+
+_OVERLAP_METRICS = {'dice': _dice, 'jaccard': _jaccard,
+                    'sensitivity': _sensitivity, 'specificity': _specificity,
+                    'precision': _precision}
+# The number of voxels counted at once
+_CHUNK_SIZE = 2 ** 22
+
+
+class MultiClassMetrics:
+    """
+    Overlap metrics of a multi-class (semantic) segmentation, from the full
+    confusion matrix of a predicted and a ground truth label map.
+
+    The confusion matrix is counted with one ``np.bincount`` of the paired
+    labels, a chunk of the volume at a time, and every per-class metric and
+    volume comes from the matrix, so the volume is only read once whatever
+    the number of classes.
+
+    Attributes
+    ----------
+    n_classes : int
+        The number of classes, labelled 0 to n_classes - 1.
+    confusion_matrix : np.ndarray
+        An (n_classes, n_classes) array of the number of voxels of each true
+        (row) and predicted (column) label.
+    dice, jaccard, sensitivity, specificity, precision : np.ndarray
+        The overlap metrics of each class against all the others. Classes in
+        neither mask have undefined (NaN) scores.
+    true_volume, predicted_volume : np.ndarray
+        The volume of each class (in milliliters).
+    volume_difference : np.ndarray
+        The predicted volume minus the true volume of each class (in
+        milliliters).
+    accuracy : float
+        The fraction of voxels with the correct label.
+    """
+    def __init__(self, prediction, truth, zoom, n_classes=None,
+                 include_background=False):
+        """
+        Initialises the MultiClassMetrics class instance.
+
+        Parameters
+        ----------
+        prediction : np.ndarray
+            An array of non-negative ints, the predicted label of each voxel.
+        truth : np.ndarray
+            An array of non-negative ints, the ground truth label of each
+            voxel.
+        zoom : tuple
+            The length of each voxel dimension in millimeters.
+        n_classes : int, optional
+            The number of classes, defaults to one more than the greatest
+            label in either map.
+        include_background : bool, default False
+            Whether class 0 counts towards the macro and micro averages.
+        """
+        prediction, truth = np.asarray(prediction), np.asarray(truth)
+        if prediction.shape != truth.shape:
+            raise ValueError('The label maps must be the same shape, not {} '
+                             'and {}.'.format(prediction.shape, truth.shape))
+        for labels in (prediction, truth):
+            if labels.dtype.kind not in 'biu':
+                raise ValueError('The label maps must be ints, not '
+                                 '{}.'.format(labels.dtype))
+        if n_classes is None:
+            n_classes = 1 + max([int(labels.max()) for labels in
+                                 (prediction, truth) if labels.size] or [0])
+        self.n_classes = int(n_classes)
+        self.zoom = zoom
+        self.include_background = include_background
+        self.confusion_matrix = _confusion_matrix(prediction, truth,
+                                                  self.n_classes)
+
+        counts = self._counts()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for name, formula in _OVERLAP_METRICS.items():
+                setattr(self, name, formula(**counts))
+        voxel_volume = np.prod(zoom) / 1000
+        self.true_volume = self.confusion_matrix.sum(axis=1) * voxel_volume
+        self.predicted_volume = self.confusion_matrix.sum(axis=0) * \
+            voxel_volume
+        self.volume_difference = self.predicted_volume - self.true_volume
+        self.accuracy = np.trace(self.confusion_matrix) / \
+            self.confusion_matrix.sum()
+
+    def get_dict(self):
+        """
+        Generate a dictionary of the averaged overlap metrics.
+
+        Returns
+        -------
+        metrics : dict
+            The ``accuracy`` and, for each overlap metric, its macro average
+            (the mean over classes present in either mask, e.g.
+            ``macro_dice``) and micro average (from the confusion counts
+            summed over classes, e.g. ``micro_dice``).
+        """
+        first = 0 if self.include_background else 1
+        counts = {key: np.sum(value[first:])
+                  for key, value in self._counts().items()}
+        metrics = {'accuracy': self.accuracy}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for name, formula in _OVERLAP_METRICS.items():
+                scores = getattr(self, name)[first:]
+                metrics['macro_' + name] = np.nan if \
+                    np.all(np.isnan(scores)) else np.nanmean(scores)
+                metrics['micro_' + name] = formula(**counts)
+        return metrics
+
+    def get_df(self):
+        """
+        Generate a Pandas DataFrame of the metrics of each class.
+
+        Returns
+        -------
+        df : pd.DataFrame
+            One row per class, indexed by label, with the overlap metrics and
+            the volumes (in milliliters).
+        """
+        columns = list(_OVERLAP_METRICS) + ['true_volume', 'predicted_volume',
+                                            'volume_difference']
+        df = pd.DataFrame({name: getattr(self, name) for name in columns},
+                          index=pd.RangeIndex(self.n_classes, name='label'))
+        return df
+
+    def _counts(self):
+        """The one-vs-rest confusion counts of each class."""
+        tp = np.diag(self.confusion_matrix)
+        fp = self.confusion_matrix.sum(axis=0) - tp
+        fn = self.confusion_matrix.sum(axis=1) - tp
+        tn = self.confusion_matrix.sum() - tp - fp - fn
+        return {'tp': tp, 'fp': fp, 'fn': fn, 'tn': tn}
+
+
+def _confusion_matrix(prediction, truth, n_classes):
+    """
+    The confusion matrix of a pair of label maps, from a bincount of
+    ``truth * n_classes + prediction`` over chunks of the first axis.
+    """
+    matrix = np.zeros(n_classes * n_classes, np.int64)
+    if truth.size == 0:
+        return matrix.reshape(n_classes, n_classes)
+    prediction, truth = np.atleast_1d(prediction), np.atleast_1d(truth)
+    # Slices along the first axis, which keep the memory layout of the maps
+    rows = max(_CHUNK_SIZE // int(np.prod(truth.shape[1:])), 1)
+    for start in range(0, len(truth), rows):
+        truth_chunk = truth[start:start + rows]
+        prediction_chunk = prediction[start:start + rows]
+        for labels in (truth_chunk, prediction_chunk):
+            if labels.min() < 0 or labels.max() >= n_classes:
+                raise ValueError('The labels must be between 0 and {}, not '
+                                 '{} to {}.'.format(n_classes - 1,
+                                                    labels.min(),
+                                                    labels.max()))
+        paired = truth_chunk.astype(np.int64) * n_classes
+        paired += prediction_chunk
+        matrix += np.bincount(paired.ravel(), minlength=n_classes * n_classes)
+    return matrix.reshape(n_classes, n_classes)
@@ -0,0 +1,170 @@
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                as_completed, wait)
+from multiprocessing import shared_memory
+import os
+
+import numpy as np
+
+from .metrics import SegmentationMetrics
+from .surface_distance.metrics import _memory_order
+
+
+def parallel_metrics(cases, workers=None, percentile=95, symmetric=True,
+                     packed=False):
+    """
+    Calculate the segmentation accuracy metrics of many cases across a pool
+    of processes, passing the masks through shared memory.
+
+    Each mask pair is thresholded straight into a shared memory segment
+    rather than being pickled to a worker, the workers map the segment
+    without copying it and only send back the dictionary of metrics.
+    Segments are returned to a pool once a case is done and reused for
+    later cases, so only a few are ever allocated.
+
+    Parameters
+    ----------
+    cases : iterable
+        ``(prediction, truth, zoom)`` tuples, where ``prediction`` and
+        ``truth`` are arrays of bools or ints (0 and 1) of the same shape
+        and ``zoom`` is the length of each voxel dimension in millimeters.
+        The cases are read lazily, a few more than the number of workers are
+        held in memory at once.
+    workers : int, optional
+        The number of worker processes. Defaults to the number of CPUs.
+    percentile : int, default 95
+        The percentile of surface distances to define as the Hausdorff
+        distance.
+    symmetric : bool, default True
+        Whether to calculate the symmetric mean surface distance.
+    packed : bool, default False
+        If true, the masks are stored as bits rather than bytes, using an
+        eighth of the shared memory at the cost of each worker unpacking its
+        own copy.
+
+    Returns
+    -------
+    metrics : list of dict
+        The ``SegmentationMetrics.get_dict`` of each case, in the same order
+        as ``cases``.
+    """
+    workers = workers or os.cpu_count()
+    pool = _SegmentPool()
+    results = {}
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            in_flight = {}
+            for index, (prediction, truth, zoom) in enumerate(cases):
+                if len(in_flight) >= 2 * workers:
+                    # Wait for a free segment before reading any more cases
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    _collect(done, in_flight, pool, results)
+                prediction, truth = np.asarray(prediction), np.asarray(truth)
+                if prediction.shape != truth.shape:
+                    raise ValueError('The masks of case {} must be the same '
+                                     'shape, not {} and {}.'.format(
+                                         index, prediction.shape,
+                                         truth.shape))
+                order = _memory_order(prediction)
+                segment = pool.acquire(2 * _mask_nbytes(prediction.size,
+                                                        packed))
+                _write_masks(segment.buf, (prediction, truth), order, packed)
+                future = executor.submit(
+                    _shared_case_metrics, segment.name, prediction.shape,
+                    order, packed, tuple(zoom), percentile, symmetric)
+                in_flight[future] = (index, segment)
+            _collect(as_completed(in_flight), in_flight, pool, results)
+    finally:
+        pool.close()
+    return [results[index] for index in range(len(results))]
+
+
+class _SegmentPool:
+    """
+    Shared memory segments that are reused across cases, the smallest free
+    segment that is large enough is handed out before allocating another.
+    """
+    def __init__(self):
+        self._segments = []
+        self._free = []
+
+    def acquire(self, nbytes):
+        fits = [segment for segment in self._free if segment.size >= nbytes]
+        if fits:
+            segment = min(fits, key=lambda segment: segment.size)
+            self._free.remove(segment)
+            return segment
+        segment = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        self._segments.append(segment)
+        return segment
+
+    def release(self, segment):
+        self._free.append(segment)
+
+    def close(self):
+        for segment in self._segments:
+            segment.close()
+            segment.unlink()
+        self._segments = []
+        self._free = []
+
+
+def _collect(done, in_flight, pool, results):
+    for future in list(done):
+        index, segment = in_flight.pop(future)
+        pool.release(segment)
+        results[index] = future.result()
+
+
+def _mask_nbytes(size, packed):
+    return (size + 7) // 8 if packed else size
+
+
+def _write_masks(buffer, masks, order, packed):
+    """Threshold the masks into consecutive blocks of a shared buffer."""
+    size = masks[0].size
+    nbytes = _mask_nbytes(size, packed)
+    for i, mask in enumerate(masks):
+        if packed:
+            block = np.frombuffer(buffer, np.uint8, nbytes, i * nbytes)
+            block[:] = np.packbits((mask > 0.5).ravel(order=order))
+            continue
+        block = np.frombuffer(buffer, bool, size, i * size).reshape(
+            mask.shape, order=order)
+        if mask.dtype == bool:
+            block[...] = mask
+        else:
+            np.greater(mask, 0.5, out=block)
+
+
+def _read_masks(buffer, shape, order, packed):
+    """Views of the masks written by ``_write_masks``."""
+    size = int(np.prod(shape))
+    nbytes = _mask_nbytes(size, packed)
+    masks = []
+    for i in range(2):
+        if packed:
+            flat = np.unpackbits(np.frombuffer(buffer, np.uint8, nbytes,
+                                               i * nbytes),
+                                 count=size).view(bool)
+        else:
+            flat = np.frombuffer(buffer, bool, size, i * size)
+        masks.append(flat.reshape(shape, order=order))
+    return masks
+
+
+# The segments each worker process has attached to, segments are reused so
+# they are only opened once
+_attached = {}
+
+
+def _attach(name):
+    if name not in _attached:
+        _attached[name] = shared_memory.SharedMemory(name)
+    return _attached[name]
+
+
+def _shared_case_metrics(name, shape, order, packed, zoom, percentile,
+                         symmetric):
+    prediction, truth = _read_masks(_attach(name).buf, shape, order, packed)
+    return SegmentationMetrics(prediction, truth, zoom, percentile,
+                               symmetric).get_dict()
@@ -0,0 +1,126 @@
+import asyncio
+import inspect
+
+from .metrics import SegmentationMetrics
+
+
+async def metrics_pipeline(cases, load=None, prefetch=2, executor=None,
+                           percentile=95, symmetric=True):
+    """
+    Asynchronously calculate the segmentation accuracy metrics of a stream
+    of cases, loading the next cases while the current ones are evaluated.
+
+    Up to ``prefetch`` cases are loaded and evaluated concurrently, loading
+    in threads (or as coroutines) and evaluating in ``executor``. The results
+    are yielded as they complete and once ``prefetch`` results are waiting
+    to be consumed no more cases are started, so a slow consumer (e.g. one
+    writing results to network storage) holds back loading rather than
+    building up masks in memory.
+
+    Parameters
+    ----------
+    cases : iterable or async iterable
+        The cases to evaluate, passed to ``load`` one at a time.
+    load : callable, optional
+        Turns a case (e.g. a pair of file paths) into a ``(prediction,
+        truth, zoom)`` tuple, the arguments of SegmentationMetrics. A
+        coroutine function is awaited, any other function is run in a
+        thread. Defaults to the cases being ``(prediction, truth, zoom)``
+        tuples already.
+    prefetch : int, default 2
+        The maximum number of cases being loaded or evaluated at once.
+    executor : concurrent.futures.Executor, optional
+        Where the metrics are calculated. Defaults to the event loop's
+        default thread pool, a ProcessPoolExecutor avoids contention for the
+        GIL but copies each mask pair to the worker.
+    percentile : int, default 95
+        The percentile of surface distances to define as the Hausdorff
+        distance.
+    symmetric : bool, default True
+        Whether to calculate the symmetric mean surface distance.
+
+    Yields
+    ------
+    case : object
+        The case, as given in ``cases``.
+    metrics : dict
+        The ``SegmentationMetrics.get_dict`` of the case.
+    """
+    if prefetch < 1:
+        raise ValueError('prefetch must be at least 1, not '
+                         '{}'.format(prefetch))
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(prefetch)
+    results = asyncio.Queue(maxsize=prefetch)
+    done = object()
+
+    async def run_case(case):
+        try:
+            prediction, truth, zoom = await _load(load, case)
+            metrics = await loop.run_in_executor(
+                executor, _case_metrics, prediction, truth, zoom, percentile,
+                symmetric)
+            del prediction, truth
+            await results.put((case, metrics, None))
+        except Exception as error:
+            await results.put((case, None, error))
+        finally:
+            slots.release()
+
+    async def produce():
+        tasks = set()
+        try:
+            async for case in _iterate(cases):
+                await slots.acquire()
+                task = asyncio.create_task(run_case(case))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        except Exception as error:
+            await results.put((None, None, error))
+        else:
+            await results.put((None, None, done))
+        finally:
+            # Only left over if the consumer stopped early
+            for task in tasks:
+                task.cancel()
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            case, metrics, error = await results.get()
+            if error is done:
+                break
+            if error is not None:
+                raise error
+            yield case, metrics
+        await producer
+    finally:
+        if not producer.done():
+            producer.cancel()
+            try:
+                await producer
+            except asyncio.CancelledError:
+                pass
+
+
+async def _load(load, case):
+    if load is None:
+        return case
+    if inspect.iscoroutinefunction(load):
+        return await load(case)
+    return await asyncio.to_thread(load, case)
+
+
+async def _iterate(cases):
+    if hasattr(cases, '__aiter__'):
+        async for case in cases:
+            yield case
+    else:
+        for case in cases:
+            yield case
+
+
+def _case_metrics(prediction, truth, zoom, percentile, symmetric):
+    return SegmentationMetrics(prediction, truth, zoom, percentile,
+                               symmetric).get_dict()
@@ -0,0 +1,226 @@
+import inspect
+
+
+_INTERMEDIATES = {}
+_METRICS = {}
+
+# The values every evaluation starts from
+_INPUTS = ('prediction', 'truth', 'zoom')
+# Metrics become attributes of SegmentationMetrics, so can't take the names
+# of its other attributes
+_RESERVED_NAMES = frozenset(('prediction', 'truth', 'zoom', 'metrics',
+                             'get_dict', 'get_df', 'get_slice_metrics'))
+
+
+class _Step:
+    def __init__(self, name, function, requires, label=None):
+        self.name = name
+        self.function = function
+        self.requires = requires if callable(requires) else tuple(requires)
+        self.label = label or name.replace('_', ' ').title()
+        self.parameters = tuple(inspect.signature(function).parameters)
+
+    @property
+    def options(self):
+        # Anything that isn't an input or intermediate is an option of the
+        # step
+        return tuple(p for p in self.parameters if p not in _INPUTS and
+                     p not in _INTERMEDIATES)
+
+    def requires_for(self, inputs):
+        """The requirements of the step for the given inputs."""
+        if callable(self.requires):
+            return tuple(self.requires(**inputs))
+        return self.requires
+
+
+def register_intermediate(name, requires=()):
+    """
+    Register a function computing a value shared between metrics e.g. the
+    confusion counts or the surface distances.
+
+    Parameters
+    ----------
+    name : str
+        The name metrics (and other intermediates) require it by.
+    requires : tuple of str or callable, optional
+        The names of the inputs (``prediction``, ``truth`` and ``zoom``) and
+        intermediates it is computed from. They are passed to the function
+        as keyword arguments, along with any of the evaluator's options
+        matching its other parameters. Intermediates computed differently
+        from different kinds of mask can instead give a function of the
+        inputs returning the names.
+
+    Returns
+    -------
+    decorator : callable
+        Registers the function and returns it unchanged.
+    """
+    def decorator(function):
+        _INTERMEDIATES[name] = _Step(name, function, requires)
+        return function
+    return decorator
+
+
+def register_metric(name, requires, label=None):
+    """
+    Register a metric so it can be requested from a MetricEvaluator or
+    SegmentationMetrics.
+
+    Parameters
+    ----------
+    name : str
+        The key of the metric in ``get_dict``, which must not be the name of
+        another attribute of SegmentationMetrics e.g. ``get_df``.
+    requires : tuple of str
+        The names of the inputs and intermediates the metric is computed
+        from, passed to the function as keyword arguments. Other parameters
+        of the function are options e.g. ``percentile``.
+    label : str, optional
+        The name of the metric in ``get_df``, defaults to ``name`` in title
+        case.
+
+    Returns
+    -------
+    decorator : callable
+        Registers the function and returns it unchanged.
+    """
+    if name in _RESERVED_NAMES or name.startswith('__'):
+        raise ValueError('{!r} is reserved, it is already an attribute of '
+                         'SegmentationMetrics.'.format(name))
+
+    def decorator(function):
+        _METRICS[name] = _Step(name, function, requires, label)
+        return function
+    return decorator
+
+
+def available_metrics():
+    """
+    The names of all registered metrics.
+
+    Returns
+    -------
+    names : list of str
+        The metric names, in the order they were registered.
+    """
+    return list(_METRICS)
+
+
+def metric_label(name):
+    """The name of a registered metric in ``get_df``."""
+    return _get_metric(name).label
+
+
+class MetricEvaluator:
+    """
+    Computes the requested metrics of a pair of masks, computing each
+    intermediate they share exactly once.
+
+    Intermediates are computed on demand and cached, so metrics requested
+    from the same evaluator later reuse them too.
+
+    Parameters
+    ----------
+    prediction : np.ndarray or EncodedMask
+        The predicted mask.
+    truth : np.ndarray or EncodedMask
+        The ground truth mask.
+    zoom : tuple
+        The length of each voxel dimension in millimeters.
+    **options
+        Options of the metrics e.g. ``percentile`` and ``symmetric``.
+    """
+    def __init__(self, prediction, truth, zoom, **options):
+        self.options = options
+        self._values = {'prediction': prediction, 'truth': truth,
+                        'zoom': zoom}
+
+    def plan(self, metrics):
+        """
+        The intermediates needed by ``metrics``, in the order they will be
+        computed.
+
+        Parameters
+        ----------
+        metrics : iterable of str
+            The names of the metrics.
+
+        Returns
+        -------
+        plan : list of str
+            Every intermediate needed by the metrics, each listed once after
+            all of its own requirements.
+        """
+        order = []
+        for name in metrics:
+            self._visit(self._requires(_get_metric(name)), order, ())
+        return order
+
+    def compute(self, metrics):
+        """
+        Compute metrics.
+
+        Parameters
+        ----------
+        metrics : iterable of str
+            The names of the metrics.
+
+        Returns
+        -------
+        values : dict
+            The value of each metric, in the order requested.
+        """
+        metrics = list(metrics)
+        steps = [_get_metric(name) for name in metrics]
+        self._check_options()
+        for name in self.plan(metrics):
+            self[name]
+        return {step.name: self._call(step) for step in steps}
+
+    def __getitem__(self, name):
+        """The value of an input or intermediate, computed if needed."""
+        if name not in self._values:
+            if name not in _INTERMEDIATES:
+                raise KeyError('Unknown intermediate {!r}.'.format(name))
+            self._values[name] = self._call(_INTERMEDIATES[name])
+        return self._values[name]
+
+    def _call(self, step):
+        kwargs = {name: self[name] for name in self._requires(step)}
+        kwargs.update({name: self.options[name] for name in step.options
+                       if name in self.options})
+        return step.function(**kwargs)
+
+    def _visit(self, requires, order, path):
+        for name in requires:
+            if name in _INPUTS or name in order:
+                continue
+            if name in path:
+                raise ValueError('Circular requirement of {!r}.'.format(name))
+            if name not in _INTERMEDIATES:
+                raise ValueError('Unknown intermediate {!r}.'.format(name))
+            self._visit(self._requires(_INTERMEDIATES[name]), order,
+                        path + (name,))
+            order.append(name)
+
+    def _requires(self, step):
+        return step.requires_for({name: self._values[name]
+                                  for name in _INPUTS})
+
+    def _check_options(self):
+        # Options may be shared between evaluations of different metrics,
+        # so only catch those no metric takes e.g. typos
+        accepted = {option for step in list(_METRICS.values()) +
+                    list(_INTERMEDIATES.values()) for option in step.options}
+        unknown = sorted(set(self.options) - accepted)
+        if unknown:
+            raise ValueError('No metric takes the option(s) {}.'.format(
+                ', '.join(unknown)))
+
+
+def _get_metric(name):
+    if name not in _METRICS:
+        raise ValueError('Unknown metric {!r}, the available metrics are '
+                         '{}.'.format(name, ', '.join(_METRICS)))
+    return _METRICS[name]
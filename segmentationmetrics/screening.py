@@ -0,0 +1,256 @@
+import numpy as np
+from scipy import spatial
+
+from . import surface_distance as sd
+from .metrics import (_as_bool_mask, _dice, _foreground_bounding_box,
+                      confusion_counts)
+from .surface_distance.metrics import _add_coarse_distances, _find_surfels
+
+
+def approximate_surface_metrics(prediction, truth, zoom, factor=2,
+                                percentile=95, symmetric=True):
+    """
+    Quickly estimate the surface based metrics with a worst-case error bound.
+
+    The distance transform is computed on a grid downsampled by ``factor``,
+    see ``surface_distance.compute_surface_distances_approximate``. Every
+    estimate is within ``max_error_mm`` of the exact value, so cases can be
+    triaged and only those close to a decision threshold need computing
+    exactly with SegmentationMetrics.
+
+    Parameters
+    ----------
+    prediction : np.ndarray
+        An array of bools or ints (0 and 1) representing the predicted
+        mask.
+    truth : np.ndarray
+        An array of bools or ints (0 and 1) representing the ground truth
+        mask.
+    zoom : tuple
+        The length of each voxel dimension in millimeters.
+    factor : int or tuple, default 2
+        The downsampling factor of the distance transform, for all axes or
+        for each axis.
+    percentile : int, default 95
+        The percentile of surface distances to define as the Hausdorff
+        distance.
+    symmetric : bool, default True
+        Whether to estimate the symmetric mean surface distance.
+
+    Returns
+    -------
+    metrics : dict
+        The estimated ``mean_surface_distance`` and ``hausdorff_distance``
+        and ``max_error_mm``, the worst-case absolute error of both (in
+        millimeters).
+    """
+    surface_dist = sd.compute_surface_distances_approximate(
+        _as_bool_mask(prediction), _as_bool_mask(truth), zoom, factor)
+    msd = sd.compute_average_surface_distance(surface_dist)
+    if symmetric:
+        msd = np.mean(msd)
+    return {'mean_surface_distance': msd,
+            'hausdorff_distance': sd.compute_robust_hausdorff(surface_dist,
+                                                              percentile),
+            'max_error_mm': surface_dist['max_error_mm']}
+
+
+def qa_gate(prediction, truth, zoom, min_dice=None, max_hausdorff=None,
+            percentile=95, factors=(4, 2)):
+    """
+    Decide whether a prediction passes quality thresholds, e.g. Dice of at
+    least 0.9 and a 95th percentile Hausdorff distance of at most 5 mm,
+    computing only as much as the decision needs.
+
+    The Dice score comes from the overlap counts within the bounding box of
+    the masks and a failure stops there. The Hausdorff distance is never
+    computed, only whether enough of each surface is within
+    ``max_hausdorff`` of the other. Distance transforms on grids downsampled
+    by each of ``factors`` bound the distance of every surface element (see
+    ``surface_distance.compute_surface_distances_approximate``) and the gate
+    stops as soon as the surface elements known to be within, or beyond,
+    the limit decide the outcome. Otherwise only the surface elements whose
+    bounds straddle the limit are checked, with a nearest neighbour search
+    that goes no further than the limit.
+
+    The decision is the same as comparing the metrics of
+    SegmentationMetrics with the thresholds, for any percentile and limit
+    (up to the rounding of the summed surface areas).
+
+    Parameters
+    ----------
+    prediction : np.ndarray
+        An array of bools or ints (0 and 1) representing the predicted
+        mask.
+    truth : np.ndarray
+        An array of bools or ints (0 and 1) representing the ground truth
+        mask.
+    zoom : tuple
+        The length of each voxel dimension in millimeters.
+    min_dice : float, optional
+        The lowest passing Dice score, not checked if ``None``.
+    max_hausdorff : float, optional
+        The greatest passing robust Hausdorff distance in millimeters, not
+        checked if ``None``.
+    percentile : int, default 95
+        The percentile of surface distances to define as the Hausdorff
+        distance.
+    factors : tuple, default (4, 2)
+        The downsampling factors of the distance transforms bounding the
+        surface distances, from coarsest to finest.
+
+    Returns
+    -------
+    result : dict
+        Whether the prediction ``passed``, the ``reason`` for the decision,
+        the ``dice`` score (``None`` if not checked) and the number of
+        surface elements checked with the nearest neighbour search
+        (``exact_surfels``).
+    """
+    result = {'passed': True, 'dice': None, 'exact_surfels': 0}
+    prediction, truth = np.asarray(prediction), np.asarray(truth)
+    if prediction.shape != truth.shape:
+        raise ValueError('The masks must be the same shape, not {} and '
+                         '{}.'.format(prediction.shape, truth.shape))
+    if len(factors) == 0:
+        raise ValueError('At least one downsampling factor is needed.')
+    # Both checks only need the masks thresholded within the bounding box of
+    # their foreground
+    size = truth.size
+    box = _foreground_bounding_box(prediction, truth)
+    prediction, truth = _as_bool_mask(prediction[box]), \
+        _as_bool_mask(truth[box])
+    reasons = []
+    if min_dice is not None:
+        result['dice'] = _dice(**confusion_counts(prediction, truth, size))
+        if not result['dice'] >= min_dice:
+            result.update(passed=False,
+                          reason='Dice {:.4g} is below {:.4g}.'.format(
+                              result['dice'], min_dice))
+            return result
+        reasons.append('Dice {:.4g} is at least {:.4g}.'.format(
+            result['dice'], min_dice))
+    if max_hausdorff is not None:
+        passed, reason, result['exact_surfels'] = _hausdorff_within(
+            prediction, truth, zoom, max_hausdorff, percentile, factors)
+        if not passed:
+            result.update(passed=False, reason=reason)
+            return result
+        reasons.append(reason)
+    result['reason'] = ' '.join(reasons) or 'No thresholds to check.'
+    return result
+
+
+def _hausdorff_within(prediction, truth, zoom, max_hausdorff, percentile,
+                      factors):
+    """
+    Whether the robust Hausdorff distance is at most ``max_hausdorff``, the
+    reason and the number of exact distances computed.
+    """
+    spacing_mm = np.asarray(zoom, np.float64)
+    label = 'The {}th percentile Hausdorff distance is'.format(percentile)
+    passing = '{} at most {:.4g} mm.'.format(label, max_hausdorff)
+    surfels = _find_surfels(prediction, truth, spacing_mm)
+    if surfels is None or min(len(surfels['borders_gt']),
+                              len(surfels['borders_pred'])) == 0:
+        if max_hausdorff == np.inf:
+            return True, passing, 0
+        return False, '{} infinite, a mask is empty.'.format(label), 0
+
+    # As compute_surface_distances(prediction, truth) in SegmentationMetrics
+    directions = (('gt_to_pred', 'gt', 'pred'), ('pred_to_gt', 'pred', 'gt'))
+    lower = {direction: np.zeros(len(surfels['borders_' + side]))
+             for direction, side, _ in directions}
+    upper = {direction: np.full(len(surfels['borders_' + side]), np.inf)
+             for direction, side, _ in directions}
+    failing = '{} more than {:.4g} mm'.format(label, max_hausdorff)
+
+    def decide(stage):
+        # Each direction passes if at least percentile % of its surface is
+        # within the limit, fail as soon as one direction can't
+        decided = True
+        for direction, side, _ in directions:
+            areas = surfels['surfel_areas_' + side]
+            if not _enough_within(lower[direction] <= max_hausdorff, areas,
+                                  percentile):
+                return False, '{} ({}).'.format(failing, stage)
+            decided &= _enough_within(upper[direction] <= max_hausdorff,
+                                      areas, percentile)
+        return (True, passing) if decided else None
+
+    for factor in factors:
+        factor = np.broadcast_to(np.asarray(factor, np.int64),
+                                 spacing_mm.shape)
+        max_error_mm = np.linalg.norm((factor - 1) * spacing_mm)
+        _add_coarse_distances(surfels, spacing_mm, factor)
+        for direction, _, _ in directions:
+            distances = surfels['distances_' + direction]
+            lower[direction] = np.maximum(lower[direction],
+                                          distances - max_error_mm)
+            upper[direction] = np.minimum(upper[direction],
+                                          distances + max_error_mm)
+        decision = decide('from the distance bounds at {} downsampling'.format(
+            'x'.join(str(f) for f in factor)))
+        if decision is not None:
+            return decision + (0,)
+
+    # Only the surface elements that may be either side of the limit need
+    # to know whether their nearest neighbour is within it
+    exact = 0
+    for direction, side, other in directions:
+        undecided = (lower[direction] <= max_hausdorff) & \
+            (upper[direction] > max_hausdorff)
+        within = _within_limit(surfels['borders_' + side][undecided],
+                               surfels['borders_' + other], spacing_mm,
+                               max_hausdorff)
+        exact += int(np.count_nonzero(undecided))
+        # Settle the bounds of each surface element either side of the limit
+        lower[direction][undecided] = np.where(within, 0, np.inf)
+        upper[direction][undecided] = np.where(within, 0, np.inf)
+        decision = decide('from the distances up to the limit')
+        if decision is not None and not decision[0]:
+            return decision + (exact,)
+    return decide('from the distances up to the limit') + (exact,)
+
+
+def _within_limit(points, others, spacing_mm, limit):
+    """
+    Whether each point is within ``limit`` mm of the closest of ``others``,
+    searching no further than the limit.
+    """
+    if len(points) == 0:
+        return np.zeros(0, bool)
+    reach = np.ceil(limit / spacing_mm).astype(np.int64)
+    near = np.all((others >= points.min(axis=0) - reach) &
+                  (others <= points.max(axis=0) + reach), axis=1)
+    if not near.any():
+        return np.zeros(len(points), bool)
+    others = others[near]
+    tree = spatial.cKDTree(others * spacing_mm, balanced_tree=False,
+                           compact_nodes=False)
+    # Neighbours are only found strictly within the bound (compared squared,
+    # so a bound of 0 finds nothing), so search a little beyond the limit and
+    # recompute the distances of the neighbours found as the distance
+    # transform computes them
+    distances, nearest = tree.query(
+        points * spacing_mm, workers=-1,
+        distance_upper_bound=limit * (1 + 1e-9) + 1e-6)
+    found = np.isfinite(distances)
+    distances[found] = np.sqrt(np.sum(
+        ((points[found] - others[nearest[found]]) * spacing_mm) ** 2, axis=1))
+    return distances <= limit
+
+
+def _enough_within(within, surfel_areas, percentile):
+    """
+    Whether the percentile of the distances is within a limit, given which
+    surface elements are. As in ``surface_distance.compute_robust_hausdorff``
+    the percentile is the distance of the first surface element (by
+    distance) whose cumulative area reaches it, which is within the limit if
+    at least one surface element is and they reach it, or if all are.
+    """
+    if within.all():
+        return True
+    return bool(within.any()) and \
+        np.sum(surfel_areas[within]) / np.sum(surfel_areas) >= \
+        percentile / 100.0
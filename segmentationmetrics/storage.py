@@ -0,0 +1,253 @@
+import itertools
+import json
+import struct
+import zlib
+
+import numpy as np
+
+from .encoded import EncodedMask, _bbox_slices
+from .surface_distance.metrics import _compute_bounding_box
+
+_MAGIC = b'SMCHUNK\x00'
+_FORMAT_VERSION = 1
+# The default chunks hold about this many voxels, 4 KiB once bit-packed
+_CHUNK_VOXELS = 2 ** 15
+
+
+class ChunkedMask(EncodedMask):
+    """
+    A binary mask of any dimension stored as zlib compressed, bit-packed
+    chunks, with an index of the foreground count and bounding box of every
+    occupied chunk.
+
+    Empty chunks aren't stored at all. The count and bounding box of the
+    mask come from the index without decoding anything and ``crop`` only
+    decompresses the chunks that intersect the requested region, so the
+    metrics of a small structure in a large scan only decode the few chunks
+    around it. Masks saved with ``save`` and opened with ``load`` also only
+    read those chunks from disk.
+    """
+    def __init__(self, shape, chunk_shape, chunks, path=None):
+        """
+        Parameters
+        ----------
+        shape : tuple
+            The shape of the mask.
+        chunk_shape : tuple
+            The shape of each chunk, the chunks at the far edge of each axis
+            may be smaller.
+        chunks : dict
+            For the index of each occupied chunk on the chunk grid, a dict
+            with its foreground ``count``, ``bbox`` (the smallest and greatest
+            foreground coordinates in the mask) and either the compressed
+            ``data`` or, for masks read from ``path``, the ``offset`` and
+            ``length`` of the data in the file.
+        path : str or os.PathLike, optional
+            The file the chunk data is read from, see ``load``.
+        """
+        self.shape = tuple(int(s) for s in shape)
+        self.chunk_shape = tuple(int(s) for s in chunk_shape)
+        if len(self.chunk_shape) != len(self.shape) or \
+                min(self.chunk_shape, default=1) < 1:
+            raise ValueError('The chunk shape {} does not fit a mask of shape '
+                             '{}.'.format(self.chunk_shape, self.shape))
+        self.chunks = {tuple(int(i) for i in index): chunk
+                       for index, chunk in chunks.items()}
+        self.path = path
+
+    @classmethod
+    def from_dense(cls, mask, chunk_shape=None):
+        """
+        Compress a dense mask into chunks.
+
+        Parameters
+        ----------
+        mask : np.ndarray
+            The mask, thresholded at 0.5 unless it is an array of bools.
+        chunk_shape : tuple, optional
+            The shape of each chunk, defaults to a cube of about 32k voxels
+            (32 x 32 x 32 in 3D).
+        """
+        mask = np.asarray(mask)
+        if mask.dtype != bool:
+            mask = mask > 0.5
+        if chunk_shape is None:
+            chunk_shape = (int(round(_CHUNK_VOXELS ** (1 / mask.ndim))),) * \
+                mask.ndim
+        chunk_shape = tuple(int(s) for s in chunk_shape)
+        chunks = {}
+        bbox_min, bbox_max = _compute_bounding_box(mask)
+        if bbox_min is not None:
+            # Only the chunks within the bounding box can be occupied
+            ranges = [range(lo // size, hi // size + 1) for lo, hi, size in
+                      zip(bbox_min, bbox_max, chunk_shape)]
+            for index in itertools.product(*ranges):
+                chunk = mask[_chunk_slices(index, chunk_shape)]
+                count = np.count_nonzero(chunk)
+                if count == 0:
+                    continue
+                origin = np.multiply(index, chunk_shape)
+                chunk_min, chunk_max = _compute_bounding_box(chunk)
+                chunks[index] = {'count': int(count),
+                                 'bbox': (chunk_min + origin,
+                                          chunk_max + origin),
+                                 'data': _encode(chunk)}
+        return cls(mask.shape, chunk_shape, chunks)
+
+    def count(self):
+        return sum(chunk['count'] for chunk in self.chunks.values())
+
+    def bounding_box(self):
+        if not self.chunks:
+            return None, None
+        boxes = [chunk['bbox'] for chunk in self.chunks.values()]
+        return (np.min([box[0] for box in boxes], axis=0).astype(np.int64),
+                np.max([box[1] for box in boxes], axis=0).astype(np.int64))
+
+    def crop(self, bbox_min, bbox_max):
+        bbox_min = np.asarray(bbox_min, np.int64)
+        bbox_max = np.asarray(bbox_max, np.int64)
+        crop = np.zeros(bbox_max - bbox_min + 1, bool)
+        indices = self._chunks_within(bbox_min, bbox_max)
+        for index, data in zip(indices, self._read(indices)):
+            origin = np.multiply(index, self.chunk_shape)
+            chunk = _decode(data, self._chunk_size(index))
+            # The part of the chunk within the crop
+            lo = np.maximum(bbox_min, origin)
+            hi = np.minimum(bbox_max, origin + chunk.shape - 1)
+            crop[_bbox_slices(lo - bbox_min, hi - bbox_min)] = \
+                chunk[_bbox_slices(lo - origin, hi - origin)]
+        return crop
+
+    def argwhere(self):
+        indices = sorted(self.chunks)
+        coordinates = [np.zeros((0, len(self.shape)), np.int64)]
+        for index, data in zip(indices, self._read(indices)):
+            chunk = _decode(data, self._chunk_size(index))
+            coordinates.append(np.argwhere(chunk) +
+                               np.multiply(index, self.chunk_shape))
+        return np.concatenate(coordinates)
+
+    def intersection_count(self, other):
+        if not isinstance(other, ChunkedMask) or \
+                other.chunk_shape != self.chunk_shape:
+            return super().intersection_count(other)
+        # Only chunks occupied in both masks can overlap
+        indices = [index for index in self.chunks if index in other.chunks
+                   and _boxes_overlap(self.chunks[index]['bbox'],
+                                      other.chunks[index]['bbox'])]
+        count = 0
+        for index, data, other_data in zip(indices, self._read(indices),
+                                           other._read(indices)):
+            # The chunks are bit-packed the same way, so AND the bytes
+            count += int(np.unpackbits(
+                np.frombuffer(zlib.decompress(data), np.uint8) &
+                np.frombuffer(zlib.decompress(other_data), np.uint8)).sum())
+        return count
+
+    def save(self, path):
+        """
+        Write the mask to a file, a JSON header with the chunk index followed
+        by the compressed chunks.
+
+        Parameters
+        ----------
+        path : str or os.PathLike
+            The file to write.
+        """
+        indices = sorted(self.chunks)
+        payloads = self._read(indices)
+        index, offset = [], 0
+        for key, data in zip(indices, payloads):
+            chunk = self.chunks[key]
+            index.append({'index': list(key),
+                          'count': chunk['count'],
+                          'bbox': [np.asarray(chunk['bbox'][0]).tolist(),
+                                   np.asarray(chunk['bbox'][1]).tolist()],
+                          'offset': offset,
+                          'length': len(data)})
+            offset += len(data)
+        header = json.dumps({'version': _FORMAT_VERSION,
+                             'shape': list(self.shape),
+                             'chunk_shape': list(self.chunk_shape),
+                             'chunks': index},
+                            separators=(',', ':')).encode()
+        with open(path, 'wb') as f:
+            f.write(_MAGIC)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            for data in payloads:
+                f.write(data)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Open a mask written by ``save``. Only the header is read, chunks are
+        read from the file when they are decoded.
+
+        Parameters
+        ----------
+        path : str or os.PathLike
+            The file to read.
+
+        Returns
+        -------
+        mask : ChunkedMask
+            The mask.
+        """
+        with open(path, 'rb') as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError('{} is not a chunked mask file.'.format(path))
+            header_length, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(header_length))
+        if header.get('version') != _FORMAT_VERSION:
+            raise ValueError('Unsupported chunked mask version {}.'.format(
+                header.get('version')))
+        start = len(_MAGIC) + 8 + header_length
+        chunks = {tuple(chunk['index']): {
+            'count': chunk['count'],
+            'bbox': (np.array(chunk['bbox'][0]), np.array(chunk['bbox'][1])),
+            'offset': start + chunk['offset'],
+            'length': chunk['length']} for chunk in header['chunks']}
+        return cls(header['shape'], header['chunk_shape'], chunks, path)
+
+    def _chunks_within(self, bbox_min, bbox_max):
+        """The indices of the occupied chunks intersecting a region."""
+        return [index for index, chunk in self.chunks.items()
+                if _boxes_overlap(chunk['bbox'], (bbox_min, bbox_max))]
+
+    def _chunk_size(self, index):
+        return tuple(min(size, n - i * size) for i, size, n in
+                     zip(index, self.chunk_shape, self.shape))
+
+    def _read(self, indices):
+        """The compressed data of each chunk, reading the file at most once."""
+        if self.path is None or not indices:
+            return [self.chunks[index]['data'] for index in indices]
+        data = []
+        with open(self.path, 'rb') as f:
+            for index in indices:
+                chunk = self.chunks[index]
+                f.seek(chunk['offset'])
+                data.append(f.read(chunk['length']))
+        return data
+
+
+def _chunk_slices(index, chunk_shape):
+    return tuple(slice(i * size, (i + 1) * size)
+                 for i, size in zip(index, chunk_shape))
+
+
+def _boxes_overlap(box_a, box_b):
+    return bool(np.all(np.asarray(box_a[0]) <= box_b[1]) and
+                np.all(np.asarray(box_b[0]) <= box_a[1]))
+
+
+def _encode(chunk):
+    return zlib.compress(np.packbits(chunk, axis=None).tobytes())
+
+
+def _decode(data, shape):
+    packed = np.frombuffer(zlib.decompress(data), np.uint8)
+    return np.unpackbits(packed, count=int(np.prod(shape))).astype(
+        bool).reshape(shape)
@@ -0,0 +1,227 @@
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+
+from .surface_distance.metrics import (_compute_borders,
+                                       _compute_bounding_box,
+                                       _crop_to_bounding_box,
+                                       _get_surface_lookup)
+
+_INDEX_VERSION = 1
+
+
+def summarise_mask(mask, zoom=None):
+    """
+    A small summary of a mask, enough to answer volume and empty mask
+    queries without loading it again.
+
+    Parameters
+    ----------
+    mask : np.ndarray
+        A binary mask, or a label map where each non-zero value is a label.
+    zoom : tuple, optional
+        The length of each voxel dimension in millimeters, needed for the
+        volume.
+
+    Returns
+    -------
+    summary : dict
+        The ``shape`` and ``zoom`` of the mask, its foreground
+        ``voxel_count``, ``volume`` (in milliliters, ``None`` without a
+        zoom), ``bounding_box`` (the first and last foreground index along
+        each axis, ``None`` if empty), ``surfel_count`` (the number of
+        surface voxels found by the surface distance pipeline, ``None``
+        unless 2D or 3D), ``label_counts`` (the number of voxels of each
+        non-zero label) and ``hash`` (of the shape, type and values).
+    """
+    mask = np.asarray(mask)
+    bbox_min, bbox_max = _compute_bounding_box(mask)
+    if bbox_min is None:
+        bounding_box = None
+        voxel_count = 0
+        surfel_count = 0 if mask.ndim in (2, 3) else None
+        label_counts = {}
+    else:
+        bounding_box = [bbox_min.tolist(), bbox_max.tolist()]
+        region = mask[tuple(slice(lo, hi + 1)
+                            for lo, hi in zip(bbox_min, bbox_max))]
+        labels, counts = np.unique(region, return_counts=True)
+        label_counts = {_label(label): int(count)
+                        for label, count in zip(labels, counts) if label != 0}
+        voxel_count = int(sum(label_counts.values()))
+        surfel_count = None
+        if mask.ndim in (2, 3):
+            _, kernel, full_true_neighbours = _get_surface_lookup(
+                (1,) * mask.ndim)
+            cropmask = _crop_to_bounding_box(mask, bbox_min, bbox_max)
+            surfel_count = int(np.count_nonzero(_compute_borders(
+                cropmask, kernel, full_true_neighbours)[1]))
+    volume = None
+    if zoom is not None:
+        volume = voxel_count * float(np.prod(zoom)) / 1000
+        zoom = [float(z) for z in zoom]
+    return {'shape': list(mask.shape),
+            'zoom': zoom,
+            'voxel_count': voxel_count,
+            'volume': volume,
+            'bounding_box': bounding_box,
+            'surfel_count': surfel_count,
+            'label_counts': label_counts,
+            'hash': mask_hash(mask)}
+
+
+def mask_hash(mask):
+    """
+    A hash of the shape, type and values of a mask, to tell whether a mask
+    has changed since it was summarised.
+
+    Parameters
+    ----------
+    mask : np.ndarray
+        The mask.
+
+    Returns
+    -------
+    hash : str
+        The hexadecimal BLAKE2b digest.
+    """
+    mask = np.ascontiguousarray(mask)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update('{}{}'.format(mask.dtype.str, mask.shape).encode())
+    digest.update(mask.view(np.uint8) if mask.size else b'')
+    return digest.hexdigest()
+
+
+class MaskIndex:
+    """
+    An index of the summaries of many masks (see ``summarise_mask``), kept
+    in one small JSON file alongside the masks.
+
+    Cohort queries such as the volume of each mask, which masks are empty
+    or the size of their bounding boxes are answered from the index without
+    loading any volumes, e.g. to skip empty cases in a batch run or start
+    with the largest.
+    """
+    def __init__(self, summaries=None):
+        """
+        Initialises the MaskIndex class instance.
+
+        Parameters
+        ----------
+        summaries : dict, optional
+            The summary of each mask, by name.
+        """
+        self.summaries = dict(summaries or {})
+
+    def add(self, name, mask, zoom=None):
+        """
+        Summarise a mask and add it to the index, replacing any summary of
+        the same name.
+
+        Parameters
+        ----------
+        name : str
+            The name of the mask e.g. its file name.
+        mask : np.ndarray
+            A binary mask or label map.
+        zoom : tuple, optional
+            The length of each voxel dimension in millimeters.
+        """
+        self.summaries[str(name)] = summarise_mask(mask, zoom)
+
+    def is_current(self, name, mask):
+        """
+        Whether a mask is in the index and unchanged since it was added.
+        """
+        return name in self.summaries and \
+            self.summaries[name]['hash'] == mask_hash(mask)
+
+    def empty_masks(self):
+        """The names of the masks with no foreground."""
+        return [name for name, summary in self.summaries.items()
+                if summary['voxel_count'] == 0]
+
+    def volumes(self):
+        """The volume of each mask in milliliters, by name."""
+        return {name: summary['volume']
+                for name, summary in self.summaries.items()}
+
+    def get_df(self):
+        """
+        Generate a Pandas DataFrame of the summaries.
+
+        Returns
+        -------
+        df : pd.DataFrame
+            One row per mask, indexed by name, with the voxel count, volume,
+            surfel count, bounding box volume (in voxels) and hash.
+        """
+        rows = {}
+        for name, summary in self.summaries.items():
+            box = summary['bounding_box']
+            rows[name] = {
+                'voxel_count': summary['voxel_count'],
+                'volume': summary['volume'],
+                'surfel_count': summary['surfel_count'],
+                'box_voxels': 0 if box is None else
+                int(np.prod(np.subtract(box[1], box[0]) + 1)),
+                'hash': summary['hash']}
+        return pd.DataFrame.from_dict(
+            rows, orient='index', columns=['voxel_count', 'volume',
+                                           'surfel_count', 'box_voxels',
+                                           'hash'])
+
+    def save(self, path):
+        """
+        Write the index to a JSON file.
+
+        Parameters
+        ----------
+        path : str or os.PathLike
+            The file to write.
+        """
+        with open(path, 'w') as f:
+            json.dump({'version': _INDEX_VERSION, 'masks': self.summaries},
+                      f, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read an index written by ``save``.
+
+        Parameters
+        ----------
+        path : str or os.PathLike
+            The file to read.
+
+        Returns
+        -------
+        index : MaskIndex
+            The index.
+        """
+        with open(path) as f:
+            contents = json.load(f)
+        if contents.get('version') != _INDEX_VERSION:
+            raise ValueError('Unsupported mask index version {}.'.format(
+                contents.get('version')))
+        return cls(contents['masks'])
+
+    def __contains__(self, name):
+        return name in self.summaries
+
+    def __getitem__(self, name):
+        return self.summaries[name]
+
+    def __len__(self):
+        return len(self.summaries)
+
+
+def _label(label):
+    # JSON keys are strings, keep integer labels readable
+    label = label.item()
+    if isinstance(label, bool) or \
+            isinstance(label, float) and label.is_integer():
+        label = int(label)
+    return str(label)
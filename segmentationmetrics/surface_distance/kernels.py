@@ -0,0 +1,154 @@
+"""Compiled kernels for finding surface elements, used when Numba is installed.
+
+`find_surfels` computes the neighbour code of every voxel of a cropped mask,
+tests it for a border and looks up its area in one loop, writing only the
+surface elements to compact arrays, where the NumPy code builds a full size
+array for each of those steps. The loops run in parallel over the first axis.
+
+Without Numba the functions run as plain Python, which is far too slow for
+real masks, so `ENABLED` is only true if Numba could be imported.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+try:
+  import numba  # pylint: disable=g-import-not-at-top
+except ImportError:
+  numba = None
+
+NUMBA_AVAILABLE = numba is not None
+# Whether `compute_surface_distances` uses these kernels, it can be set to
+# False to compare against the NumPy code.
+ENABLED = NUMBA_AVAILABLE
+
+if NUMBA_AVAILABLE:
+  _jit = numba.njit(cache=True)
+  _jit_parallel = numba.njit(parallel=True, cache=True)
+  _prange = numba.prange
+else:
+  _jit = _jit_parallel = lambda function: function
+  _prange = range
+
+
+@_jit
+def _neighbour_code(mask, weights, i, j, k):
+  """The code of the 2x2x2 neighbourhood ending at voxel (i, j, k)."""
+  code = 0
+  for a in range(2):
+    if i + a - 1 < 0:
+      continue
+    for b in range(2):
+      if j + b - 1 < 0:
+        continue
+      for c in range(2):
+        if k + c - 1 >= 0 and mask[i + a - 1, j + b - 1, k + c - 1]:
+          code += weights[a, b, c]
+  return code
+
+
+@_jit_parallel
+def _count_surfels(mask, weights, full_true_neighbours):
+  """The number of surface voxels in each plane along the first axis."""
+  counts = np.zeros(mask.shape[0], np.int64)
+  for i in _prange(mask.shape[0]):
+    count = 0
+    for j in range(mask.shape[1]):
+      for k in range(mask.shape[2]):
+        code = _neighbour_code(mask, weights, i, j, k)
+        if code != 0 and code != full_true_neighbours:
+          count += 1
+    counts[i] = count
+  return counts
+
+
+@_jit_parallel
+def _write_surfels(mask, weights, full_true_neighbours, table, starts,
+                   coordinates, codes, areas, background):
+  """Writes the surface voxels of each plane from its start in the outputs."""
+  for i in _prange(mask.shape[0]):
+    n = starts[i]
+    for j in range(mask.shape[1]):
+      for k in range(mask.shape[2]):
+        code = _neighbour_code(mask, weights, i, j, k)
+        if code != 0 and code != full_true_neighbours:
+          coordinates[n, 0] = i
+          coordinates[n, 1] = j
+          coordinates[n, 2] = k
+          codes[n] = code
+          areas[n] = table[code]
+          background[i, j, k] = False
+          n += 1
+
+
+@_jit_parallel
+def _gather(values, coordinates):
+  """The value at each of a list of 3D coordinates."""
+  result = np.empty(len(coordinates), values.dtype)
+  for n in _prange(len(coordinates)):
+    result[n] = values[coordinates[n, 0], coordinates[n, 1],
+                       coordinates[n, 2]]
+  return result
+
+
+def find_surfels(cropmask, kernel, full_true_neighbours, table):
+  """Finds the surface elements of a cropped mask.
+
+  The same surface elements as `_compute_borders` followed by a lookup of
+  their areas, in the same (C) order as indexing with its `borders`.
+
+  Args:
+    cropmask: The mask cropped by `_crop_to_bounding_box`, 2D or 3D.
+    kernel: The kernel encoding the 2x2 (resp. 2x2x2) neighbourhood.
+    full_true_neighbours: The neighbour code of a voxel inside the mask.
+    table: The table mapping each neighbour code to the contour length in mm
+      (resp. surface element area in mm^2).
+
+  Returns:
+    A tuple:
+     - The int64 coordinates of the surface voxels, one row per voxel.
+     - Their uint8 neighbour codes.
+     - Their contour length (resp. surface element area).
+     - A bool array the shape of `cropmask`, false for the surface voxels,
+       ready for the distance transform.
+  """
+  mask, weights = _as_3d(cropmask, kernel)
+  counts = _count_surfels(mask, weights, full_true_neighbours)
+  starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+  num_surfels = int(counts.sum())
+  coordinates = np.empty((num_surfels, 3), np.int64)
+  codes = np.empty(num_surfels, np.uint8)
+  areas = np.empty(num_surfels, table.dtype)
+  background = np.ones(mask.shape, bool)
+  _write_surfels(mask, weights, full_true_neighbours, table, starts,
+                 coordinates, codes, areas, background)
+  if cropmask.ndim == 2:
+    coordinates = coordinates[:, [0, 2]]
+    background = background.reshape(cropmask.shape)
+  return coordinates, codes, areas, background
+
+
+def gather(values, coordinates):
+  """The values of a 2D or 3D array at the coordinates from `find_surfels`."""
+  if values.ndim == 2:
+    values = values[:, np.newaxis]
+    coordinates = np.insert(coordinates, 1, 0, axis=1)
+  return _gather(values, coordinates)
+
+
+def _as_3d(cropmask, kernel):
+  """Views a 2D mask and kernel as 3D, with a length one second axis.
+
+  The 2D kernel weights go in the second half of the second axis, so the
+  neighbours before the single plane (always outside the mask) add nothing
+  and the 2D neighbour codes are unchanged.
+  """
+  weights = np.asarray(kernel, np.int64)
+  if cropmask.ndim == 3:
+    return cropmask, weights
+  weights_3d = np.zeros((2, 2, 2), np.int64)
+  weights_3d[:, 1, :] = weights
+  return cropmask[:, np.newaxis, :], weights_3d
@@ -17,9 +17,14 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import functools
+
+from . import kernels  # pylint: disable=relative-beyond-top-level
 from . import lookup_tables  # pylint: disable=relative-beyond-top-level
 import numpy as np
 from scipy import ndimage
+from scipy import spatial
+from scipy.sparse import csgraph
 
 
 def _assert_is_numpy_array(name, array):
@@ -51,6 +56,13 @@ def _assert_is_bool_numpy_array(name, array):
                      "not {}".format(name, array.dtype))
 
 
+def _assert_is_mask_numpy_array(name, array):
+  _assert_is_numpy_array(name, array)
+  if array.dtype not in (bool, np.uint8):
+    raise ValueError("The argument {!r} should be a numpy array of type bool "
+                     "or uint8, not {}".format(name, array.dtype))
+
+
 def _compute_bounding_box(mask):
   """Computes the bounding box of the masks.
 
@@ -95,30 +107,109 @@ def _compute_bounding_box(mask):
 
 
 def _crop_to_bounding_box(mask, bbox_min, bbox_max):
-  """Crops a 2D or 3D mask to the bounding box specified by `bbox_{min,max}`."""
+  """Crops a mask to the bounding box specified by `bbox_{min,max}`."""
   # we need to zeropad the cropped region with 1 voxel at the lower,
   # the right (and the back on 3D) sides. This is required to obtain the
   # "full" convolution result with the 2x2 (or 2x2x2 in 3D) kernel.
   # TODO:  This is correct only if the object is interior to the
   # bounding box.
-  cropmask = np.zeros((bbox_max - bbox_min) + 2, np.uint8)
+  # Keep the memory layout of the input (e.g. Fortran ordered volumes from
+  # NIfTI files) so the copy below reads it sequentially.
+  cropmask = np.zeros((bbox_max - bbox_min) + 2, np.uint8,
+                      order=_memory_order(mask))
 
   num_dims = len(mask.shape)
-  # pyformat: disable
-  if num_dims == 2:
-    cropmask[0:-1, 0:-1] = mask[bbox_min[0]:bbox_max[0] + 1,
-                                bbox_min[1]:bbox_max[1] + 1]
-  elif num_dims == 3:
-    cropmask[0:-1, 0:-1, 0:-1] = mask[bbox_min[0]:bbox_max[0] + 1,
-                                      bbox_min[1]:bbox_max[1] + 1,
-                                      bbox_min[2]:bbox_max[2] + 1]
-  # pyformat: enable
+  region = mask[tuple(
+      slice(bbox_min[axis], bbox_max[axis] + 1) for axis in range(num_dims))]
+  if region.dtype == bool:
+    # cast straight into the buffer
+    cropmask[(slice(0, -1),) * num_dims] = region
   else:
-    assert False
+    np.not_equal(region, 0, out=cropmask[(slice(0, -1),) * num_dims],
+                 casting="unsafe")
 
   return cropmask
 
 
+def _memory_order(array):
+  """Returns "F" if the last axis of `array` varies slowest in memory."""
+  strides = np.abs(array.strides)
+  if array.ndim > 1 and strides[0] < strides[-1]:
+    return "F"
+  return "C"
+
+
+def _compute_union_bounding_box(mask_a, mask_b):
+  """Computes the bounding box of `mask_a | mask_b` without building it.
+
+  The last axis is projected out of each mask once and the projections onto
+  the other axes are taken from that much smaller array, so each mask is read
+  twice whatever the number of dimensions.
+
+  Args:
+    mask_a: The first numpy mask, where non-zero means foreground.
+    mask_b: The second numpy mask, the same shape as `mask_a`.
+
+  Returns:
+    The same as `_compute_bounding_box(mask_a | mask_b)`.
+  """
+  num_dims = len(mask_a.shape)
+  leading = np.any(mask_a, axis=-1) | np.any(mask_b, axis=-1)
+  last = (np.any(mask_a, axis=tuple(range(num_dims - 1))) |
+          np.any(mask_b, axis=tuple(range(num_dims - 1))))
+  idx_nonzero_last = np.nonzero(last)[0]
+  if len(idx_nonzero_last) == 0:  # pylint: disable=g-explicit-length-test
+    return None, None
+
+  bbox_min, bbox_max = _compute_bounding_box(leading)
+  return (np.append(bbox_min, np.min(idx_nonzero_last)),
+          np.append(bbox_max, np.max(idx_nonzero_last)))
+
+
+def _get_surface_lookup(spacing_mm):
+  """Returns the lookup table, kernel and full code for 2D or 3D masks.
+
+  The tables are cached per spacing, so repeated calls with the same spacing
+  (e.g. for every frame of a time series) only build them once.
+
+  Args:
+    spacing_mm: 2-element (resp. 3-element) list-like structure. Voxel spacing
+      in x0 anx x1 (resp. x0, x1 and x2) directions.
+
+  Returns:
+    A tuple:
+     - The table mapping each neighbour code to the contour length in mm
+       (resp. surface element area in mm^2).
+     - The kernel to encode the 2x2 (resp. 2x2x2) neighbourhood of a voxel.
+     - The neighbour code of a voxel completely inside the mask.
+
+  Raises:
+    ValueError: If `spacing_mm` is not 2D or 3D.
+  """
+  return _get_surface_lookup_cached(tuple(float(s) for s in spacing_mm))
+
+
+@functools.lru_cache(maxsize=32)
+def _get_surface_lookup_cached(spacing_mm):
+  num_dims = len(spacing_mm)
+  if num_dims == 2:
+    # compute the area for all 16 possible surface elements
+    # (given a 2x2 neighbourhood) according to the spacing_mm
+    return (
+        lookup_tables.create_table_neighbour_code_to_contour_length(spacing_mm),
+        lookup_tables.ENCODE_NEIGHBOURHOOD_2D_KERNEL,
+        0b1111)
+  elif num_dims == 3:
+    # compute the area for all 256 possible surface elements
+    # (given a 2x2x2 neighbourhood) according to the spacing_mm
+    return (
+        lookup_tables.create_table_neighbour_code_to_surface_area(spacing_mm),
+        lookup_tables.ENCODE_NEIGHBOURHOOD_3D_KERNEL,
+        0b11111111)
+  raise ValueError("Only 2D and 3D masks are supported, not "
+                   "{}D.".format(num_dims))
+
+
 def _sort_distances_surfels(distances, surfel_areas):
   """Sorts the two list with respect to the tuple of (distance, surfel_area).
 
@@ -129,13 +220,14 @@ def _sort_distances_surfels(distances, surfel_areas):
   Returns:
     A tuple of the sorted (distances, surfel_areas).
   """
-  sorted_surfels = np.array(sorted(zip(distances, surfel_areas)))
-  return sorted_surfels[:, 0], sorted_surfels[:, 1]
+  order = np.lexsort((surfel_areas, distances))
+  return distances[order], surfel_areas[order]
 
 
 def compute_surface_distances(mask_gt,
                               mask_pred,
-                              spacing_mm):
+                              spacing_mm,
+                              return_coordinates=False):
   """Computes closest distances from all surface points to the other surface.
 
   This function can be applied to 2D or 3D tensors. For 2D, both masks must be
@@ -153,10 +245,14 @@ def compute_surface_distances(mask_gt,
   the other list are `inf`.
 
   Args:
-    mask_gt: 2-dim (resp. 3-dim) bool Numpy array. The ground truth mask.
+    mask_gt: 2-dim (resp. 3-dim) bool Numpy array. The ground truth mask. A
+      uint8 array, where non-zero means foreground, or a Fortran ordered array
+      is used as it is, without an extra copy.
     mask_pred: 2-dim (resp. 3-dim) bool Numpy array. The predicted mask.
     spacing_mm: 2-element (resp. 3-element) list-like structure. Voxel spacing
       in x0 anx x1 (resp. x0, x1 and x2) directions.
+    return_coordinates: bool. Whether to also return where each surface
+      element is, see `compute_worst_surfels`.
 
   Returns:
     A dict with:
@@ -172,6 +268,14 @@ def compute_surface_distances(mask_gt,
     "surfel_areas_pred": 1-dim numpy array of type float. The length of the
       of the predicted contours in mm (resp. the surface elements area in
       mm^2) in the same order as distances_gt_to_pred.
+    With `return_coordinates`, also:
+    "surfel_coordinates_gt": (N, 2) (resp. (N, 3)) int32 numpy array. The
+      index, in the uncropped mask, of the voxel whose lower corner each ground
+      truth surface element is at (the corner shared with the voxel at index
+      - 1 on every axis), in the same order as distances_gt_to_pred. Indices
+      can equal the mask shape for surfaces touching its far edge.
+    "surfel_coordinates_pred": The same for the predicted surface elements, in
+      the same order as distances_pred_to_gt.
 
   Raises:
     ValueError: If the masks and the `spacing_mm` arguments are of incompatible
@@ -181,86 +285,85 @@ def compute_surface_distances(mask_gt,
   # in 2D stands for contours in 3D. The surface elements in 3D correspond to
   # the line elements in 2D.
 
-  _assert_is_bool_numpy_array("mask_gt", mask_gt)
-  _assert_is_bool_numpy_array("mask_pred", mask_pred)
-
-  if not len(mask_gt.shape) == len(mask_pred.shape) == len(spacing_mm):
-    raise ValueError("The arguments must be of compatible shape. Got mask_gt "
-                     "with {} dimensions ({}) and mask_pred with {} dimensions "
-                     "({}), while the spacing_mm was {} elements.".format(
-                         len(mask_gt.shape),
-                         mask_gt.shape, len(mask_pred.shape), mask_pred.shape,
-                         len(spacing_mm)))
-
-  num_dims = len(spacing_mm)
-  if num_dims == 2:
-    _check_2d_numpy_array("mask_gt", mask_gt)
-    _check_2d_numpy_array("mask_pred", mask_pred)
-
-    # compute the area for all 16 possible surface elements
-    # (given a 2x2 neighbourhood) according to the spacing_mm
-    neighbour_code_to_surface_area = (
-        lookup_tables.create_table_neighbour_code_to_contour_length(spacing_mm))
-    kernel = lookup_tables.ENCODE_NEIGHBOURHOOD_2D_KERNEL
-    full_true_neighbours = 0b1111
-  elif num_dims == 3:
-    _check_3d_numpy_array("mask_gt", mask_gt)
-    _check_3d_numpy_array("mask_pred", mask_pred)
-
-    # compute the area for all 256 possible surface elements
-    # (given a 2x2x2 neighbourhood) according to the spacing_mm
-    neighbour_code_to_surface_area = (
-        lookup_tables.create_table_neighbour_code_to_surface_area(spacing_mm))
-    kernel = lookup_tables.ENCODE_NEIGHBOURHOOD_3D_KERNEL
-    full_true_neighbours = 0b11111111
-  else:
-    raise ValueError("Only 2D and 3D masks are supported, not "
-                     "{}D.".format(num_dims))
+  _check_masks(mask_gt, mask_pred, spacing_mm)
+  neighbour_code_to_surface_area, kernel, full_true_neighbours = (
+      _get_surface_lookup(spacing_mm))
 
   # compute the bounding box of the masks to trim the volume to the smallest
   # possible processing subvolume
-  bbox_min, bbox_max = _compute_bounding_box(mask_gt | mask_pred)
+  bbox_min, bbox_max = _compute_union_bounding_box(mask_gt, mask_pred)
   # Both the min/max bbox are None at the same time, so we only check one.
   if bbox_min is None:
-    return {
-        "distances_gt_to_pred": np.array([]),
-        "distances_pred_to_gt": np.array([]),
-        "surfel_areas_gt": np.array([]),
-        "surfel_areas_pred": np.array([]),
-    }
+    surface_distances = _empty_surface_distances()
+    if return_coordinates:
+      for side in ("gt", "pred"):
+        surface_distances["surfel_coordinates_" + side] = np.zeros(
+            (0, len(spacing_mm)), np.int32)
+    return surface_distances
 
   # crop the processing subvolume.
   cropmask_gt = _crop_to_bounding_box(mask_gt, bbox_min, bbox_max)
   cropmask_pred = _crop_to_bounding_box(mask_pred, bbox_min, bbox_max)
 
-  # compute the neighbour code (local binary pattern) for each voxel
-  # the resulting arrays are spacially shifted by minus half a voxel in each
-  # axis.
-  # i.e. the points are located at the corners of the original voxels
-  neighbour_code_map_gt = ndimage.filters.correlate(
-      cropmask_gt.astype(np.uint8), kernel, mode="constant", cval=0)
-  neighbour_code_map_pred = ndimage.filters.correlate(
-      cropmask_pred.astype(np.uint8), kernel, mode="constant", cval=0)
-
-  # create masks with the surface voxels
-  borders_gt = ((neighbour_code_map_gt != 0) &
-                (neighbour_code_map_gt != full_true_neighbours))
-  borders_pred = ((neighbour_code_map_pred != 0) &
-                  (neighbour_code_map_pred != full_true_neighbours))
+  # find the surface elements, their areas and their distance to the other
+  # surface, in a compiled loop over the box if Numba is installed
+  compute = (_compute_surfel_distances_fused if kernels.ENABLED
+             else _compute_surfel_distances)
+  (distances_gt_to_pred, distances_pred_to_gt, surfel_areas_gt,
+   surfel_areas_pred, coordinates_gt, coordinates_pred) = compute(
+       cropmask_gt, cropmask_pred, spacing_mm, neighbour_code_to_surface_area,
+       kernel, full_true_neighbours, return_coordinates)
+
+  if return_coordinates:
+    # sort them by distance, keeping the coordinates aligned, and move them
+    # from the cropped box back to the mask
+    surface_distances = {}
+    for side, direction, distances, surfel_areas, coordinates in (
+        ("gt", "gt_to_pred", distances_gt_to_pred, surfel_areas_gt,
+         coordinates_gt),
+        ("pred", "pred_to_gt", distances_pred_to_gt, surfel_areas_pred,
+         coordinates_pred)):
+      order = np.lexsort((surfel_areas, distances))
+      surface_distances["distances_" + direction] = distances[order]
+      surface_distances["surfel_areas_" + side] = surfel_areas[order]
+      surface_distances["surfel_coordinates_" + side] = (
+          coordinates[order] + bbox_min).astype(np.int32)
+    return surface_distances
+
+  # sort them by distance
+  if distances_gt_to_pred.shape != (0,):
+    distances_gt_to_pred, surfel_areas_gt = _sort_distances_surfels(
+        distances_gt_to_pred, surfel_areas_gt)
+
+  if distances_pred_to_gt.shape != (0,):
+    distances_pred_to_gt, surfel_areas_pred = _sort_distances_surfels(
+        distances_pred_to_gt, surfel_areas_pred)
+
+  return {
+      "distances_gt_to_pred": distances_gt_to_pred,
+      "distances_pred_to_gt": distances_pred_to_gt,
+      "surfel_areas_gt": surfel_areas_gt,
+      "surfel_areas_pred": surfel_areas_pred,
+  }
+
+
+def _compute_surfel_distances(cropmask_gt, cropmask_pred, spacing_mm,
+                              neighbour_code_to_surface_area, kernel,
+                              full_true_neighbours, return_coordinates=False):
+  """The unsorted distances and areas of the surfels of two cropped masks.
+
+  Followed by the coordinates of the surfels in the cropped masks if
+  `return_coordinates`, otherwise `None`.
+  """
+  neighbour_code_map_gt, borders_gt = _compute_borders(
+      cropmask_gt, kernel, full_true_neighbours)
+  neighbour_code_map_pred, borders_pred = _compute_borders(
+      cropmask_pred, kernel, full_true_neighbours)
 
   # compute the distance transform (closest distance of each voxel to the
   # surface voxels)
-  if borders_gt.any():
-    distmap_gt = ndimage.morphology.distance_transform_edt(
-        ~borders_gt, sampling=spacing_mm)
-  else:
-    distmap_gt = np.inf * np.ones(borders_gt.shape)
-
-  if borders_pred.any():
-    distmap_pred = ndimage.morphology.distance_transform_edt(
-        ~borders_pred, sampling=spacing_mm)
-  else:
-    distmap_pred = np.inf * np.ones(borders_pred.shape)
+  distmap_gt = _compute_distance_map(borders_gt, spacing_mm)
+  distmap_pred = _compute_distance_map(borders_pred, spacing_mm)
 
   # compute the area of each surface element
   surface_area_map_gt = neighbour_code_to_surface_area[neighbour_code_map_gt]
@@ -273,23 +376,738 @@ def compute_surface_distances(mask_gt,
   surfel_areas_gt = surface_area_map_gt[borders_gt]
   surfel_areas_pred = surface_area_map_pred[borders_pred]
 
-  # sort them by distance
-  if distances_gt_to_pred.shape != (0,):
-    distances_gt_to_pred, surfel_areas_gt = _sort_distances_surfels(
-        distances_gt_to_pred, surfel_areas_gt)
+  coordinates_gt = coordinates_pred = None
+  if return_coordinates:
+    coordinates_gt = np.argwhere(borders_gt)
+    coordinates_pred = np.argwhere(borders_pred)
+  return (distances_gt_to_pred, distances_pred_to_gt, surfel_areas_gt,
+          surfel_areas_pred, coordinates_gt, coordinates_pred)
+
+
+def _compute_surfel_distances_fused(cropmask_gt, cropmask_pred, spacing_mm,
+                                    neighbour_code_to_surface_area, kernel,
+                                    full_true_neighbours,
+                                    return_coordinates=False):
+  """`_compute_surfel_distances` with the compiled kernels."""
+  coordinates_gt, _, surfel_areas_gt, background_gt = kernels.find_surfels(
+      cropmask_gt, kernel, full_true_neighbours,
+      neighbour_code_to_surface_area)
+  coordinates_pred, _, surfel_areas_pred, background_pred = (
+      kernels.find_surfels(cropmask_pred, kernel, full_true_neighbours,
+                           neighbour_code_to_surface_area))
+  if len(coordinates_pred):
+    distmap_pred = ndimage.distance_transform_edt(background_pred,
+                                                  sampling=spacing_mm)
+    distances_gt_to_pred = kernels.gather(distmap_pred, coordinates_gt)
+  else:
+    distances_gt_to_pred = np.full(len(coordinates_gt), np.inf)
+  del background_pred
+  if len(coordinates_gt):
+    distmap_gt = ndimage.distance_transform_edt(background_gt,
+                                                sampling=spacing_mm)
+    distances_pred_to_gt = kernels.gather(distmap_gt, coordinates_pred)
+  else:
+    distances_pred_to_gt = np.full(len(coordinates_pred), np.inf)
+  if not return_coordinates:
+    coordinates_gt = coordinates_pred = None
+  return (distances_gt_to_pred, distances_pred_to_gt, surfel_areas_gt,
+          surfel_areas_pred, coordinates_gt, coordinates_pred)
 
-  if distances_pred_to_gt.shape != (0,):
-    distances_pred_to_gt, surfel_areas_pred = _sort_distances_surfels(
-        distances_pred_to_gt, surfel_areas_pred)
 
+def _check_masks(mask_gt, mask_pred, spacing_mm):
+  """Raises an exception if the masks and spacing are not compatible."""
+  _assert_is_mask_numpy_array("mask_gt", mask_gt)
+  _assert_is_mask_numpy_array("mask_pred", mask_pred)
+
+  if not len(mask_gt.shape) == len(mask_pred.shape) == len(spacing_mm):
+    raise ValueError("The arguments must be of compatible shape. Got mask_gt "
+                     "with {} dimensions ({}) and mask_pred with {} dimensions "
+                     "({}), while the spacing_mm was {} elements.".format(
+                         len(mask_gt.shape),
+                         mask_gt.shape, len(mask_pred.shape), mask_pred.shape,
+                         len(spacing_mm)))
+
+  if len(spacing_mm) not in (2, 3):
+    raise ValueError("Only 2D and 3D masks are supported, not "
+                     "{}D.".format(len(spacing_mm)))
+
+
+def _empty_surface_distances():
+  """The result of `compute_surface_distances` for two empty masks."""
   return {
-      "distances_gt_to_pred": distances_gt_to_pred,
-      "distances_pred_to_gt": distances_pred_to_gt,
-      "surfel_areas_gt": surfel_areas_gt,
-      "surfel_areas_pred": surfel_areas_pred,
+      "distances_gt_to_pred": np.array([]),
+      "distances_pred_to_gt": np.array([]),
+      "surfel_areas_gt": np.array([]),
+      "surfel_areas_pred": np.array([]),
   }
 
 
+def _compute_borders(cropmask, kernel, full_true_neighbours):
+  """Computes the neighbour codes and surface voxels of a cropped mask.
+
+  Args:
+    cropmask: The mask cropped by `_crop_to_bounding_box`.
+    kernel: The kernel encoding the 2x2 (resp. 2x2x2) neighbourhood.
+    full_true_neighbours: The neighbour code of a voxel inside the mask.
+
+  Returns:
+    A tuple:
+     - The neighbour code (local binary pattern) of each voxel. The array is
+       spatially shifted by minus half a voxel in each axis, i.e. the points
+       are located at the corners of the original voxels.
+     - A bool array, true for the surface voxels.
+  """
+  # cropmask is already uint8, write the codes in its memory layout
+  neighbour_code_map = ndimage.correlate(
+      cropmask, kernel, output=np.zeros_like(cropmask), mode="constant",
+      cval=0)
+  borders = ((neighbour_code_map != 0) &
+             (neighbour_code_map != full_true_neighbours))
+  return neighbour_code_map, borders
+
+
+def _compute_distance_map(borders, spacing_mm):
+  """Computes the distance of each voxel to the closest surface voxel.
+
+  Every distance is `inf` if there are no surface voxels.
+  """
+  if borders.any():
+    return ndimage.distance_transform_edt(
+        ~borders, sampling=spacing_mm)
+  return np.inf * np.ones(borders.shape)
+
+
+def compute_surface_distances_approximate(mask_gt,
+                                          mask_pred,
+                                          spacing_mm,
+                                          factor=2):
+  """Computes approximate surface distances with a worst-case error bound.
+
+  The surface elements and their areas are found at full resolution, as in
+  `compute_surface_distances`, but the distance transform is computed on a
+  grid downsampled by `factor`, where a coarse voxel is a surface voxel if
+  any of the voxels it covers is. Each surface element is given the distance
+  between the centre of its coarse voxel and the closest coarse surface voxel
+  centre. As every point is within half a coarse voxel diagonal of its coarse
+  voxel centre, each distance is within `(factor - 1)` voxel diagonals of the
+  exact distance. The same bound then holds for the average surface distance
+  and for any percentile of the distances (e.g. the robust Hausdorff
+  distance).
+
+  Args:
+    mask_gt: 2-dim (resp. 3-dim) bool Numpy array. The ground truth mask.
+    mask_pred: 2-dim (resp. 3-dim) bool Numpy array. The predicted mask.
+    spacing_mm: 2-element (resp. 3-element) list-like structure. Voxel spacing
+      in x0 anx x1 (resp. x0, x1 and x2) directions.
+    factor: int or list-like of int. The downsampling factor of the distance
+      transform, for all axes or for each axis. A factor of 1 gives the exact
+      distances.
+
+  Returns:
+    A dict with the same keys as `compute_surface_distances`, which can be
+    passed to the other `compute_*` functions, plus "max_error_mm", a float
+    value. The worst-case absolute error (in mm) of every distance.
+
+  Raises:
+    ValueError: If the masks and the `spacing_mm` arguments are of incompatible
+      shape or type. Or if the masks are not 2D or 3D.
+  """
+  _check_masks(mask_gt, mask_pred, spacing_mm)
+  num_dims = len(spacing_mm)
+  factor = np.broadcast_to(np.asarray(factor, np.int64), (num_dims,))
+  if np.any(factor < 1):
+    raise ValueError("The downsampling factor must be at least 1, not "
+                     "{}.".format(factor))
+  spacing_mm = np.asarray(spacing_mm, np.float64)
+  max_error_mm = float(np.linalg.norm((factor - 1) * spacing_mm))
+
+  bounds = _compute_coarse_distance_bounds(mask_gt, mask_pred, spacing_mm,
+                                           factor)
+  if bounds is None:
+    surface_distances = _empty_surface_distances()
+    surface_distances["max_error_mm"] = max_error_mm
+    return surface_distances
+
+  surface_distances = {"max_error_mm": max_error_mm}
+  for side, direction in (("gt", "gt_to_pred"), ("pred", "pred_to_gt")):
+    distances = bounds["distances_" + direction]
+    surfel_areas = bounds["surfel_areas_" + side]
+    if distances.shape != (0,):
+      distances, surfel_areas = _sort_distances_surfels(distances,
+                                                        surfel_areas)
+    surface_distances["distances_" + direction] = distances
+    surface_distances["surfel_areas_" + side] = surfel_areas
+  return surface_distances
+
+
+def _compute_coarse_distance_bounds(mask_gt, mask_pred, spacing_mm, factor):
+  """Computes approximate distances of every surface element on a coarse grid.
+
+  Args:
+    mask_gt: The ground truth mask.
+    mask_pred: The predicted mask.
+    spacing_mm: Numpy array of the voxel spacing.
+    factor: Numpy array of int. The downsampling factor of each axis.
+
+  Returns:
+    `None` if both masks are empty, otherwise the dict of `_find_surfels`
+    with the coarse distances added by `_add_coarse_distances`.
+  """
+  surfels = _find_surfels(mask_gt, mask_pred, spacing_mm)
+  if surfels is not None:
+    _add_coarse_distances(surfels, spacing_mm, factor)
+  return surfels
+
+
+def _find_surfels(mask_gt, mask_pred, spacing_mm):
+  """Finds the surface elements of both masks at full resolution.
+
+  Args:
+    mask_gt: The ground truth mask.
+    mask_pred: The predicted mask.
+    spacing_mm: The voxel spacing.
+
+  Returns:
+    `None` if both masks are empty, otherwise a dict with, for each side
+    ("gt" and "pred"), the cropped "neighbour_code_map_<side>", the bool
+    "border_mask_<side>", the coordinates of each surface element in the
+    cropped volume "borders_<side>" (an (N, dims) array) and the unsorted
+    "surfel_areas_<side>", as well as the "bbox_min" of the crop.
+  """
+  neighbour_code_to_surface_area, kernel, full_true_neighbours = (
+      _get_surface_lookup(spacing_mm))
+  bbox_min, bbox_max = _compute_union_bounding_box(mask_gt, mask_pred)
+  if bbox_min is None:
+    return None
+
+  surfels = {"bbox_min": bbox_min}
+  for side, mask in (("gt", mask_gt), ("pred", mask_pred)):
+    cropmask = _crop_to_bounding_box(mask, bbox_min, bbox_max)
+    neighbour_code_map, borders = _compute_borders(cropmask, kernel,
+                                                   full_true_neighbours)
+    surfels["neighbour_code_map_" + side] = neighbour_code_map
+    surfels["border_mask_" + side] = borders
+    surfels["borders_" + side] = np.argwhere(borders)
+    surfels["surfel_areas_" + side] = neighbour_code_to_surface_area[
+        neighbour_code_map[borders]]
+  return surfels
+
+
+def _add_coarse_distances(surfels, spacing_mm, factor):
+  """Adds the coarse distances "distances_<direction>" to `surfels`.
+
+  Each distance is within `norm((factor - 1) * spacing_mm)` of the exact
+  distance, see `compute_surface_distances_approximate`.
+  """
+  distmaps = {}
+  for side in ("gt", "pred"):
+    distmaps[side] = _compute_distance_map(
+        _downsample_any(surfels["border_mask_" + side], factor),
+        factor * spacing_mm)
+  for side, other, direction in (("gt", "pred", "gt_to_pred"),
+                                 ("pred", "gt", "pred_to_gt")):
+    coarse_coordinates = surfels["borders_" + side] // factor
+    surfels["distances_" + direction] = distmaps[other][
+        tuple(coarse_coordinates.T)]
+
+
+def _downsample_any(mask, factor):
+  """Downsamples a bool array, a coarse voxel is true if any voxel it covers is.
+  """
+  coarse_shape = -(-np.asarray(mask.shape) // factor)
+  padding = coarse_shape * factor - mask.shape
+  if padding.any():
+    mask = np.pad(mask, [(0, n) for n in padding])
+  # reduce one axis at a time, starting with the last, so each reduction is
+  # over a contiguous block and shrinks the array for the next one
+  for axis in reversed(range(mask.ndim)):
+    mask = mask.reshape(mask.shape[:axis] + (coarse_shape[axis], factor[axis]) +
+                        mask.shape[axis + 1:]).any(axis=axis + 1)
+  return mask
+
+
+def compute_robust_hausdorff_coarse_to_fine(mask_gt,
+                                            mask_pred,
+                                            spacing_mm,
+                                            percent,
+                                            factors=(4, 2)):
+  """Computes the exact robust Hausdorff distance from a coarse-to-fine search.
+
+  Gives the same result as
+  `compute_robust_hausdorff(compute_surface_distances(...), percent)` but
+  only computes full resolution distances where they can change the result.
+  Distance transforms on grids downsampled by each of `factors` bound the
+  distance of every surface element, see
+  `compute_surface_distances_approximate`. The bounds give a range for the
+  percentile, surface elements whose bounds lie entirely below or above that
+  range cannot be the percentile and only the remaining surface elements have
+  their exact distance computed, with a nearest neighbour search over the
+  other surface. This is much faster when the percentile is determined by a
+  small part of the surface, e.g. the maximum of two well aligned surfaces.
+
+  Args:
+    mask_gt: 2-dim (resp. 3-dim) bool Numpy array. The ground truth mask.
+    mask_pred: 2-dim (resp. 3-dim) bool Numpy array. The predicted mask.
+    spacing_mm: 2-element (resp. 3-element) list-like structure. Voxel spacing
+      in x0 anx x1 (resp. x0, x1 and x2) directions.
+    percent: a float value between 0 and 100.
+    factors: list-like of int. The downsampling factors of the pyramid, from
+      coarsest to finest.
+
+  Returns:
+    a float value. The robust Hausdorff distance in mm.
+
+  Raises:
+    ValueError: If the masks and the `spacing_mm` arguments are of incompatible
+      shape or type. Or if the masks are not 2D or 3D.
+  """
+  _check_masks(mask_gt, mask_pred, spacing_mm)
+  spacing_mm = np.asarray(spacing_mm, np.float64)
+  surfels = _find_surfels(mask_gt, mask_pred, spacing_mm)
+  if surfels is None:
+    return compute_robust_hausdorff(_empty_surface_distances(), percent)
+
+  lower = {}
+  upper = {}
+  for direction, side in (("gt_to_pred", "gt"), ("pred_to_gt", "pred")):
+    lower[direction] = np.zeros(len(surfels["borders_" + side]))
+    upper[direction] = np.full(len(surfels["borders_" + side]), np.inf)
+  for factor in factors:
+    factor = np.broadcast_to(np.asarray(factor, np.int64), spacing_mm.shape)
+    max_error_mm = np.linalg.norm((factor - 1) * spacing_mm)
+    _add_coarse_distances(surfels, spacing_mm, factor)
+    for direction in lower:
+      distances = surfels["distances_" + direction]
+      lower[direction] = np.maximum(lower[direction], distances - max_error_mm)
+      upper[direction] = np.minimum(upper[direction], distances + max_error_mm)
+
+  # Only the surface elements whose bounds overlap the range of the percentile
+  # need their exact distance, the others are on a known side of it.
+  perc_distances = []
+  for direction, side, other in (("gt_to_pred", "gt", "pred"),
+                                 ("pred_to_gt", "pred", "gt")):
+    surfel_areas = surfels["surfel_areas_" + side]
+    if len(surfel_areas) == 0:  # pylint: disable=g-explicit-length-test
+      perc_distances.append(np.inf)
+      continue
+    others = surfels["borders_" + other]
+    if len(others) == 0:  # pylint: disable=g-explicit-length-test
+      perc_distances.append(np.inf)
+      continue
+    range_min = _weighted_percentile(lower[direction], surfel_areas, percent)
+    range_max = _weighted_percentile(upper[direction], surfel_areas, percent)
+    candidates = ((upper[direction] >= range_min) &
+                  (lower[direction] <= range_max))
+    distances = lower[direction].copy()
+    distances[candidates] = _nearest_distances(
+        surfels["borders_" + side][candidates],
+        upper[direction][candidates], others, spacing_mm)
+    perc_distances.append(
+        _weighted_percentile(distances, surfel_areas, percent))
+  return max(perc_distances)
+
+
+def _nearest_distances(points, upper_bounds, others, spacing_mm):
+  """Exact distance (in mm) from each point to the closest of `others`.
+
+  Only the other points close enough to be within the upper bound of a point
+  go in the search tree.
+  """
+  if len(points) == 0:  # pylint: disable=g-explicit-length-test
+    return np.zeros(0)
+  reach = np.ceil(np.max(upper_bounds) / spacing_mm).astype(np.int64)
+  near = np.all((others >= points.min(axis=0) - reach) &
+                (others <= points.max(axis=0) + reach), axis=1)
+  tree = spatial.cKDTree(others[near] * spacing_mm, balanced_tree=False,
+                         compact_nodes=False)
+  return tree.query(points * spacing_mm, workers=-1)[0]
+
+
+def _weighted_percentile(distances, surfel_areas, percent):
+  """The area weighted percentile of unsorted distances.
+
+  Uses the same definition as `compute_robust_hausdorff`.
+  """
+  order = np.lexsort((surfel_areas, distances))
+  surfel_areas_cum = np.cumsum(surfel_areas[order]) / np.sum(surfel_areas)
+  idx = np.searchsorted(surfel_areas_cum, percent / 100.0)
+  return distances[order][min(idx, len(distances) - 1)]
+
+
+def compute_surface_distances_clustered(mask_gt,
+                                        mask_pred,
+                                        spacing_mm,
+                                        factor=4):
+  """Computes surface distances one cluster of nearby components at a time.
+
+  Gives the same result as `compute_surface_distances`, but rather than
+  cropping both masks to a single bounding box, which covers most of the
+  volume for widely separated parts (e.g. both kidneys or scattered lesions),
+  the foreground is split into clusters of nearby connected components, each
+  processed in its own bounding box. Components are found on a grid
+  downsampled by `factor`, and clusters whose boxes are within one coarse
+  voxel of each other are merged, so no cluster box contains another
+  cluster's foreground.
+
+  The distance maps of each cluster only cover its own surfaces. A surface
+  element's distance within its cluster is exact when it is no further than
+  the bounding box of any other cluster's surface; the few that are further
+  (e.g. the surface of a false positive lesion far from any true lesion) are
+  found with a KD-tree of the other surface.
+
+  Args:
+    mask_gt: 2-dim (resp. 3-dim) bool Numpy array. The ground truth mask.
+    mask_pred: 2-dim (resp. 3-dim) bool Numpy array. The predicted mask.
+    spacing_mm: 2-element (resp. 3-element) list-like structure. Voxel spacing
+      in x0 anx x1 (resp. x0, x1 and x2) directions.
+    factor: Int or list-like of int. The downsampling factor of the grid the
+      components are found on, for all axes or for each axis.
+
+  Returns:
+    The same dict as `compute_surface_distances`.
+
+  Raises:
+    ValueError: If the masks and the `spacing_mm` arguments are of incompatible
+      shape or type. Or if the masks are not 2D or 3D.
+  """
+  _check_masks(mask_gt, mask_pred, spacing_mm)
+  spacing_mm = np.asarray(spacing_mm, np.float64)
+  factor = np.broadcast_to(np.asarray(factor, np.int64), spacing_mm.shape)
+  if np.any(factor < 1):
+    raise ValueError("The downsampling factor must be at least 1, not "
+                     "{}.".format(factor))
+
+  return _clustered_surface_distances(
+      ((box, mask_gt[box], mask_pred[box])
+       for box in _find_cluster_boxes(mask_gt, mask_pred, factor)),
+      spacing_mm)
+
+
+def _clustered_surface_distances(crops, spacing_mm):
+  """`compute_surface_distances_clustered` from the masks of each cluster.
+
+  Args:
+    crops: Iterable of (box, cropmask_gt, cropmask_pred), the bounding box of
+      each cluster (a tuple of slices, separated as by `_find_cluster_boxes`)
+      and both masks within it.
+    spacing_mm: Numpy array of the voxel spacing.
+
+  Returns:
+    The same dict as `compute_surface_distances`.
+  """
+  clusters = []
+  for box, cropmask_gt, cropmask_pred in crops:
+    surfels = _find_surfels(cropmask_gt, cropmask_pred, spacing_mm)
+    if surfels is None:
+      continue
+    offset = surfels["bbox_min"] + [b.start for b in box]
+    for side in ("gt", "pred"):
+      surfels["borders_" + side] = surfels["borders_" + side] + offset
+    for side, other, direction in (("gt", "pred", "gt_to_pred"),
+                                   ("pred", "gt", "pred_to_gt")):
+      distmap = _compute_distance_map(surfels["border_mask_" + other],
+                                      spacing_mm)
+      surfels["distances_" + direction] = distmap[
+          tuple((surfels["borders_" + side] - offset).T)]
+    # the surface elements of a cluster are within the box of its codes
+    surfels["code_box"] = (offset, offset + surfels["border_mask_gt"].shape -
+                           1)
+    for key in ("neighbour_code_map_gt", "neighbour_code_map_pred",
+                "border_mask_gt", "border_mask_pred"):
+      del surfels[key]
+    clusters.append(surfels)
+  if not clusters:
+    return _empty_surface_distances()
+
+  surface_distances = {}
+  for side, other, direction in (("gt", "pred", "gt_to_pred"),
+                                 ("pred", "gt", "pred_to_gt")):
+    others = np.concatenate([c["borders_" + other] for c in clusters])
+    tree = None
+    for i, cluster in enumerate(clusters):
+      points = cluster["borders_" + side]
+      distances = cluster["distances_" + direction]
+      lower_bound = np.full(len(points), np.inf)
+      for j, other_cluster in enumerate(clusters):
+        if j != i and len(other_cluster["borders_" + other]):
+          lower_bound = np.minimum(lower_bound, _distance_to_box(
+              points, *other_cluster["code_box"], spacing_mm))
+      closer_elsewhere = distances > lower_bound
+      if np.any(closer_elsewhere):
+        if tree is None:
+          tree = spatial.cKDTree(others * spacing_mm, balanced_tree=False,
+                                 compact_nodes=False)
+        distances[closer_elsewhere] = tree.query(
+            points[closer_elsewhere] * spacing_mm, workers=-1)[0]
+    key = "surfel_areas_" + side
+    distances, surfel_areas = _sort_distances_surfels(
+        np.concatenate([c["distances_" + direction] for c in clusters]),
+        np.concatenate([c[key] for c in clusters]))
+    surface_distances["distances_" + direction] = distances
+    surface_distances[key] = surfel_areas
+  return surface_distances
+
+
+def _find_cluster_boxes(mask_gt, mask_pred, factor):
+  """The bounding boxes of clusters of nearby components, as slices.
+
+  Boxes are separated by at least one voxel (one coarse voxel of `factor`),
+  so the neighbour codes within each box are the same as in the whole mask.
+  """
+  coarse = _downsample_max(mask_gt, factor) | _downsample_max(mask_pred,
+                                                              factor)
+  return _coarse_cluster_boxes(coarse, factor, mask_gt.shape)
+
+
+def _coarse_cluster_boxes(coarse, factor, shape):
+  """`_find_cluster_boxes` from the downsampled union of the masks."""
+  labels, _ = ndimage.label(coarse, np.ones((3,) * coarse.ndim))
+  objects = ndimage.find_objects(labels)
+  if not objects:
+    return []
+  box_min = np.array([[s.start for s in obj] for obj in objects])
+  box_max = np.array([[s.stop - 1 for s in obj] for obj in objects])
+  while True:
+    # merge boxes that overlap or touch until none do
+    touching = np.all((box_min[:, np.newaxis] <= box_max[np.newaxis] + 1) &
+                      (box_min[np.newaxis] <= box_max[:, np.newaxis] + 1),
+                      axis=-1)
+    n_clusters, cluster = csgraph.connected_components(touching,
+                                                       directed=False)
+    if n_clusters == len(box_min):
+      break
+    merged_min = np.full((n_clusters, coarse.ndim), np.iinfo(np.int64).max)
+    merged_max = np.full((n_clusters, coarse.ndim), -1)
+    np.minimum.at(merged_min, cluster, box_min)
+    np.maximum.at(merged_max, cluster, box_max)
+    box_min, box_max = merged_min, merged_max
+  return [tuple(slice(lo * f, min((hi + 1) * f, n))
+                for lo, hi, f, n in zip(lo_row, hi_row, factor, shape))
+          for lo_row, hi_row in zip(box_min, box_max)]
+
+
+def _downsample_max(mask, factor):
+  """Downsamples a mask without padding it, a coarse voxel is true if any voxel
+  it covers is non-zero.
+  """
+  for axis in reversed(range(mask.ndim)):
+    mask = np.maximum.reduceat(
+        mask, np.arange(0, mask.shape[axis], factor[axis]), axis=axis)
+  return mask != 0
+
+
+def _distance_to_box(points, box_min, box_max, spacing_mm):
+  """The distance (in mm) from each point to the box from min to max."""
+  gap = np.maximum(np.maximum(box_min - points, points - box_max), 0)
+  return np.linalg.norm(gap * spacing_mm, axis=1)
+
+
+def compute_surface_distances_kdtree(mask_gt,
+                                     mask_pred,
+                                     spacing_mm,
+                                     slab_size=None):
+  """Computes surface distances with nearest neighbour search, slab by slab.
+
+  Gives the same result as `compute_surface_distances` (up to rounding of the
+  distances) without a distance transform: the surface elements are found in
+  slabs of `slab_size` voxels along the first axis of the bounding box and the
+  distances come from a KD-tree of each surface. The memory needed follows the
+  size of a slab and the number of surface elements rather than the volume of
+  the bounding box.
+
+  Args:
+    mask_gt: 2-dim (resp. 3-dim) bool Numpy array. The ground truth mask.
+    mask_pred: 2-dim (resp. 3-dim) bool Numpy array. The predicted mask.
+    spacing_mm: 2-element (resp. 3-element) list-like structure. Voxel spacing
+      in x0 anx x1 (resp. x0, x1 and x2) directions.
+    slab_size: Int. The thickness of each slab in voxels, by default the
+      whole bounding box is processed at once.
+
+  Returns:
+    The same dict as `compute_surface_distances`.
+
+  Raises:
+    ValueError: If the masks and the `spacing_mm` arguments are of incompatible
+      shape or type. Or if the masks are not 2D or 3D.
+  """
+  _check_masks(mask_gt, mask_pred, spacing_mm)
+  spacing_mm = np.asarray(spacing_mm, np.float64)
+  neighbour_code_to_surface_area, kernel, full_true_neighbours = (
+      _get_surface_lookup(spacing_mm))
+  bbox_min, bbox_max = _compute_union_bounding_box(mask_gt, mask_pred)
+  if bbox_min is None:
+    return _empty_surface_distances()
+
+  # neighbour codes of the bounding box go from 0 to its size (inclusive)
+  # along each axis, the code at i depends on the voxels at i - 1 and i.
+  num_codes = bbox_max[0] - bbox_min[0] + 2
+  slab_size = num_codes if slab_size is None else max(int(slab_size), 1)
+  borders = {"gt": [], "pred": []}
+  surfel_areas = {"gt": [], "pred": []}
+  for start in range(0, num_codes, slab_size):
+    stop = min(start + slab_size, num_codes)
+    first = max(start - 1, 0)
+    slab_min, slab_max = bbox_min.copy(), bbox_max.copy()
+    slab_min[0] = bbox_min[0] + first
+    slab_max[0] = min(bbox_min[0] + stop - 1, bbox_max[0])
+    for side, mask in (("gt", mask_gt), ("pred", mask_pred)):
+      cropmask = _crop_to_bounding_box(mask, slab_min, slab_max)
+      neighbour_code_map, slab_borders = _compute_borders(
+          cropmask, kernel, full_true_neighbours)
+      neighbour_code_map = neighbour_code_map[start - first:stop - first]
+      slab_borders = slab_borders[start - first:stop - first]
+      points = np.argwhere(slab_borders)
+      points[:, 0] += start
+      borders[side].append(points)
+      surfel_areas[side].append(
+          neighbour_code_to_surface_area[neighbour_code_map[slab_borders]])
+
+  surface_distances = {}
+  for side, other, direction in (("gt", "pred", "gt_to_pred"),
+                                 ("pred", "gt", "pred_to_gt")):
+    points = np.concatenate(borders[side])
+    others = np.concatenate(borders[other])
+    if len(others) == 0:  # pylint: disable=g-explicit-length-test
+      distances = np.full(len(points), np.inf)
+    else:
+      tree = spatial.cKDTree(others * spacing_mm, balanced_tree=False,
+                             compact_nodes=False)
+      distances = tree.query(points * spacing_mm, workers=-1)[0]
+    distances, areas = _sort_distances_surfels(
+        distances, np.concatenate(surfel_areas[side]))
+    surface_distances["distances_" + direction] = distances
+    surface_distances["surfel_areas_" + side] = areas
+  return surface_distances
+
+
+def compact_surface_distances(surface_distances,
+                              bin_width_mm=0.1,
+                              relative_resolution=None):
+  """Bins the output of `compute_surface_distances` into distance histograms.
+
+  The compact form needs a few kB per case, where the surfel arrays of a large
+  case take tens of MB, and is accepted by `compute_average_surface_distance`,
+  `compute_robust_hausdorff`, `compute_surface_overlap_at_tolerance` and
+  `compute_surface_dice_at_tolerance` in place of the full surface distances.
+
+  Bin `i` holds the surfel area with distances in `((i - 1) * bin_width_mm,
+  i * bin_width_mm]`, so bin 0 only holds surfels lying on the other surface.
+  With a `relative_resolution` the bins widen beyond `bin_width_mm /
+  relative_resolution`, each being `relative_resolution` times its distance
+  wide, which bounds the number of bins for masks far apart.
+
+  The average surface distance is kept exactly. The robust Hausdorff distance
+  is the upper edge of the bin holding the percentile, at most a bin width
+  more than the exact value, and the 100th percentile is exact. The surface
+  overlap counts the bins below the tolerance, which is exact for tolerances
+  on a bin edge (e.g. multiples of `bin_width_mm` for fixed bins).
+
+  Args:
+    surface_distances: dict with "distances_gt_to_pred", "distances_pred_to_gt"
+      "surfel_areas_gt", "surfel_areas_pred" created by
+      compute_surface_distances()
+    bin_width_mm: a positive float. The width of the bins in mm.
+    relative_resolution: a positive float, e.g. 0.01 for bins at most 1% of
+      their distance wide. By default all bins are `bin_width_mm` wide.
+
+  Returns:
+    A dict with:
+    "bin_width_mm", "relative_resolution": the binning.
+    "histogram_gt_to_pred": 1-dim numpy array of type float. The area of the
+      ground truth surface elements in each bin of distances to the predicted
+      surface, up to the last non-empty bin. Surfels with an infinite distance
+      are not in any bin.
+    "histogram_pred_to_gt": the same for the predicted surface.
+    "surface_area_gt", "surface_area_pred": The total surface area (resp.
+      contour length) of each surface.
+    "distance_sum_gt_to_pred", "distance_sum_pred_to_gt": The area weighted
+      sum of the distances in each direction.
+    "max_distance_gt_to_pred", "max_distance_pred_to_gt": The largest
+      distance in each direction, or -inf if the surface is empty.
+
+  Raises:
+    ValueError: If `bin_width_mm` or `relative_resolution` is not positive.
+  """
+  if bin_width_mm <= 0:
+    raise ValueError("bin_width_mm must be positive, not "
+                     "{}.".format(bin_width_mm))
+  if relative_resolution is not None and relative_resolution <= 0:
+    raise ValueError("relative_resolution must be positive, not "
+                     "{}.".format(relative_resolution))
+  compact = {"bin_width_mm": bin_width_mm,
+             "relative_resolution": relative_resolution}
+  for side, direction in (("gt", "gt_to_pred"), ("pred", "pred_to_gt")):
+    distances = np.asarray(surface_distances["distances_" + direction],
+                           np.float64)
+    surfel_areas = np.asarray(surface_distances["surfel_areas_" + side],
+                              np.float64)
+    finite = np.isfinite(distances)
+    index = _histogram_bin_index(distances[finite], bin_width_mm,
+                                 relative_resolution)
+    compact["histogram_" + direction] = np.bincount(
+        index, weights=surfel_areas[finite]).astype(np.float64)
+    compact["surface_area_" + side] = np.sum(surfel_areas)
+    compact["distance_sum_" + direction] = np.sum(distances * surfel_areas)
+    compact["max_distance_" + direction] = (
+        np.max(distances) if len(distances) else -np.inf)
+  return compact
+
+
+def _histogram_bin_index(distances, bin_width_mm, relative_resolution):
+  """The bin of each distance in `compact_surface_distances`."""
+  # rounded so distances on a bin edge aren't pushed into the next bin
+  index = np.ceil(np.round(distances / bin_width_mm, 9))
+  if relative_resolution is not None:
+    num_fixed = int(np.ceil(1 / relative_resolution))
+    far = index > num_fixed
+    index[far] = num_fixed + np.ceil(np.round(
+        np.log(distances[far] / (num_fixed * bin_width_mm)) /
+        np.log1p(relative_resolution), 9))
+  return index.astype(np.int64)
+
+
+def _histogram_bin_edge(index, bin_width_mm, relative_resolution):
+  """The upper edge (in mm) of each bin in `compact_surface_distances`."""
+  index = np.asarray(index)
+  edge = index * np.float64(bin_width_mm)
+  if relative_resolution is not None:
+    num_fixed = int(np.ceil(1 / relative_resolution))
+    edge = np.where(
+        index > num_fixed,
+        num_fixed * bin_width_mm *
+        (1 + relative_resolution) ** np.maximum(index - num_fixed, 0), edge)
+  return edge
+
+
+def _is_compact(surface_distances):
+  return "histogram_gt_to_pred" in surface_distances
+
+
+def _compact_percentile(compact, side, direction, percent):
+  """The robust Hausdorff distance in one direction from a compact dict."""
+  histogram = compact["histogram_" + direction]
+  total_area = compact["surface_area_" + side]
+  if total_area == 0:
+    return np.inf
+  idx = np.searchsorted(np.cumsum(histogram) / total_area, percent / 100.0)
+  if idx >= len(histogram):
+    # the percentile falls among infinite distances, or rounding stopped the
+    # cumulative sum just short of 1
+    return compact["max_distance_" + direction]
+  return min(_histogram_bin_edge(idx, compact["bin_width_mm"],
+                                 compact["relative_resolution"]),
+             compact["max_distance_" + direction])
+
+
+def _compact_overlap(compact, direction, tolerance_mm):
+  """The surfel area within the tolerance in one direction."""
+  histogram = compact["histogram_" + direction]
+  edges = _histogram_bin_edge(np.arange(len(histogram)),
+                              compact["bin_width_mm"],
+                              compact["relative_resolution"])
+  return np.sum(histogram[edges <= tolerance_mm * (1 + 1e-9)])
+
+
 def compute_average_surface_distance(surface_distances):
   """Returns the average surface distance.
 
@@ -300,7 +1118,8 @@ def compute_average_surface_distance(surface_distances):
   Args:
     surface_distances: dict with "distances_gt_to_pred", "distances_pred_to_gt"
     "surfel_areas_gt", "surfel_areas_pred" created by
-    compute_surface_distances()
+    compute_surface_distances(), or its compact form created by
+    compact_surface_distances()
 
   Returns:
     A tuple with two float values:
@@ -309,6 +1128,11 @@ def compute_average_surface_distance(surface_distances):
       - the average distance from the predicted surface to the ground truth
         surface.
   """
+  if _is_compact(surface_distances):
+    return (surface_distances["distance_sum_gt_to_pred"] /
+            surface_distances["surface_area_gt"],
+            surface_distances["distance_sum_pred_to_gt"] /
+            surface_distances["surface_area_pred"])
   distances_gt_to_pred = surface_distances["distances_gt_to_pred"]
   distances_pred_to_gt = surface_distances["distances_pred_to_gt"]
   surfel_areas_gt = surface_distances["surfel_areas_gt"]
@@ -332,12 +1156,17 @@ def compute_robust_hausdorff(surface_distances, percent):
   Args:
     surface_distances: dict with "distances_gt_to_pred", "distances_pred_to_gt"
       "surfel_areas_gt", "surfel_areas_pred" created by
-      compute_surface_distances()
+      compute_surface_distances(), or its compact form created by
+      compact_surface_distances()
     percent: a float value between 0 and 100.
 
   Returns:
     a float value. The robust Hausdorff distance in mm.
   """
+  if _is_compact(surface_distances):
+    return max(
+        _compact_percentile(surface_distances, "gt", "gt_to_pred", percent),
+        _compact_percentile(surface_distances, "pred", "pred_to_gt", percent))
   distances_gt_to_pred = surface_distances["distances_gt_to_pred"]
   distances_pred_to_gt = surface_distances["distances_pred_to_gt"]
   surfel_areas_gt = surface_distances["surfel_areas_gt"]
@@ -362,6 +1191,39 @@ def compute_robust_hausdorff(surface_distances, percent):
   return max(perc_distance_gt_to_pred, perc_distance_pred_to_gt)
 
 
+def compute_worst_surfels(surface_distances, k=10):
+  """Finds the surface elements furthest from the other surface.
+
+  The distances are already sorted, so this is only a slice of each array,
+  e.g. to localise the largest errors without a second pass over the masks.
+
+  Args:
+    surface_distances: dict created by compute_surface_distances() with
+      `return_coordinates=True`.
+    k: int. The number of surface elements to return in each direction.
+
+  Returns:
+    A dict with the same keys as `surface_distances`, each holding (at most)
+    the `k` surface elements with the greatest distance to the other surface,
+    from the furthest.
+
+  Raises:
+    ValueError: If `surface_distances` has no surfel coordinates.
+  """
+  if "surfel_coordinates_gt" not in surface_distances:
+    raise ValueError("The surface distances have no surfel coordinates, "
+                     "compute them with `return_coordinates=True`.")
+  if k < 0:
+    raise ValueError("k must be at least 0, not {}.".format(k))
+  worst = {}
+  for side, direction in (("gt", "gt_to_pred"), ("pred", "pred_to_gt")):
+    for key in ("distances_" + direction, "surfel_areas_" + side,
+                "surfel_coordinates_" + side):
+      values = surface_distances[key]
+      worst[key] = values[len(values) - 1::-1][:k]
+  return worst
+
+
 def compute_surface_overlap_at_tolerance(surface_distances, tolerance_mm):
   """Computes the overlap of the surfaces at a specified tolerance.
 
@@ -373,13 +1235,19 @@ def compute_surface_overlap_at_tolerance(surface_distances, tolerance_mm):
   Args:
     surface_distances: dict with "distances_gt_to_pred", "distances_pred_to_gt"
       "surfel_areas_gt", "surfel_areas_pred" created by
-      compute_surface_distances()
+      compute_surface_distances(), or its compact form created by
+      compact_surface_distances()
     tolerance_mm: a float value. The tolerance in mm
 
   Returns:
     A tuple of two float values. The overlap fraction in [0.0, 1.0] of the
     ground truth surface with the predicted surface and vice versa.
   """
+  if _is_compact(surface_distances):
+    return (_compact_overlap(surface_distances, "gt_to_pred", tolerance_mm) /
+            surface_distances["surface_area_gt"],
+            _compact_overlap(surface_distances, "pred_to_gt", tolerance_mm) /
+            surface_distances["surface_area_pred"])
   distances_gt_to_pred = surface_distances["distances_gt_to_pred"]
   distances_pred_to_gt = surface_distances["distances_pred_to_gt"]
   surfel_areas_gt = surface_distances["surfel_areas_gt"]
@@ -406,12 +1274,19 @@ def compute_surface_dice_at_tolerance(surface_distances, tolerance_mm):
   Args:
     surface_distances: dict with "distances_gt_to_pred", "distances_pred_to_gt"
       "surfel_areas_gt", "surfel_areas_pred" created by
-      compute_surface_distances()
+      compute_surface_distances(), or its compact form created by
+      compact_surface_distances()
     tolerance_mm: a float value. The tolerance in mm
 
   Returns:
     A float value. The surface DICE coefficient in [0.0, 1.0].
   """
+  if _is_compact(surface_distances):
+    return (
+        (_compact_overlap(surface_distances, "gt_to_pred", tolerance_mm) +
+         _compact_overlap(surface_distances, "pred_to_gt", tolerance_mm)) /
+        (surface_distances["surface_area_gt"] +
+         surface_distances["surface_area_pred"]))
   distances_gt_to_pred = surface_distances["distances_gt_to_pred"]
   distances_pred_to_gt = surface_distances["distances_pred_to_gt"]
   surfel_areas_gt = surface_distances["surfel_areas_gt"]
@@ -440,4 +1315,192 @@ def compute_dice_coefficient(mask_gt, mask_pred):
   if volume_sum == 0:
     return np.nan
   volume_intersect = (mask_gt & mask_pred).sum()
-  return 2*volume_intersect / volume_sum
\ No newline at end of file
+  return 2*volume_intersect / volume_sum
+
+
+def compute_surface_distances_batch(masks_gt,
+                                    masks_pred,
+                                    spacing_mm):
+  """Computes the surface distances for a batch of 2D (resp. 3D) masks.
+
+  Equivalent to calling `compute_surface_distances` on each pair of masks
+  `(masks_gt[i], masks_pred[i])` but the neighbour codes, borders and distance
+  transforms of the whole batch are computed in a few vectorized calls. The
+  batch axis is treated as an axis whose spacing is larger than any distance
+  within a mask, so distances never cross from one mask to another.
+
+  Args:
+    masks_gt: 3-dim (resp. 4-dim) bool Numpy array. The ground truth masks,
+      stacked along the first axis.
+    masks_pred: 3-dim (resp. 4-dim) bool Numpy array. The predicted masks,
+      stacked along the first axis.
+    spacing_mm: 2-element (resp. 3-element) list-like structure. Voxel spacing
+      of each mask in x0 anx x1 (resp. x0, x1 and x2) directions.
+
+  Returns:
+    A dict with the same keys as `compute_surface_distances` plus
+    "batch_index_gt" and "batch_index_pred", 1-dim numpy arrays of type int
+    giving the index of the mask each surface element belongs to, and
+    "batch_size". The surface elements are sorted by mask and then by
+    distance.
+
+  Raises:
+    ValueError: If the masks and the `spacing_mm` arguments are of incompatible
+      shape or type. Or if the masks are not 2D or 3D.
+  """
+  _assert_is_bool_numpy_array("masks_gt", masks_gt)
+  _assert_is_bool_numpy_array("masks_pred", masks_pred)
+  if (masks_gt.shape != masks_pred.shape or
+      len(masks_gt.shape) != len(spacing_mm) + 1):
+    raise ValueError("The arguments must be of compatible shape. Got masks_gt "
+                     "of shape {} and masks_pred of shape {}, while the "
+                     "spacing_mm was {} elements.".format(
+                         masks_gt.shape, masks_pred.shape, len(spacing_mm)))
+
+  neighbour_code_to_surface_area, kernel, full_true_neighbours = (
+      _get_surface_lookup(spacing_mm))
+  batch_size = masks_gt.shape[0]
+  surface_distances = {
+      "distances_gt_to_pred": np.array([]),
+      "distances_pred_to_gt": np.array([]),
+      "surfel_areas_gt": np.array([]),
+      "surfel_areas_pred": np.array([]),
+      "batch_index_gt": np.array([], np.int64),
+      "batch_index_pred": np.array([], np.int64),
+      "batch_size": batch_size,
+  }
+
+  # a single bounding box, shared by all masks of the batch
+  bbox_min, bbox_max = _compute_bounding_box(
+      np.any(masks_gt, axis=0) | np.any(masks_pred, axis=0))
+  if bbox_min is None:
+    return surface_distances
+  bbox_min = np.concatenate([[0], bbox_min])
+  bbox_max = np.concatenate([[batch_size - 1], bbox_max])
+  # the batch axis must not be padded, the extra slice is dropped again
+  cropmask_gt = _crop_to_bounding_box(masks_gt, bbox_min, bbox_max)[:-1]
+  cropmask_pred = _crop_to_bounding_box(masks_pred, bbox_min, bbox_max)[:-1]
+
+  # a kernel of length one along the batch axis encodes each mask separately
+  kernel = kernel[np.newaxis]
+  neighbour_code_map_gt, borders_gt = _compute_borders(
+      cropmask_gt, kernel, full_true_neighbours)
+  neighbour_code_map_pred, borders_pred = _compute_borders(
+      cropmask_pred, kernel, full_true_neighbours)
+
+  # any distance between two masks of the batch is larger than the diagonal
+  # of the cropped masks, so the closest border is always in the same mask,
+  # if that mask has a border at all.
+  diagonal = np.linalg.norm(np.asarray(borders_gt.shape[1:]) *
+                            np.asarray(spacing_mm, np.float64))
+  sampling = (2 * diagonal,) + tuple(spacing_mm)
+  spatial_axes = tuple(range(1, borders_gt.ndim))
+  has_borders_gt = borders_gt.any(axis=spatial_axes)
+  has_borders_pred = borders_pred.any(axis=spatial_axes)
+  if has_borders_gt.any():
+    distmap_gt = ndimage.distance_transform_edt(~borders_gt, sampling=sampling)
+  else:
+    distmap_gt = np.inf * np.ones(borders_gt.shape)
+  if has_borders_pred.any():
+    distmap_pred = ndimage.distance_transform_edt(~borders_pred,
+                                                  sampling=sampling)
+  else:
+    distmap_pred = np.inf * np.ones(borders_pred.shape)
+
+  batch_index_gt = np.nonzero(borders_gt)[0]
+  batch_index_pred = np.nonzero(borders_pred)[0]
+  distances_gt_to_pred = distmap_pred[borders_gt]
+  distances_pred_to_gt = distmap_gt[borders_pred]
+  distances_gt_to_pred[~has_borders_pred[batch_index_gt]] = np.inf
+  distances_pred_to_gt[~has_borders_gt[batch_index_pred]] = np.inf
+  surfel_areas_gt = neighbour_code_to_surface_area[
+      neighbour_code_map_gt[borders_gt]]
+  surfel_areas_pred = neighbour_code_to_surface_area[
+      neighbour_code_map_pred[borders_pred]]
+
+  # sort them by mask, then by distance
+  order_gt = np.lexsort((surfel_areas_gt, distances_gt_to_pred,
+                         batch_index_gt))
+  order_pred = np.lexsort((surfel_areas_pred, distances_pred_to_gt,
+                           batch_index_pred))
+  surface_distances.update({
+      "distances_gt_to_pred": distances_gt_to_pred[order_gt],
+      "distances_pred_to_gt": distances_pred_to_gt[order_pred],
+      "surfel_areas_gt": surfel_areas_gt[order_gt],
+      "surfel_areas_pred": surfel_areas_pred[order_pred],
+      "batch_index_gt": batch_index_gt[order_gt],
+      "batch_index_pred": batch_index_pred[order_pred],
+  })
+  return surface_distances
+
+
+def compute_average_surface_distance_batch(surface_distances):
+  """Returns the average surface distance of every mask in a batch.
+
+  Args:
+    surface_distances: dict created by compute_surface_distances_batch()
+
+  Returns:
+    A tuple with two 1-dim numpy arrays of type float, one value per mask:
+      - the average distance (in mm) from the ground truth surface to the
+        predicted surface
+      - the average distance from the predicted surface to the ground truth
+        surface.
+  """
+  batch_size = surface_distances["batch_size"]
+  averages = []
+  for direction, side in (("gt_to_pred", "gt"), ("pred_to_gt", "pred")):
+    distances = surface_distances["distances_" + direction]
+    surfel_areas = surface_distances["surfel_areas_" + side]
+    batch_index = surface_distances["batch_index_" + side]
+    averages.append(
+        np.bincount(batch_index, weights=distances * surfel_areas,
+                    minlength=batch_size) /
+        np.bincount(batch_index, weights=surfel_areas, minlength=batch_size))
+  return tuple(averages)
+
+
+def compute_robust_hausdorff_batch(surface_distances, percent):
+  """Computes the robust Hausdorff distance of every mask in a batch.
+
+  Args:
+    surface_distances: dict created by compute_surface_distances_batch()
+    percent: a float value between 0 and 100.
+
+  Returns:
+    a 1-dim numpy array of type float. The robust Hausdorff distance in mm of
+    each mask.
+  """
+  batch_size = surface_distances["batch_size"]
+  perc_distances = []
+  for direction, side in (("gt_to_pred", "gt"), ("pred_to_gt", "pred")):
+    perc_distances.append(_batch_percentile(
+        surface_distances["distances_" + direction],
+        surface_distances["surfel_areas_" + side],
+        surface_distances["batch_index_" + side],
+        batch_size, percent))
+  return np.maximum(*perc_distances)
+
+
+def _batch_percentile(distances, surfel_areas, batch_index, batch_size,
+                      percent):
+  """Area weighted percentile of each mask's sorted distances."""
+  perc_distance = np.full(batch_size, np.inf)
+  if len(distances) == 0:  # pylint: disable=g-explicit-length-test
+    return perc_distance
+  masks = np.arange(batch_size)
+  starts = np.searchsorted(batch_index, masks, side="left")
+  ends = np.searchsorted(batch_index, masks, side="right")
+  non_empty = ends > starts
+  cum_areas = np.cumsum(surfel_areas)
+  offsets = np.where(starts > 0, cum_areas[starts - 1], 0)
+  totals = cum_areas[ends - 1] - offsets
+  surfel_areas_cum = (cum_areas - offsets[batch_index]) / totals[batch_index]
+  # the first surface element reaching the percentile, as np.searchsorted
+  # does for a single mask, or the last one if rounding stops short of it.
+  reached = np.where(surfel_areas_cum >= percent / 100.0,
+                     np.arange(len(distances)), len(distances))
+  first = np.minimum.reduceat(reached, starts[non_empty])
+  idx = np.minimum(first, ends[non_empty] - 1)
+  perc_distance[non_empty] = distances[idx]
+  return perc_distance
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from segmentationmetrics import (SegmentationMetrics, batch_metrics,
+                                 slice_metrics)
+from skimage.morphology import disk
+
+
+class TestBatchMetrics:
+    n_images = 8
+    prediction = np.zeros((n_images, 64, 64))
+    truth = np.zeros((n_images, 64, 64))
+    for i in range(n_images):
+        truth[i, 10 + i:31 + i, 20:41] = disk(10)
+        prediction[i, 12:12 + 2 * (6 + i) + 1,
+                   20 + i:20 + i + 2 * (6 + i) + 1] = disk(6 + i)
+
+    def test_matches_single_images(self):
+        metrics = batch_metrics(self.prediction, self.truth, (1, 0.5))
+        for i in range(self.n_images):
+            sm = SegmentationMetrics(self.prediction[i], self.truth[i],
+                                     (1, 0.5))
+            assert {key: value[i] for key, value in metrics.items()} == \
+                pytest.approx(sm.get_dict())
+
+    def test_options(self):
+        metrics = batch_metrics(self.prediction, self.truth, (1, 1),
+                                percentile=99, symmetric=False)
+        assert metrics['mean_surface_distance'].shape == (self.n_images, 2)
+        sm = SegmentationMetrics(self.prediction[3], self.truth[3], (1, 1),
+                                 percentile=99, symmetric=False)
+        assert metrics['hausdorff_distance'][3] == \
+            pytest.approx(sm.hausdorff_distance)
+        assert tuple(metrics['mean_surface_distance'][3]) == \
+            pytest.approx(sm.mean_surface_distance)
+
+
+class TestSliceMetrics:
+    truth = np.zeros((40, 40, 12))
+    prediction = np.zeros((40, 40, 12))
+    truth[5:30, 8:28, 2:9] = 1
+    prediction[7:31, 8:25, 3:11] = 1
+
+    def test_matches_single_slices(self):
+        metrics = slice_metrics(self.prediction, self.truth, (1, 0.8, 3))
+        np.testing.assert_array_equal(metrics['slice'], np.arange(2, 11))
+        for i, z in enumerate(metrics['slice']):
+            sm = SegmentationMetrics(self.prediction[..., z],
+                                     self.truth[..., z], (1, 0.8))
+            assert {key: value[i] for key, value in metrics.items()
+                    if key != 'slice'} == pytest.approx(sm.get_dict(),
+                                                        nan_ok=True)
+
+    def test_method_and_axis(self):
+        sm = SegmentationMetrics(self.prediction, self.truth, (1, 0.8, 3))
+        metrics = sm.get_slice_metrics(axis=0)
+        np.testing.assert_array_equal(metrics['slice'], np.arange(5, 31))
+        single = SegmentationMetrics(self.prediction[10], self.truth[10],
+                                     (0.8, 3))
+        assert metrics['hausdorff_distance'][5] == \
+            pytest.approx(single.hausdorff_distance)
+        assert metrics['dice'][5] == pytest.approx(single.dice)
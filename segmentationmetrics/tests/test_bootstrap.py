@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from segmentationmetrics import (CohortMetrics, bootstrap_ci,
+                                 bootstrap_paired_ci, bootstrap_pooled_ci)
+
+
+class TestBootstrap:
+    rng = np.random.default_rng(0)
+    metrics = pd.DataFrame({'dice': rng.beta(8, 2, 500),
+                            'hausdorff_distance': rng.gamma(2, 2, 500)})
+
+    def test_ci(self):
+        ci = bootstrap_ci(self.metrics, 2000, seed=1)
+        assert list(ci.index) == ['dice', 'hausdorff_distance']
+        np.testing.assert_allclose(ci['Estimate'], self.metrics.mean())
+        assert np.all(ci['Lower'] < ci['Estimate'])
+        assert np.all(ci['Estimate'] < ci['Upper'])
+        # Close to the normal approximation for a mean of many cases
+        se = self.metrics.std() / np.sqrt(len(self.metrics))
+        np.testing.assert_allclose(ci['Upper'] - ci['Lower'],
+                                   2 * 1.96 * se, rtol=0.1)
+
+        # Reproducible with a seed, whatever form the metrics take
+        assert ci.equals(bootstrap_ci(self.metrics, 2000, seed=1))
+        as_dict = bootstrap_ci({name: self.metrics[name].to_numpy()
+                                for name in self.metrics}, 2000, seed=1)
+        np.testing.assert_allclose(as_dict.to_numpy(), ci.to_numpy())
+        single = bootstrap_ci(self.metrics['dice'].to_numpy(), 2000, seed=1)
+        np.testing.assert_allclose(single.to_numpy()[0], ci.to_numpy()[0])
+
+    def test_paired(self):
+        better = self.metrics.copy()
+        better['dice'] += self.rng.normal(0.02, 0.01, len(better))
+        ci = bootstrap_paired_ci(better, self.metrics, 2000, seed=2)
+        assert ci.loc['dice', 'Lower'] > 0
+        assert ci.loc['dice', 'P-value'] < 0.01
+        assert ci.loc['hausdorff_distance', 'Estimate'] == 0
+        assert ci.loc['hausdorff_distance', 'P-value'] == 1
+
+        with pytest.raises(ValueError):
+            bootstrap_paired_ci(better, self.metrics[:10])
+
+    def test_pooled(self):
+        counts = {'tp': self.rng.integers(100, 1000, 200),
+                  'fp': self.rng.integers(0, 100, 200),
+                  'fn': self.rng.integers(0, 100, 200),
+                  'tn': self.rng.integers(1000, 2000, 200)}
+        ci = bootstrap_pooled_ci(counts, 1000, seed=3)
+        cohort = CohortMetrics()
+        cohort.add_counts(*[np.sum(counts[key])
+                            for key in ('tp', 'fp', 'fn', 'tn')])
+        for metric in ci.index:
+            assert ci.loc[metric, 'Estimate'] == pytest.approx(
+                getattr(cohort, metric))
+            assert ci.loc[metric, 'Lower'] <= ci.loc[metric, 'Estimate'] <= \
+                ci.loc[metric, 'Upper']
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            bootstrap_ci(np.zeros(0))
+        with pytest.raises(ValueError):
+            bootstrap_ci(self.metrics, confidence=95)
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from segmentationmetrics import CohortMetrics, SegmentationMetrics
+from segmentationmetrics import surface_distance as sd
+from skimage.morphology import ball
+
+
+def _sphere(shape, centre, radius):
+    img = np.zeros(shape)
+    b = ball(radius)
+    img[centre[0] - radius:centre[0] + radius + 1,
+        centre[1] - radius:centre[1] + radius + 1,
+        centre[2] - radius:centre[2] + radius + 1] = b
+    return img
+
+
+class TestCohortMetrics:
+    shape = (48, 48, 48)
+    cases = [(_sphere(shape, (24, 24, 24), 12),
+              _sphere(shape, (25, 24, 23), 11)),
+             (_sphere(shape, (20, 20, 20), 5),
+              _sphere(shape, (22, 20, 20), 6)),
+             (_sphere(shape, (30, 30, 30), 8),
+              _sphere(shape, (30, 30, 30), 8))]
+    zoom = (1, 1, 2)
+
+    def _accumulate(self, cases):
+        cohort = CohortMetrics(bin_width=0.05)
+        for prediction, truth in cases:
+            cohort.add(prediction, truth, self.zoom)
+        return cohort
+
+    def test_pooled_overlap(self):
+        cohort = self._accumulate(self.cases)
+        # Pooling the counts is the same as concatenating the volumes
+        prediction = np.concatenate([c[0] for c in self.cases])
+        truth = np.concatenate([c[1] for c in self.cases])
+        sm = SegmentationMetrics(prediction, truth, self.zoom)
+        for metric in ['dice', 'jaccard', 'sensitivity', 'specificity',
+                       'precision', 'accuracy']:
+            assert getattr(cohort, metric) == pytest.approx(
+                getattr(sm, metric))
+        assert cohort.n_cases == 3
+
+    def test_pooled_surface_distances(self):
+        cohort = self._accumulate(self.cases)
+        surface_distances = [sd.compute_surface_distances(p > 0.5, t > 0.5,
+                                                          self.zoom)
+                             for p, t in self.cases]
+        pooled = {key: np.concatenate([s[key] for s in surface_distances])
+                  for key in surface_distances[0]}
+        for key in ['gt_to_pred', 'pred_to_gt']:
+            order = np.argsort(pooled['distances_' + key], kind='stable')
+            pooled['distances_' + key] = pooled['distances_' + key][order]
+            area_key = 'surfel_areas_' + key.split('_')[0]
+            pooled[area_key] = pooled[area_key][order]
+
+        assert cohort.mean_surface_distance() == pytest.approx(
+            np.mean(sd.compute_average_surface_distance(pooled)))
+        for percentile in [50, 95, 100]:
+            exact = sd.compute_robust_hausdorff(pooled, percentile)
+            pooled_hd = cohort.hausdorff_distance(percentile)
+            assert exact <= pooled_hd < exact + cohort.bin_width
+
+    def test_merge(self):
+        cohort = self._accumulate(self.cases)
+        merged = self._accumulate(self.cases[:1]) + \
+            self._accumulate(self.cases[1:])
+        assert merged.n_cases == cohort.n_cases
+        assert merged.counts == cohort.counts
+        assert merged.get_dict() == pytest.approx(cohort.get_dict())
+
+        with pytest.raises(ValueError):
+            merged.merge(CohortMetrics(bin_width=1))
+
+    def test_empty_prediction(self):
+        cohort = CohortMetrics()
+        cohort.add(np.zeros(self.shape), self.cases[0][1], self.zoom)
+        assert cohort.dice == 0
+        assert cohort.hausdorff_distance() == np.inf
+        assert cohort.mean_surface_distance(symmetric=False)[1] == np.inf
+
+    def test_compact_surface_distances(self):
+        cohort = self._accumulate(self.cases)
+        compact = CohortMetrics(bin_width=0.05)
+        for prediction, truth in self.cases + [(np.zeros(self.shape),
+                                                self.cases[0][1])]:
+            surface_distances = sd.compute_surface_distances(
+                prediction > 0.5, truth > 0.5, self.zoom)
+            compact.add_surface_distances(sd.compact_surface_distances(
+                surface_distances, bin_width_mm=0.05))
+        cohort.add(np.zeros(self.shape), self.cases[0][1], self.zoom)
+        assert compact.hausdorff_distance(50) == pytest.approx(
+            cohort.hausdorff_distance(50))
+        assert compact.hausdorff_distance(100) == np.inf
+        assert compact.mean_surface_distance(symmetric=False)[0] == \
+            pytest.approx(cohort.mean_surface_distance(symmetric=False)[0])
+
+        with pytest.raises(ValueError):
+            compact.add_surface_distances(sd.compact_surface_distances(
+                surface_distances, bin_width_mm=0.1))
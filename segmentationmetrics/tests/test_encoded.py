@@ -0,0 +1,128 @@
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from segmentationmetrics import (CoordinateMask, RunLengthMask,
+                                 SegmentationMetrics)
+from segmentationmetrics.encoded import encoded_confusion_counts
+from segmentationmetrics.metrics import confusion_counts
+from skimage.morphology import ball, disk
+
+
+def _coco_string(counts):
+    # The compression used by the COCO API, for testing the decoder
+    chars = []
+    for i, x in enumerate(counts):
+        if i > 2:
+            x -= counts[i - 2]
+        more = True
+        while more:
+            c = x & 0x1f
+            x >>= 5
+            more = x != -1 if c & 0x10 else x != 0
+            if more:
+                c |= 0x20
+            chars.append(chr(c + 48))
+    return ''.join(chars)
+
+
+class TestRunLengthMask:
+    truth = np.zeros((64, 80), bool)
+    truth[10:31, 20:41] = disk(10)
+    truth[50:55, 70:78] = True
+    prediction = np.zeros((64, 80), bool)
+    prediction[12:33, 22:43] = disk(10)
+    prediction[0:64, 5] = True
+
+    def test_round_trip(self):
+        rle = RunLengthMask.from_dense(self.truth)
+        np.testing.assert_array_equal(rle.to_dense(), self.truth)
+        assert rle.count() == np.count_nonzero(self.truth)
+        np.testing.assert_array_equal(np.unique(rle.argwhere(), axis=0),
+                                      np.argwhere(self.truth))
+        bbox_min, bbox_max = rle.bounding_box()
+        np.testing.assert_array_equal(bbox_min, [10, 20])
+        np.testing.assert_array_equal(bbox_max, [54, 77])
+
+    def test_coco_string(self):
+        counts = [0, 3, 7, 1, 4, 1, 4]
+        rle = RunLengthMask(_coco_string(counts), (4, 5))
+        np.testing.assert_array_equal(rle.to_dense(),
+                                      RunLengthMask(counts, (4, 5)).to_dense())
+        with pytest.raises(ValueError):
+            RunLengthMask([1, 2], (4, 5))
+
+    def test_metrics_match_dense(self):
+        dense = SegmentationMetrics(self.prediction, self.truth, (1, 0.5))
+        encoded = SegmentationMetrics(RunLengthMask.from_dense(self.prediction),
+                                      RunLengthMask.from_dense(self.truth),
+                                      (1, 0.5))
+        assert encoded.get_dict() == pytest.approx(dense.get_dict())
+        np.testing.assert_array_equal(encoded.prediction, self.prediction)
+
+    def test_counts_without_decoding(self):
+        prediction = RunLengthMask.from_dense(self.prediction)
+        truth = RunLengthMask.from_dense(self.truth)
+        with mock.patch.object(RunLengthMask, 'crop') as crop, \
+                mock.patch.object(RunLengthMask, 'intersection_count',
+                                  wraps=prediction.intersection_count) as \
+                intersection_count:
+            sm = SegmentationMetrics(prediction, truth, (1, 0.5),
+                                     metrics=['dice', 'true_volume'])
+        crop.assert_not_called()
+        intersection_count.assert_called_once()
+        assert sm.dice == pytest.approx(SegmentationMetrics(
+            self.prediction, self.truth, (1, 0.5)).dice)
+
+
+class TestCoordinateMask:
+    truth = np.zeros((40, 40, 40), bool)
+    truth[5:16, 5:16, 5:16] = ball(5)
+    truth[30:35, 30:35, 30:35] = True
+    prediction = np.zeros((40, 40, 40), bool)
+    prediction[6:17, 5:16, 4:15] = ball(5)
+
+    def test_counts(self):
+        expected = confusion_counts(self.prediction, self.truth)
+        coords = encoded_confusion_counts(
+            CoordinateMask.from_dense(self.prediction),
+            CoordinateMask.from_dense(self.truth))
+        assert coords == expected
+
+    def test_metrics_match_dense(self):
+        dense = SegmentationMetrics(self.prediction, self.truth, (1, 2, 1))
+        encoded = SegmentationMetrics(
+            CoordinateMask(np.argwhere(self.prediction), (40, 40, 40)),
+            self.truth, (1, 2, 1))
+        assert encoded.get_dict() == pytest.approx(dense.get_dict())
+
+    def test_surfaces_decoded_per_cluster(self):
+        # Structures at opposite corners of a large volume
+        truth = np.zeros((120, 120, 120), bool)
+        truth[2:13, 2:13, 2:13] = ball(5)
+        truth[105:115, 108:118, 104:116] = True
+        prediction = np.zeros((120, 120, 120), bool)
+        prediction[3:14, 2:13, 2:13] = ball(5)
+        prediction[106:115, 108:117, 104:116] = True
+        dense = SegmentationMetrics(prediction, truth, (1, 2, 1))
+        with mock.patch.object(CoordinateMask, 'crop', autospec=True,
+                               side_effect=CoordinateMask.crop) as crop:
+            encoded = SegmentationMetrics(CoordinateMask.from_dense(prediction),
+                                          CoordinateMask.from_dense(truth),
+                                          (1, 2, 1))
+        assert encoded.get_dict() == pytest.approx(dense.get_dict())
+        # Only the boxes around each structure are decoded
+        assert crop.call_count == 4
+        for (_, bbox_min, bbox_max), _ in crop.call_args_list:
+            assert np.prod(np.subtract(bbox_max, bbox_min) + 1) < 20 ** 3
+
+    def test_mixed_encodings(self):
+        truth = self.truth[10]
+        prediction = self.prediction[10]
+        dense = SegmentationMetrics(prediction, truth, (1, 1))
+        encoded = SegmentationMetrics(CoordinateMask.from_dense(prediction),
+                                      RunLengthMask.from_dense(truth),
+                                      (1, 1))
+        assert encoded.get_dict() == pytest.approx(dense.get_dict(),
+                                                   nan_ok=True)
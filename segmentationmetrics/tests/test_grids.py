@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from segmentationmetrics import CrossGridMetrics, SegmentationMetrics
+
+
+def _sphere(shape, zoom, centre, radius):
+    """A sphere in mm, sampled at the voxel centres of a grid."""
+    centres = [(np.arange(n) + 0.5) * z for n, z in zip(shape, zoom)]
+    grid = np.meshgrid(*centres, indexing='ij')
+    return sum((g - c) ** 2 for g, c in zip(grid, centre)) < radius ** 2
+
+
+class TestCrossGridMetrics:
+    zoom = (1, 0.8, 2)
+    truth = _sphere((40, 40, 30), zoom, (20, 16, 30), 11)
+    prediction = _sphere((40, 40, 30), zoom, (21, 15, 30), 10)
+
+    def test_same_grid(self):
+        cgm = CrossGridMetrics(self.prediction, self.truth, self.zoom,
+                               self.zoom)
+        sm = SegmentationMetrics(self.prediction, self.truth, self.zoom)
+        assert cgm.get_dict() == pytest.approx(sm.get_dict())
+        assert type(cgm.get_df()) == pd.DataFrame
+
+    def test_coarse_prediction(self):
+        # Upsampling the coarse prediction by repeating voxels is the same
+        # as the nearest neighbour sampling, so the overlap matches
+        coarse = self.prediction[::2, ::2, ::2]
+        upsampled = coarse
+        for axis in range(3):
+            upsampled = np.repeat(upsampled, 2, axis)
+        cgm = CrossGridMetrics(coarse, self.truth, (2, 1.6, 4), self.zoom)
+        sm = SegmentationMetrics(upsampled, self.truth, self.zoom)
+        for metric in ['dice', 'jaccard', 'sensitivity', 'specificity',
+                       'precision', 'accuracy', 'predicted_volume']:
+            assert getattr(cgm, metric) == pytest.approx(getattr(sm, metric))
+
+    def test_different_resolutions(self):
+        # The same sphere on a 1.5 mm isotropic and a 0.7 x 0.7 x 3 mm grid
+        prediction = _sphere((40, 40, 20), (1.5, 1.5, 1.5), (30, 30, 15), 12)
+        truth = _sphere((86, 86, 10), (0.7, 0.7, 3), (30, 30, 15), 12)
+        cgm = CrossGridMetrics(prediction, truth, (1.5, 1.5, 1.5),
+                               (0.7, 0.7, 3))
+        assert cgm.dice > 0.9
+        assert cgm.hausdorff_distance < 3
+        assert cgm.predicted_volume == pytest.approx(
+            4 / 3 * np.pi * 12 ** 3 / 1000, rel=0.05)
+
+    def test_affine(self):
+        # The truth stored flipped along the first axis and shifted
+        affine = np.diag([-1, 0.8, 2, 1.])
+        affine[:3, 3] = [39.5 + 10, 0.4, 1]
+        prediction_affine = np.diag([1, 0.8, 2, 1.])
+        prediction_affine[:3, 3] = [0.5 + 10, 0.4, 1]
+        cgm = CrossGridMetrics(self.prediction, self.truth[::-1],
+                               prediction_affine=prediction_affine,
+                               truth_affine=affine)
+        sm = SegmentationMetrics(self.prediction, self.truth, self.zoom)
+        assert cgm.get_dict() == pytest.approx(sm.get_dict())
+
+    def test_empty(self):
+        cgm = CrossGridMetrics(np.zeros((20, 20)), self.truth[20],
+                               (2, 2), (1, 0.8))
+        assert cgm.dice == 0
+        assert cgm.hausdorff_distance == np.inf
+        assert cgm.counts['fn'] == np.count_nonzero(self.truth[20])
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            CrossGridMetrics(self.prediction, self.truth, self.zoom)
+        with pytest.raises(ValueError):
+            CrossGridMetrics(self.prediction, self.truth, self.zoom,
+                             truth_affine=np.eye(3))
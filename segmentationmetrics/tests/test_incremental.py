@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from segmentationmetrics import IncrementalMetrics, SegmentationMetrics
+from skimage.morphology import ball, disk
+
+
+class TestIncrementalMetrics:
+    truth = np.zeros((40, 40, 30))
+    truth[4:27, 6:29, 3:26] = ball(11)
+    prediction = np.zeros((40, 40, 30))
+    prediction[6:29, 6:29, 4:27] = ball(11)
+
+    def _check(self, im, zoom):
+        sm = SegmentationMetrics(im.prediction, im.truth, zoom)
+        assert im.get_dict() == pytest.approx(sm.get_dict(), nan_ok=True)
+
+    def test_edits(self):
+        zoom = (1, 0.8, 2)
+        im = IncrementalMetrics(self.prediction, self.truth, zoom)
+        self._check(im, zoom)
+        rng = np.random.default_rng(0)
+        # Small corrections, an edit far from both surfaces, an edit at the
+        # edge of the volume and an edit of both masks
+        im.update((slice(10, 14), slice(5, 9), slice(3, 8)), prediction=1)
+        self._check(im, zoom)
+        im.update((slice(20, 30), slice(10, 20), slice(10, 20)),
+                  prediction=rng.random((10, 10, 10)) > 0.5)
+        self._check(im, zoom)
+        im.update((slice(35, 40), slice(35, 40), slice(0, 3)), truth=True)
+        self._check(im, zoom)
+        im.update((slice(0, 40), slice(0, 40), slice(20, 30)),
+                  prediction=0, truth=self.prediction[..., 20:])
+        self._check(im, zoom)
+        im.update((slice(None), slice(None), slice(None)), prediction=0)
+        self._check(im, zoom)
+        assert type(im.get_df()) == pd.DataFrame
+
+    def test_2d(self):
+        truth = np.zeros((30, 30), bool)
+        truth[5:20, 5:20] = disk(7)
+        im = IncrementalMetrics(np.zeros((30, 30)), truth, (1, 2))
+        self._check(im, (1, 2))
+        im.update((slice(6, 21), slice(5, 20)), prediction=disk(7))
+        self._check(im, (1, 2))
+        im.update((slice(25, 27), slice(0, 1)), truth=[[1], [1]])
+        self._check(im, (1, 2))
+
+    def test_invalid_region(self):
+        im = IncrementalMetrics(self.prediction, self.truth, (1, 1, 1))
+        with pytest.raises(ValueError):
+            im.update((slice(0, 2), slice(0, 2)), prediction=1)
+        with pytest.raises(ValueError):
+            im.update((slice(0, 4, 2),) * 3, prediction=1)
+        with pytest.raises(ValueError):
+            im.prediction[0, 0, 0] = 1
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from segmentationmetrics import InstanceMetrics, SegmentationMetrics
+from skimage.morphology import ball
+
+
+class TestInstanceMetrics:
+    shape = (64, 64, 64)
+    truth = np.zeros(shape)
+    prediction = np.zeros(shape)
+    # Two detected lesions, one missed and one false positive
+    truth[5:16, 5:16, 5:16] = ball(5)
+    prediction[6:17, 5:16, 5:16] = ball(5)
+    truth[30:45, 30:45, 30:45] = ball(7)
+    prediction[31:44, 32:45, 30:43] = ball(6)
+    truth[50:55, 5:10, 50:55] = ball(2)
+    prediction[5:10, 50:55, 50:55] = ball(2)
+
+    def test_detection(self):
+        im = InstanceMetrics(self.prediction, self.truth, (1, 1, 1))
+        assert im.get_dict() == pytest.approx({'n_true': 3,
+                                               'n_predicted': 3,
+                                               'true_positives': 2,
+                                               'false_positives': 1,
+                                               'false_negatives': 1,
+                                               'detection_precision': 2 / 3,
+                                               'detection_sensitivity': 2 / 3,
+                                               'detection_f1': 2 / 3})
+        assert im.overlap.sum() == np.prod(self.shape)
+
+    def test_per_instance(self):
+        im = InstanceMetrics(self.prediction, self.truth, (1, 1, 2))
+        df = im.get_df()
+        assert type(df) == pd.DataFrame
+        assert len(df) == 4
+
+        # Matched pairs agree with evaluating each lesion on its own
+        for box in [np.s_[:20, :20, :20], np.s_[25:50, 25:50, 25:50]]:
+            sm = SegmentationMetrics(self.prediction[box], self.truth[box],
+                                     (1, 1, 2))
+            row = df[np.isclose(df['true_volume'], sm.true_volume)]
+            assert row['dice'].item() == pytest.approx(sm.dice)
+            assert row['hausdorff_distance'].item() == \
+                pytest.approx(sm.hausdorff_distance)
+            assert row['mean_surface_distance'].item() == \
+                pytest.approx(sm.mean_surface_distance)
+
+        unmatched = df[(df['true_label'] == 0) | (df['predicted_label'] == 0)]
+        assert (unmatched['dice'] == 0).all()
+        assert unmatched['hausdorff_distance'].isna().all()
+
+    def test_iou_threshold(self):
+        im = InstanceMetrics(self.prediction, self.truth, (1, 1, 1),
+                             iou_threshold=0.99)
+        assert im.true_positives == 0
+        assert im.detection_f1 == 0
+
+    def test_empty(self):
+        im = InstanceMetrics(np.zeros(self.shape), self.truth, (1, 1, 1))
+        assert im.n_predicted == 0
+        assert im.false_negatives == 3
+        assert np.isnan(im.detection_precision)
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from segmentationmetrics import (SegmentationMetrics, local_overlap_maps,
+                                 local_surface_error_map, surface_error_map)
+from segmentationmetrics import surface_distance as sd
+from skimage.morphology import ball, disk
+
+
+class TestLocal:
+    truth = np.zeros((40, 40, 30))
+    truth[4:27, 6:29, 3:26] = ball(11)
+    prediction = np.zeros((40, 40, 30))
+    prediction[6:29, 6:29, 4:27] = ball(11)
+    zoom = (1, 0.8, 2)
+
+    def test_overlap_maps(self):
+        window = (5, 7, 3)
+        maps = local_overlap_maps(self.prediction, self.truth, window)
+        for voxel in [(15, 17, 14), (5, 17, 14), (0, 0, 0), (39, 20, 29)]:
+            region = tuple(slice(max(i - w // 2, 0), i + w // 2 + 1)
+                           for i, w in zip(voxel, window))
+            prediction = self.prediction[region] > 0.5
+            truth = self.truth[region] > 0.5
+            assert maps['tp'][voxel] == np.sum(prediction & truth)
+            assert maps['fp'][voxel] == np.sum(prediction & ~truth)
+            assert maps['fn'][voxel] == np.sum(~prediction & truth)
+            if prediction.any() or truth.any():
+                sm = SegmentationMetrics(prediction, truth, self.zoom,
+                                         metrics=['dice', 'jaccard'])
+                assert maps['dice'][voxel] == pytest.approx(sm.dice)
+                assert maps['jaccard'][voxel] == pytest.approx(sm.jaccard)
+            else:
+                assert np.isnan(maps['dice'][voxel])
+
+        # A window covering the whole volume everywhere
+        maps = local_overlap_maps(self.prediction, self.truth, 79)
+        sm = SegmentationMetrics(self.prediction, self.truth, self.zoom)
+        np.testing.assert_allclose(maps['dice'], sm.dice)
+
+    def test_surface_error_map(self):
+        errors = surface_error_map(self.prediction, self.truth, self.zoom)
+        expected = sd.compute_surface_distances(self.prediction > 0.5,
+                                                self.truth > 0.5, self.zoom,
+                                                return_coordinates=True)
+        for side, direction, key in (('prediction', 'gt_to_pred', 'gt'),
+                                     ('truth', 'pred_to_gt', 'pred')):
+            mask = getattr(self, side) > 0.5
+            assert mask[tuple(errors[side]['coordinates'].T)].all()
+            # Each surface element is on one of the voxels at its corner
+            offsets = expected['surfel_coordinates_' + key] - \
+                errors[side]['coordinates']
+            assert np.isin(offsets, [0, 1]).all()
+            np.testing.assert_allclose(np.sort(errors[side]['distances']),
+                                       expected['distances_' + direction])
+            assert np.sum(errors[side]['areas']) == pytest.approx(
+                np.sum(expected['surfel_areas_' + key]))
+
+    def test_local_surface_error_map(self):
+        error = local_surface_error_map(self.prediction, self.truth,
+                                        self.zoom, 79)
+        # Both surfaces weighted by area, rather than the mean of the two
+        # directions
+        expected = sd.compute_surface_distances(self.prediction > 0.5,
+                                                self.truth > 0.5, self.zoom)
+        areas = np.concatenate([expected['surfel_areas_gt'],
+                                expected['surfel_areas_pred']])
+        distances = np.concatenate([expected['distances_gt_to_pred'],
+                                    expected['distances_pred_to_gt']])
+        np.testing.assert_allclose(error, np.sum(areas * distances) /
+                                   np.sum(areas))
+
+        error = local_surface_error_map(self.prediction, self.truth,
+                                        self.zoom, 3)
+        assert np.isnan(error[0, 0, 0])
+        assert np.nanmin(error) == 0
+
+    def test_2d_and_empty(self):
+        truth = np.zeros((30, 30))
+        truth[5:16, 5:16] = disk(5)
+        errors = surface_error_map(np.zeros((30, 30)), truth, (1, 1))
+        assert len(errors['prediction']['distances']) == 0
+        assert np.all(np.isinf(errors['truth']['distances']))
+        error = local_surface_error_map(np.zeros((30, 30)), truth, (1, 1), 5)
+        assert np.isinf(error[10, 5])
+        assert np.isnan(error[25, 25])
+        errors = surface_error_map(np.zeros((30, 30)), np.zeros((30, 30)),
+                                   (1, 1))
+        assert errors['truth']['coordinates'].shape == (0, 2)
+
+    def test_window(self):
+        with pytest.raises(ValueError):
+            local_overlap_maps(self.prediction, self.truth, 0)
@@ -108,6 +108,31 @@ class TestSegmentationMetrics:
                                                'volume_difference': 1.5280},
                                               rel=1e-20, abs=1e-4)
 
+    def test_memory_layout_and_dtype(self):
+        crop = (slice(40, 120),) * 3
+        expected = SegmentationMetrics(self.img_a[crop], self.img_b[crop],
+                                       (1, 2, 1)).get_dict()
+        for convert in (np.asfortranarray,
+                        lambda img: img.astype(bool),
+                        lambda img: np.asfortranarray(img, np.uint8)):
+            sm = SegmentationMetrics(convert(self.img_a[crop]),
+                                     convert(self.img_b[crop]), (1, 2, 1))
+            assert sm.get_dict() == pytest.approx(expected, rel=1e-12)
+            # The masks are kept thresholded, as bools
+            assert sm.prediction.dtype == bool
+            np.testing.assert_array_equal(sm.prediction,
+                                          self.img_a[crop] > 0.5)
+            np.testing.assert_array_equal(sm.truth, self.img_b[crop] > 0.5)
+
+    def test_empty(self):
+        empty = np.zeros((8, 8, 8))
+        sm = SegmentationMetrics(empty, empty, (1, 1, 1))
+        assert sm.true_volume == 0
+        assert sm.specificity == 1
+        assert np.isnan(sm.dice)
+        with pytest.raises(ValueError):
+            SegmentationMetrics(empty, empty[1:], (1, 1, 1))
+
     def test_no_overlap(self):
         # Non-overlapping spheres
         sm = SegmentationMetrics(self.img_a, self.img_c, (1, 1, 1))
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from segmentationmetrics import MultiClassMetrics, SegmentationMetrics
+from segmentationmetrics import multiclass
+
+
+class TestMultiClassMetrics:
+    rng = np.random.default_rng(0)
+    truth = rng.integers(0, 4, (30, 40, 20)).astype(np.uint8)
+    prediction = truth.copy()
+    changed = rng.random(truth.shape) > 0.8
+    prediction[changed] = rng.integers(0, 5, np.count_nonzero(changed))
+    zoom = (1, 1, 2)
+
+    def test_confusion_matrix(self, monkeypatch):
+        expected = np.zeros((5, 5), np.int64)
+        np.add.at(expected, (self.truth.ravel(), self.prediction.ravel()), 1)
+        mcm = MultiClassMetrics(self.prediction, self.truth, self.zoom)
+        np.testing.assert_array_equal(mcm.confusion_matrix, expected)
+        # The same over many small chunks, whatever the memory layout
+        monkeypatch.setattr(multiclass, '_CHUNK_SIZE', 1000)
+        chunked = MultiClassMetrics(np.asfortranarray(self.prediction),
+                                    self.truth, self.zoom, n_classes=6)
+        np.testing.assert_array_equal(chunked.confusion_matrix[:5, :5],
+                                      expected)
+        assert chunked.confusion_matrix[5].sum() == 0
+
+    def test_matches_binary(self):
+        mcm = MultiClassMetrics(self.prediction, self.truth, self.zoom)
+        for label in range(mcm.n_classes):
+            sm = SegmentationMetrics(self.prediction == label,
+                                     self.truth == label, self.zoom)
+            for metric in ['dice', 'jaccard', 'sensitivity', 'specificity',
+                           'precision', 'true_volume', 'predicted_volume',
+                           'volume_difference']:
+                assert getattr(mcm, metric)[label] == \
+                    pytest.approx(getattr(sm, metric), nan_ok=True)
+        df = mcm.get_df()
+        assert type(df) == pd.DataFrame
+        assert list(df.index) == list(range(5))
+        assert df.loc[2, 'dice'] == mcm.dice[2]
+
+    def test_averages(self):
+        mcm = MultiClassMetrics(self.prediction, self.truth, self.zoom)
+        metrics = mcm.get_dict()
+        assert metrics['accuracy'] == pytest.approx(
+            np.mean(self.prediction == self.truth))
+        assert metrics['macro_dice'] == pytest.approx(np.mean(mcm.dice[1:]))
+        # Micro-averaged over the foreground classes
+        tp = np.count_nonzero((self.prediction == self.truth) &
+                              (self.truth > 0))
+        assert metrics['micro_sensitivity'] == pytest.approx(
+            tp / np.count_nonzero(self.truth > 0))
+        with_background = MultiClassMetrics(self.prediction, self.truth,
+                                            self.zoom,
+                                            include_background=True)
+        assert with_background.get_dict()['macro_dice'] == \
+            pytest.approx(np.mean(mcm.dice))
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            MultiClassMetrics(self.prediction, self.truth, self.zoom,
+                              n_classes=3)
+        with pytest.raises(ValueError):
+            MultiClassMetrics(self.prediction.astype(float), self.truth,
+                              self.zoom)
+        with pytest.raises(ValueError):
+            MultiClassMetrics(self.prediction[1:], self.truth, self.zoom)
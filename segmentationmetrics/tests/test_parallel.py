@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from segmentationmetrics import SegmentationMetrics, parallel_metrics
+from segmentationmetrics.parallel import _SegmentPool
+from skimage.morphology import ball
+
+
+class TestParallelMetrics:
+    cases = []
+    for i in range(5):
+        r = 5 + i
+        truth = np.zeros((32, 32, 32))
+        truth[16 - r:17 + r, 16 - r:17 + r, 16 - r:17 + r] = ball(r)
+        prediction = np.roll(truth, i, axis=0)
+        cases.append((prediction, truth, (1, 1, 1 + i / 2)))
+    cases.append((np.zeros((12, 10)), np.eye(12, 10), (1, 2)))
+
+    @pytest.mark.parametrize('packed', [False, True])
+    def test_matches_single_cases(self, packed):
+        # Mix memory layouts and data types
+        cases = [(np.asfortranarray(p), t.astype(bool), z)
+                 for p, t, z in self.cases]
+        results = parallel_metrics(cases, workers=2, packed=packed)
+        assert len(results) == len(cases)
+        for (prediction, truth, zoom), metrics in zip(self.cases, results):
+            sm = SegmentationMetrics(prediction, truth, zoom)
+            assert metrics == pytest.approx(sm.get_dict(), nan_ok=True)
+
+    def test_asymmetric(self):
+        results = parallel_metrics(iter(self.cases[:2]), workers=1,
+                                   symmetric=False)
+        sm = SegmentationMetrics(*self.cases[1], symmetric=False)
+        assert np.allclose(results[1]['mean_surface_distance'],
+                           sm.mean_surface_distance)
+
+    def test_raises_on_different_shapes(self):
+        with pytest.raises(ValueError):
+            parallel_metrics([(np.zeros((4, 4)), np.zeros((4, 5)), (1, 1))],
+                             workers=1)
+
+
+class TestSegmentPool:
+    def test_reuses_segments(self):
+        pool = _SegmentPool()
+        try:
+            a = pool.acquire(100)
+            pool.release(a)
+            assert pool.acquire(50) is a
+            b = pool.acquire(100)
+            assert b is not a
+            pool.release(a)
+            pool.release(b)
+            assert pool.acquire(200).size >= 200
+            assert len(pool._segments) == 3
+        finally:
+            pool.close()
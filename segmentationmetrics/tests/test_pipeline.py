@@ -0,0 +1,69 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from segmentationmetrics import SegmentationMetrics, metrics_pipeline
+from skimage.morphology import ball
+
+
+def _collect(cases, **kwargs):
+    async def run():
+        return [result async for result in metrics_pipeline(cases, **kwargs)]
+    return asyncio.run(run())
+
+
+class TestMetricsPipeline:
+    masks = {}
+    for r in range(4, 9):
+        truth = np.zeros((24, 24, 24))
+        truth[12 - r:13 + r, 12 - r:13 + r, 12 - r:13 + r] = ball(r)
+        masks[r] = (np.roll(truth, 2, axis=1), truth, (1, 1, 2))
+
+    def test_thread_loader(self):
+        results = _collect(list(self.masks), load=self.masks.get, prefetch=3)
+        assert sorted(case for case, _ in results) == list(self.masks)
+        for case, metrics in results:
+            sm = SegmentationMetrics(*self.masks[case])
+            assert metrics == pytest.approx(sm.get_dict())
+
+    def test_async_loader_and_cases(self):
+        loading = []
+
+        async def load(case):
+            loading.append(case)
+            await asyncio.sleep(0.01)
+            loading.remove(case)
+            return self.masks[case]
+
+        async def cases():
+            for case in self.masks:
+                yield case
+                # never more than prefetch cases are loading at once
+                assert len(loading) <= 2
+
+        results = _collect(cases(), load=load, prefetch=2)
+        assert len(results) == len(self.masks)
+
+    def test_default_loader(self):
+        results = _collect([self.masks[4]], prefetch=1)
+        assert results[0][1]['dice'] == pytest.approx(
+            SegmentationMetrics(*self.masks[4]).dice)
+
+    def test_errors(self):
+        def load(case):
+            if case == 6:
+                raise OSError('Cannot read case')
+            return self.masks[case]
+
+        with pytest.raises(OSError):
+            _collect(list(self.masks), load=load)
+        with pytest.raises(ValueError):
+            _collect(list(self.masks), prefetch=0)
+
+    def test_early_exit(self):
+        async def run():
+            async for case, metrics in metrics_pipeline(
+                    list(self.masks), load=self.masks.get, prefetch=2):
+                return case
+        assert asyncio.run(run()) in self.masks
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from segmentationmetrics import (compute_surface_distances_planned,
+                                 plan_surface_distances)
+from segmentationmetrics import surface_distance as sd
+from skimage.morphology import ball
+
+
+class TestPlanner:
+    truth = np.zeros((60, 50, 40), bool)
+    truth[5:28, 5:28, 5:28] = ball(11)
+    truth[40:55, 30:45, 20:35] = True
+    prediction = np.zeros((60, 50, 40), bool)
+    prediction[6:29, 5:28, 6:29] = ball(11)
+    prediction[41:55, 30:44, 21:35] = True
+    zoom = (1, 0.8, 2)
+
+    def _check(self, result):
+        expected = sd.compute_surface_distances(self.truth, self.prediction,
+                                                self.zoom)
+        for direction, side in (('gt_to_pred', 'gt'), ('pred_to_gt', 'pred')):
+            # Distances found by nearest neighbour search can differ from the
+            # distance transform in the last bit, which reorders ties
+            pairs = []
+            for surface_distances in (result, expected):
+                distances = surface_distances['distances_' + direction]
+                areas = surface_distances['surfel_areas_' + side]
+                order = np.lexsort((areas, np.round(distances, 9)))
+                pairs.append((distances[order], areas[order]))
+            np.testing.assert_allclose(pairs[0], pairs[1])
+
+    def test_plan(self):
+        plan = plan_surface_distances(self.truth, self.prediction, self.zoom)
+        assert plan['within_budget']
+        assert plan['statistics']['n_clusters'] == 2
+        assert plan['statistics']['surfels'] > 0
+        assert set(plan['estimates']) == {'edt', 'clustered', 'kdtree',
+                                          'slabs'}
+        fastest = min(plan['estimates'],
+                      key=lambda name: plan['estimates'][name]['seconds'])
+        assert plan['strategy'] == fastest
+
+    def test_budget(self):
+        plan = plan_surface_distances(self.truth, self.prediction, self.zoom)
+        memory = {name: estimate['memory_bytes']
+                  for name, estimate in plan['estimates'].items()}
+        budget = memory['kdtree'] - 1
+        plan = plan_surface_distances(self.truth, self.prediction, self.zoom,
+                                      budget)
+        assert plan['within_budget']
+        assert plan['estimates'][plan['strategy']]['memory_bytes'] <= budget
+        result = compute_surface_distances_planned(self.truth, self.prediction,
+                                                   self.zoom, budget)
+        assert result['plan']['strategy'] == plan['strategy']
+        self._check(result)
+
+        # Nothing fits, so the least memory is used
+        result = compute_surface_distances_planned(self.truth, self.prediction,
+                                                   self.zoom, 1)
+        assert not result['plan']['within_budget']
+        assert result['plan']['strategy'] == 'slabs'
+        assert result['plan']['options'] == {'slab_size': 1}
+        self._check(result)
+
+    @pytest.mark.parametrize('strategy', ['edt', 'clustered', 'kdtree',
+                                          'slabs'])
+    def test_strategies(self, strategy):
+        result = compute_surface_distances_planned(
+            self.truth, self.prediction, self.zoom, strategy=strategy)
+        assert result['plan']['strategy'] == strategy
+        self._check(result)
+
+    def test_empty(self):
+        mask = np.zeros((20, 20), bool)
+        result = compute_surface_distances_planned(mask, mask, (1, 1))
+        assert result['plan']['statistics']['box_voxels'] == 0
+        assert len(result['distances_gt_to_pred']) == 0
+
+    def test_unknown_strategy(self):
+        with pytest.raises(ValueError):
+            compute_surface_distances_planned(self.truth, self.prediction,
+                                              self.zoom, strategy='band')
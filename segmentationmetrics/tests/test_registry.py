@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+from segmentationmetrics import (CoordinateMask, MetricEvaluator,
+                                 SegmentationMetrics, available_metrics,
+                                 register_intermediate, register_metric)
+from segmentationmetrics import registry
+from segmentationmetrics import surface_distance as sd
+
+
+class TestMetricRegistry:
+    truth = np.zeros((30, 30, 20))
+    truth[5:20, 8:22, 4:16] = 1
+    prediction = np.zeros((30, 30, 20))
+    prediction[7:21, 8:24, 3:15] = 1
+
+    def test_plan(self):
+        evaluator = MetricEvaluator(self.prediction, self.truth, (1, 1, 2))
+        assert evaluator.plan(['dice']) == ['bounding_box', 'masks',
+                                            'counts']
+        plan = evaluator.plan(['hausdorff_distance', 'surface_dice',
+                               'boundary_iou', 'dice'])
+        assert sorted(plan) == sorted(set(plan))
+        assert plan.index('borders') < plan.index('distance_maps') < \
+            plan.index('surface_distances')
+        # Encoded masks are counted without decoding them
+        evaluator = MetricEvaluator(CoordinateMask.from_dense(self.prediction),
+                                    CoordinateMask.from_dense(self.truth),
+                                    (1, 1, 2))
+        assert evaluator.plan(['dice']) == ['counts']
+
+    def test_intermediates_computed_once(self):
+        calls = []
+
+        @register_intermediate('_test_volume', requires=('counts', 'zoom'))
+        def volume(counts, zoom):
+            calls.append(1)
+            return (counts['tp'] + counts['fn']) * np.prod(zoom)
+
+        @register_metric('_test_twice', requires=('_test_volume',),
+                         label='Twice')
+        def twice(_test_volume, scale=2):
+            return scale * _test_volume
+
+        try:
+            sm = SegmentationMetrics(self.prediction, self.truth, (1, 1, 2),
+                                     metrics=['_test_twice', 'true_volume',
+                                              '_test_twice'], scale=3)
+            assert len(calls) == 1
+            assert sm._test_twice == pytest.approx(3 * 1000 * sm.true_volume)
+            assert list(sm.get_df()['Metric']) == ['Twice', 'True Volume']
+        finally:
+            registry._METRICS.pop('_test_twice')
+            registry._INTERMEDIATES.pop('_test_volume')
+
+    def test_extra_metrics(self):
+        sm = SegmentationMetrics(
+            self.prediction, self.truth, (1, 1, 2),
+            metrics=['surface_dice', 'boundary_iou', 'relative_volume_error'],
+            tolerance=2)
+        surface_dist = sd.compute_surface_distances(self.prediction > 0.5,
+                                                    self.truth > 0.5,
+                                                    (1, 1, 2))
+        assert sm.surface_dice == pytest.approx(
+            sd.compute_surface_dice_at_tolerance(surface_dist, 2))
+        assert 0 < sm.boundary_iou < 1
+        assert sm.relative_volume_error == pytest.approx(
+            np.sum(self.prediction) / np.sum(self.truth) - 1)
+        assert sm.get_df()['Metric'][1] == 'Boundary IoU'
+
+        same = SegmentationMetrics(self.truth, self.truth, (1, 1, 2),
+                                   metrics=['boundary_iou', 'surface_dice'])
+        assert same.boundary_iou == 1
+        assert same.surface_dice == 1
+
+    def test_boundary_iou_orientation(self):
+        truth = np.zeros((20, 20))
+        truth[5:15, 5:15] = 1
+        prediction = np.zeros((20, 20))
+        prediction[6:15, 5:16] = 1
+        # A one voxel band on every side of the square
+        same = SegmentationMetrics(truth, truth, (1, 1),
+                                   metrics=['boundary_iou'])
+        assert same.boundary_iou == 1
+        scores = []
+        for k in range(4):
+            for flip in (False, True):
+                p, t = np.rot90(prediction, k), np.rot90(truth, k)
+                if flip:
+                    p, t = p[::-1], t[::-1]
+                scores.append(SegmentationMetrics(
+                    p, t, (1, 1), metrics=['boundary_iou']).boundary_iou)
+        assert scores == pytest.approx([scores[0]] * 8)
+        # Bands of 36 voxels each, 19 in common
+        assert scores[0] == pytest.approx(19 / (36 + 36 - 19))
+
+    def test_default_metrics(self):
+        sm = SegmentationMetrics(self.prediction, self.truth, (1, 1, 2))
+        assert list(sm.get_dict()) == available_metrics()[:11]
+
+    def test_reserved_names(self):
+        for name in ['get_dict', 'metrics', 'zoom']:
+            with pytest.raises(ValueError):
+                register_metric(name, requires=('counts',))
+            assert name not in available_metrics()
+        # Every public attribute of SegmentationMetrics besides the metrics
+        sm = SegmentationMetrics(self.prediction, self.truth, (1, 1, 2))
+        public = {name for name in dir(sm) if not name.startswith('_')}
+        assert public - set(available_metrics()) <= registry._RESERVED_NAMES
+
+    def test_raises_on_unknown_names(self):
+        with pytest.raises(ValueError):
+            SegmentationMetrics(self.prediction, self.truth, (1, 1, 2),
+                                metrics=['dice', 'not_a_metric'])
+        with pytest.raises(ValueError):
+            SegmentationMetrics(self.prediction, self.truth, (1, 1, 2),
+                                tolerence=2)
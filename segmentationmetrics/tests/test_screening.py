@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from segmentationmetrics import (SegmentationMetrics,
+                                 approximate_surface_metrics, qa_gate)
+from skimage.morphology import ball
+
+
+class TestApproximateSurfaceMetrics:
+    truth = np.zeros((48, 48, 48))
+    prediction = np.zeros((48, 48, 48))
+    truth[8:39, 8:39, 8:39] = ball(15)
+    prediction[10:39, 9:38, 8:37] = ball(14)
+
+    def test_within_error_bound(self):
+        sm = SegmentationMetrics(self.prediction, self.truth, (1, 1, 2))
+        approx = approximate_surface_metrics(self.prediction, self.truth,
+                                             (1, 1, 2), factor=2)
+        assert approx['max_error_mm'] > 0
+        for metric in ['mean_surface_distance', 'hausdorff_distance']:
+            assert abs(approx[metric] - getattr(sm, metric)) <= \
+                approx['max_error_mm']
+
+    def test_options(self):
+        sm = SegmentationMetrics(self.prediction, self.truth, (1, 1, 1),
+                                 percentile=99, symmetric=False)
+        approx = approximate_surface_metrics(self.prediction, self.truth,
+                                             (1, 1, 1), factor=(1, 1, 1),
+                                             percentile=99, symmetric=False)
+        assert approx['max_error_mm'] == 0
+        assert approx['hausdorff_distance'] == sm.hausdorff_distance
+        assert approx['mean_surface_distance'] == sm.mean_surface_distance
+
+
+class TestQAGate:
+    truth = np.zeros((48, 48, 48))
+    prediction = np.zeros((48, 48, 48))
+    truth[8:39, 8:39, 8:39] = ball(15)
+    prediction[10:39, 9:38, 8:37] = ball(14)
+
+    def test_matches_metrics(self):
+        for zoom in [(1, 1, 2), (0.7, 0.7, 3)]:
+            sm = SegmentationMetrics(self.prediction, self.truth, zoom)
+            for max_hausdorff in [0.5, 2, sm.hausdorff_distance,
+                                  np.nextafter(sm.hausdorff_distance, 0), 10]:
+                result = qa_gate(self.prediction, self.truth, zoom,
+                                 max_hausdorff=max_hausdorff)
+                assert result['passed'] == \
+                    (sm.hausdorff_distance <= max_hausdorff)
+        sm = SegmentationMetrics(self.prediction, self.truth, (1, 1, 1),
+                                 percentile=50)
+        assert qa_gate(self.prediction, self.truth, (1, 1, 1),
+                       max_hausdorff=sm.hausdorff_distance,
+                       percentile=50)['passed']
+
+    def test_early_termination(self):
+        dice = SegmentationMetrics(self.prediction, self.truth,
+                                   (1, 1, 2)).dice
+        # A failed Dice doesn't look at the surfaces
+        result = qa_gate(self.prediction, self.truth, (1, 1, 2),
+                         min_dice=0.95, max_hausdorff=1)
+        assert not result['passed']
+        assert result['dice'] == dice
+        assert result['reason'].startswith('Dice')
+        # A generous limit is decided by the coarse bounds alone
+        result = qa_gate(self.prediction, self.truth, (1, 1, 2),
+                         min_dice=0.8, max_hausdorff=10)
+        assert result['passed']
+        assert result['exact_surfels'] == 0
+        assert 'Hausdorff' in result['reason']
+
+    def test_extreme_percentiles(self):
+        # Cubes 10.4 mm apart, every surface distance is at least that
+        truth = np.zeros((20, 20, 40), bool)
+        prediction = np.zeros((20, 20, 40), bool)
+        truth[5:15, 5:15, 2:10] = True
+        prediction[5:15, 5:15, 18:26] = True
+        zoom = (1, 1, 1.3)
+        for percentile in [0, 50, 100]:
+            hd = SegmentationMetrics(prediction, truth, zoom,
+                                     percentile=percentile).hausdorff_distance
+            for max_hausdorff in [0, 1, np.nextafter(hd, 0), hd, 2 * hd]:
+                assert qa_gate(prediction, truth, zoom,
+                               max_hausdorff=max_hausdorff,
+                               percentile=percentile)['passed'] == \
+                    (hd <= max_hausdorff)
+        for percentile in [0, 100]:
+            sm = SegmentationMetrics(self.prediction, self.truth, (1, 1, 2),
+                                     percentile=percentile)
+            for max_hausdorff in [0, sm.hausdorff_distance,
+                                  np.nextafter(sm.hausdorff_distance, 0)]:
+                assert qa_gate(self.prediction, self.truth, (1, 1, 2),
+                               max_hausdorff=max_hausdorff,
+                               percentile=percentile)['passed'] == \
+                    (sm.hausdorff_distance <= max_hausdorff)
+
+    def test_zero_limit(self):
+        # Identical surfaces are 0 mm apart
+        for zoom in [(1, 1, 1), (0.7, 0.7, 3)]:
+            assert qa_gate(self.truth, self.truth, zoom,
+                           max_hausdorff=0)['passed']
+            assert not qa_gate(self.prediction, self.truth, zoom,
+                               max_hausdorff=0)['passed']
+
+    def test_empty(self):
+        result = qa_gate(np.zeros_like(self.truth), self.truth, (1, 1, 1),
+                         max_hausdorff=5)
+        assert not result['passed']
+        assert qa_gate(self.prediction, self.truth, (1, 1, 1))['passed']
+        with pytest.raises(ValueError):
+            qa_gate(self.prediction, self.truth[1:], (1, 1, 1), 0.9)
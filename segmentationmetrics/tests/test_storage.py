@@ -0,0 +1,87 @@
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from segmentationmetrics import ChunkedMask, SegmentationMetrics
+from segmentationmetrics import storage
+from segmentationmetrics.encoded import encoded_confusion_counts
+from segmentationmetrics.metrics import confusion_counts
+from skimage.morphology import ball
+
+
+class TestChunkedMask:
+    truth = np.zeros((100, 90, 70), bool)
+    truth[40:51, 40:51, 30:41] = ball(5)
+    prediction = np.zeros((100, 90, 70), bool)
+    prediction[41:52, 39:50, 30:41] = ball(5)
+    prediction[3, 4, 5] = True
+
+    def test_round_trip(self):
+        chunked = ChunkedMask.from_dense(self.prediction)
+        assert chunked.chunk_shape == (32, 32, 32)
+        np.testing.assert_array_equal(chunked.to_dense(), self.prediction)
+        assert chunked.count() == np.count_nonzero(self.prediction)
+        np.testing.assert_array_equal(
+            np.unique(chunked.argwhere(), axis=0), np.argwhere(self.prediction))
+        bbox_min, bbox_max = chunked.bounding_box()
+        np.testing.assert_array_equal(bbox_min, [3, 4, 5])
+        np.testing.assert_array_equal(bbox_max, [51, 49, 40])
+        # Empty chunks are not stored
+        assert len(chunked.chunks) < np.prod(
+            np.ceil(np.divide(self.prediction.shape, 32)))
+
+        empty = ChunkedMask.from_dense(np.zeros((10, 10)))
+        assert empty.bounding_box() == (None, None)
+        assert empty.count() == 0
+
+    def test_crop_decodes_overlapping_chunks(self):
+        chunked = ChunkedMask.from_dense(self.truth, (16, 16, 16))
+        with mock.patch.object(storage, '_decode',
+                               wraps=storage._decode) as decode:
+            crop = chunked.crop([40, 40, 30], [50, 50, 40])
+        np.testing.assert_array_equal(crop, ball(5))
+        # The ball spans 2 x 2 x 2 chunks, one corner is empty
+        assert decode.call_count == len(chunked.chunks) == 7
+        with mock.patch.object(storage, '_decode',
+                               wraps=storage._decode) as decode:
+            assert not chunked.crop([0, 0, 0], [20, 20, 20]).any()
+        assert decode.call_count == 0
+
+    def test_counts(self):
+        expected = confusion_counts(self.prediction, self.truth)
+        assert encoded_confusion_counts(
+            ChunkedMask.from_dense(self.prediction),
+            ChunkedMask.from_dense(self.truth)) == expected
+        # Different chunks fall back to decoding the union bounding box
+        assert encoded_confusion_counts(
+            ChunkedMask.from_dense(self.prediction, (10, 20, 30)),
+            ChunkedMask.from_dense(self.truth)) == expected
+
+    def test_save_load(self, tmp_path):
+        path = tmp_path / 'truth.smc'
+        ChunkedMask.from_dense(self.truth).save(path)
+        loaded = ChunkedMask.load(path)
+        assert loaded.shape == self.truth.shape
+        assert loaded.count() == np.count_nonzero(self.truth)
+        np.testing.assert_array_equal(loaded.to_dense(), self.truth)
+
+        # A saved copy of a loaded mask is the same file
+        loaded.save(tmp_path / 'copy.smc')
+        assert (tmp_path / 'copy.smc').read_bytes() == path.read_bytes()
+
+        (tmp_path / 'other.npy').write_bytes(b'\x93NUMPY')
+        with pytest.raises(ValueError):
+            ChunkedMask.load(tmp_path / 'other.npy')
+
+    def test_metrics_match_dense(self, tmp_path):
+        ChunkedMask.from_dense(self.prediction).save(tmp_path / 'pred.smc')
+        dense = SegmentationMetrics(self.prediction, self.truth, (1, 2, 1))
+        chunked = SegmentationMetrics(ChunkedMask.load(tmp_path / 'pred.smc'),
+                                      ChunkedMask.from_dense(self.truth),
+                                      (1, 2, 1))
+        assert chunked.get_dict() == pytest.approx(dense.get_dict())
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            ChunkedMask.from_dense(self.truth, (16, 16))
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from segmentationmetrics import MaskIndex, SegmentationMetrics, summarise_mask
+from segmentationmetrics import surface_distance as sd
+from skimage.morphology import ball
+
+
+class TestSummary:
+    mask = np.zeros((40, 40, 30), np.uint8)
+    mask[4:27, 6:29, 3:26] = ball(11)
+    mask[30:35, 30:35, 20:25] = 3
+    zoom = (1, 0.8, 2)
+
+    def test_summarise_mask(self):
+        summary = summarise_mask(self.mask, self.zoom)
+        foreground = self.mask > 0
+        sm = SegmentationMetrics(foreground, foreground, self.zoom)
+        assert summary['voxel_count'] == np.count_nonzero(foreground)
+        assert summary['volume'] == pytest.approx(sm.true_volume)
+        assert summary['bounding_box'] == [[4, 6, 3], [34, 34, 25]]
+        assert summary['label_counts'] == {'1': np.sum(self.mask == 1),
+                                           '3': 125}
+        surface_distances = sd.compute_surface_distances(
+            foreground, foreground, self.zoom)
+        assert summary['surfel_count'] == len(
+            surface_distances['surfel_areas_gt'])
+        assert summarise_mask(foreground)['label_counts'] == {
+            '1': np.count_nonzero(foreground)}
+
+        empty = summarise_mask(np.zeros((10, 10)))
+        assert empty['voxel_count'] == 0
+        assert empty['bounding_box'] is None
+        assert empty['volume'] is None
+
+    def test_hash(self):
+        summary = summarise_mask(self.mask)
+        assert summary['hash'] == summarise_mask(self.mask.copy())['hash']
+        changed = self.mask.copy()
+        changed[0, 0, 0] = 1
+        assert summary['hash'] != summarise_mask(changed)['hash']
+        assert summary['hash'] != summarise_mask(
+            self.mask.reshape(30, 40, 40))['hash']
+
+    def test_index(self, tmp_path):
+        index = MaskIndex()
+        index.add('case_1', self.mask, self.zoom)
+        index.add('case_2', np.zeros((10, 10, 10)), (1, 1, 1))
+        path = tmp_path / 'masks.json'
+        index.save(path)
+
+        loaded = MaskIndex.load(path)
+        assert len(loaded) == 2 and 'case_1' in loaded
+        assert loaded['case_1'] == index['case_1']
+        assert loaded.empty_masks() == ['case_2']
+        assert loaded.volumes()['case_2'] == 0
+        assert loaded.is_current('case_1', self.mask)
+        assert not loaded.is_current('case_1', self.mask[::-1])
+        assert not loaded.is_current('case_3', self.mask)
+        df = loaded.get_df()
+        assert type(df) == pd.DataFrame
+        assert df.loc['case_1', 'box_voxels'] == 31 * 29 * 23
+
+        path.write_text('{"version": 0, "masks": {}}')
+        with pytest.raises(ValueError):
+            MaskIndex.load(path)
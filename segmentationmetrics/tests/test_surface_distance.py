@@ -18,10 +18,13 @@ from __future__ import division
 from __future__ import print_function
 
 import math
+from unittest import mock
+
 from absl.testing import absltest
 from absl.testing import parameterized
 import numpy as np
 from .. import surface_distance
+from ..surface_distance import kernels
 from ..surface_distance import metrics
 
 
@@ -361,4 +364,407 @@ class SurfaceDistance3DTest(SurfaceDistanceTest):
         expected_hausdorff_95=np.inf,
         expected_surface_overlap_at_1mm=(np.nan, np.nan),
         expected_surface_dice_at_1mm=np.nan,
-        expected_volumetric_dice=np.nan)
\ No newline at end of file
+        expected_volumetric_dice=np.nan)
+
+
+class SurfaceDistanceMemoryLayoutTest(parameterized.TestCase):
+
+  @parameterized.parameters(((1, 2),), ((2, 1, 1.5),))
+  def test_fortran_ordered_and_uint8_masks(self, spacing_mm):
+    rng = np.random.default_rng(0)
+    shape = (20,) * len(spacing_mm)
+    mask_gt = np.zeros(shape, bool)
+    mask_gt[(slice(4, 15),) * len(spacing_mm)] = True
+    mask_pred = rng.random(shape) > 0.7
+    expected = surface_distance.compute_surface_distances(mask_gt, mask_pred,
+                                                          spacing_mm)
+    for convert in (np.asfortranarray,
+                    lambda mask: mask.astype(np.uint8) * 255,
+                    lambda mask: np.asfortranarray(mask, np.uint8)):
+      actual = surface_distance.compute_surface_distances(
+          convert(mask_gt), convert(mask_pred), spacing_mm)
+      for key in expected:
+        np.testing.assert_array_equal(expected[key], actual[key])
+
+  def test_other_dtypes_rejected(self):
+    mask = np.zeros((4, 4, 4), np.int64)
+    with self.assertRaises(ValueError):
+      surface_distance.compute_surface_distances(mask, mask, (1, 1, 1))
+
+
+class SurfaceDistanceBatchTest(parameterized.TestCase):
+
+  @parameterized.parameters(((1, 2),), ((2, 1, 1.5),))
+  def test_matches_unbatched(self, spacing_mm):
+    shape = (6,) + (24,) * len(spacing_mm)
+    masks_gt = np.zeros(shape, bool)
+    masks_pred = np.zeros(shape, bool)
+    masks_gt[0, 4:12, 5:15] = 1
+    masks_pred[0, 5:14, 5:12] = 1
+    masks_gt[1, 10:20, 2:8] = 1
+    masks_pred[1, 3:5, 18:20] = 1
+    masks_gt[2, 5:10, 5:10] = 1  # empty prediction
+    masks_pred[3, 5:10, 5:10] = 1  # empty ground truth
+    masks_gt[5, 8:12, 8:12] = 1
+    masks_pred[5, 8:12, 8:12] = 1  # 4 is empty on both
+    batch = surface_distance.compute_surface_distances_batch(
+        masks_gt, masks_pred, spacing_mm)
+    hausdorff_95 = surface_distance.compute_robust_hausdorff_batch(batch, 95)
+    average_distance = (
+        surface_distance.compute_average_surface_distance_batch(batch))
+
+    self.assertEqual(batch['batch_size'], 6)
+    for i in range(6):
+      single = surface_distance.compute_surface_distances(
+          masks_gt[i], masks_pred[i], spacing_mm)
+      for side in ('gt', 'pred'):
+        in_mask = batch['batch_index_' + side] == i
+        np.testing.assert_array_equal(
+            single['surfel_areas_' + side],
+            batch['surfel_areas_' + side][in_mask])
+      np.testing.assert_array_equal(
+          single['distances_gt_to_pred'],
+          batch['distances_gt_to_pred'][batch['batch_index_gt'] == i])
+      np.testing.assert_array_equal(
+          single['distances_pred_to_gt'],
+          batch['distances_pred_to_gt'][batch['batch_index_pred'] == i])
+      self.assertEqual(
+          surface_distance.compute_robust_hausdorff(single, 95),
+          hausdorff_95[i])
+      np.testing.assert_allclose(
+          surface_distance.compute_average_surface_distance(single),
+          (average_distance[0][i], average_distance[1][i]))
+
+  def test_raises_on_incompatible_shapes(self):
+    with self.assertRaisesRegex(ValueError,
+                                'The arguments must be of compatible shape'):
+      surface_distance.compute_surface_distances_batch(
+          np.zeros([2, 2, 2], bool), np.zeros([2, 2, 2], bool), [1, 1, 1])
+
+
+class SurfaceDistanceApproximateTest(parameterized.TestCase):
+
+  @parameterized.parameters(((2, 1), 2), ((1, 1, 1), 2), ((2, 1, 0.5), 3),
+                            ((1, 1, 1), (1, 2, 4)))
+  def test_within_error_bound(self, spacing_mm, factor):
+    shape = (30,) * len(spacing_mm)
+    mask_gt = np.zeros(shape, bool)
+    mask_pred = np.zeros(shape, bool)
+    mask_gt[(slice(5, 20),) * len(spacing_mm)] = 1
+    mask_pred[(slice(8, 25),) + (slice(3, 18),) * (len(spacing_mm) - 1)] = 1
+    mask_pred[(slice(27, 29),) * len(spacing_mm)] = 1
+    exact = surface_distance.compute_surface_distances(
+        mask_gt, mask_pred, spacing_mm)
+    approximate = surface_distance.compute_surface_distances_approximate(
+        mask_gt, mask_pred, spacing_mm, factor)
+
+    max_error = np.linalg.norm((np.asarray(factor) - 1) *
+                               np.asarray(spacing_mm))
+    self.assertAlmostEqual(max_error, approximate['max_error_mm'])
+    for key in ('surfel_areas_gt', 'surfel_areas_pred'):
+      np.testing.assert_allclose(np.sort(exact[key]),
+                                 np.sort(approximate[key]))
+    for percent in (50, 95, 100):
+      self.assertLessEqual(
+          abs(surface_distance.compute_robust_hausdorff(exact, percent) -
+              surface_distance.compute_robust_hausdorff(approximate, percent)),
+          max_error + 1e-9)
+    for exact_average, approximate_average in zip(
+        surface_distance.compute_average_surface_distance(exact),
+        surface_distance.compute_average_surface_distance(approximate)):
+      self.assertLessEqual(abs(exact_average - approximate_average),
+                           max_error + 1e-9)
+
+  def test_factor_one_is_exact(self):
+    mask_gt = np.zeros((20, 20), bool)
+    mask_pred = np.zeros((20, 20), bool)
+    mask_gt[3:9, 4:15] = 1
+    mask_pred[5:12, 2:10] = 1
+    exact = surface_distance.compute_surface_distances(
+        mask_gt, mask_pred, (1, 2))
+    approximate = surface_distance.compute_surface_distances_approximate(
+        mask_gt, mask_pred, (1, 2), factor=1)
+    self.assertEqual(approximate.pop('max_error_mm'), 0)
+    for key, value in exact.items():
+      np.testing.assert_array_equal(value, approximate[key])
+
+  def test_empty_masks(self):
+    approximate = surface_distance.compute_surface_distances_approximate(
+        np.zeros((8, 8), bool), np.zeros((8, 8), bool), (1, 1), factor=2)
+    self.assertEqual(len(approximate['distances_gt_to_pred']), 0)
+    self.assertAlmostEqual(approximate['max_error_mm'], math.sqrt(2))
+
+
+class SurfaceDistanceCoarseToFineTest(parameterized.TestCase):
+
+  @parameterized.product(spacing_mm=[(1, 1), (2, 1), (1, 1, 1), (0.5, 1, 3)],
+                         percent=[50, 95, 100])
+  def test_matches_exact(self, spacing_mm, percent):
+    rng = np.random.default_rng(0)
+    shape = (40,) * len(spacing_mm)
+    mask_gt = np.zeros(shape, bool)
+    mask_gt[(slice(5, 30),) * len(spacing_mm)] = 1
+    mask_pred = mask_gt.copy()
+    # a few bumps and dents on an otherwise well aligned surface
+    for _ in range(5):
+      centre = rng.integers(3, 32, len(spacing_mm))
+      mask_pred[tuple(slice(c, c + 4) for c in centre)] ^= True
+    exact = surface_distance.compute_robust_hausdorff(
+        surface_distance.compute_surface_distances(mask_gt, mask_pred,
+                                                   spacing_mm), percent)
+    self.assertAlmostEqual(
+        exact,
+        surface_distance.compute_robust_hausdorff_coarse_to_fine(
+            mask_gt, mask_pred, spacing_mm, percent),
+        places=10)
+
+  def test_empty_masks(self):
+    mask_gt = np.zeros((16, 16, 16), bool)
+    mask_pred = np.zeros((16, 16, 16), bool)
+    self.assertEqual(
+        surface_distance.compute_robust_hausdorff_coarse_to_fine(
+            mask_gt, mask_pred, (1, 1, 1), 95), np.inf)
+    mask_gt[4:8, 4:8, 4:8] = 1
+    self.assertEqual(
+        surface_distance.compute_robust_hausdorff_coarse_to_fine(
+            mask_gt, mask_pred, (1, 1, 1), 95), np.inf)
+
+
+class SurfaceDistanceClusteredTest(parameterized.TestCase):
+
+  @parameterized.product(spacing_mm=[(1, 2), (2, 1, 1.5)], factor=[1, 2, 4])
+  def test_matches_single_box(self, spacing_mm, factor):
+    num_dims = len(spacing_mm)
+    shape = (100,) + (40,) * (num_dims - 1)
+    mask_gt = np.zeros(shape, bool)
+    mask_pred = np.zeros(shape, bool)
+    # two matching parts at opposite ends of the volume
+    mask_gt[(slice(5, 20),) * num_dims] = True
+    mask_pred[(slice(7, 21),) * num_dims] = True
+    mask_gt[(slice(80, 95),) + (slice(20, 35),) * (num_dims - 1)] = True
+    mask_pred[(slice(81, 97),) + (slice(22, 35),) * (num_dims - 1)] = True
+    # a false positive and a false negative far from everything else
+    mask_pred[(slice(50, 53),) + (slice(2, 5),) * (num_dims - 1)] = True
+    mask_gt[(slice(60, 62),) + (slice(30, 33),) * (num_dims - 1)] = True
+    expected = surface_distance.compute_surface_distances(
+        mask_gt, mask_pred, spacing_mm)
+    actual = surface_distance.compute_surface_distances_clustered(
+        mask_gt, mask_pred, spacing_mm, factor)
+    for key in expected:
+      np.testing.assert_allclose(expected[key], actual[key])
+
+  def test_empty_masks(self):
+    mask_gt = np.zeros((30, 30, 30), bool)
+    mask_pred = np.zeros((30, 30, 30), bool)
+    result = surface_distance.compute_surface_distances_clustered(
+        mask_gt, mask_pred, (1, 1, 1))
+    self.assertEmpty(result["distances_gt_to_pred"])
+    mask_gt[2:5, 2:5, 2:5] = True
+    mask_gt[20:25, 20:25, 20:25] = True
+    expected = surface_distance.compute_surface_distances(
+        mask_gt, mask_pred, (1, 1, 1))
+    result = surface_distance.compute_surface_distances_clustered(
+        mask_gt, mask_pred, (1, 1, 1))
+    for key in expected:
+      np.testing.assert_array_equal(expected[key], result[key])
+
+
+class SurfaceDistanceKDTreeTest(parameterized.TestCase):
+
+  @parameterized.product(spacing_mm=[(1, 2), (2, 1, 1.5)],
+                         slab_size=[None, 1, 2, 7, 100])
+  def test_matches_distance_transform(self, spacing_mm, slab_size):
+    num_dims = len(spacing_mm)
+    shape = (50,) + (30,) * (num_dims - 1)
+    rng = np.random.default_rng(0)
+    mask_gt = np.zeros(shape, bool)
+    mask_pred = np.zeros(shape, bool)
+    mask_gt[(slice(5, 40),) + (slice(5, 25),) * (num_dims - 1)] = True
+    mask_pred[(slice(8, 42),) + (slice(4, 22),) * (num_dims - 1)] = True
+    mask_pred ^= rng.random(shape) > 0.97
+    expected = surface_distance.compute_surface_distances(
+        mask_gt, mask_pred, spacing_mm)
+    actual = surface_distance.compute_surface_distances_kdtree(
+        mask_gt, mask_pred, spacing_mm, slab_size)
+    for key in expected:
+      np.testing.assert_allclose(expected[key], actual[key])
+
+  def test_empty_masks(self):
+    mask_gt = np.zeros((20, 20, 20), bool)
+    mask_pred = np.zeros((20, 20, 20), bool)
+    result = surface_distance.compute_surface_distances_kdtree(
+        mask_gt, mask_pred, (1, 1, 1))
+    self.assertEmpty(result["distances_gt_to_pred"])
+    mask_gt[2:5, 2:5, 2:5] = True
+    expected = surface_distance.compute_surface_distances(
+        mask_gt, mask_pred, (1, 1, 1))
+    result = surface_distance.compute_surface_distances_kdtree(
+        mask_gt, mask_pred, (1, 1, 1), 2)
+    for key in expected:
+      np.testing.assert_array_equal(expected[key], result[key])
+
+
+class SurfaceDistanceKernelsTest(parameterized.TestCase):
+  # Without Numba the kernels run as Python, so the masks are kept small
+
+  @parameterized.parameters((1, 2), (2, 1, 1.5))
+  def test_find_surfels_matches_borders(self, *spacing_mm):
+    num_dims = len(spacing_mm)
+    rng = np.random.default_rng(0)
+    cropmask = (rng.random((9,) * num_dims) > 0.4).astype(np.uint8)
+    cropmask[(-1,) * num_dims] = 0
+    table, kernel, full_true_neighbours = metrics._get_surface_lookup(
+        spacing_mm)
+    codes, borders = metrics._compute_borders(cropmask, kernel,
+                                              full_true_neighbours)
+    coordinates, surfel_codes, areas, background = kernels.find_surfels(
+        cropmask, kernel, full_true_neighbours, table)
+    np.testing.assert_array_equal(coordinates, np.argwhere(borders))
+    np.testing.assert_array_equal(surfel_codes, codes[borders])
+    np.testing.assert_array_equal(areas, table[codes[borders]])
+    np.testing.assert_array_equal(background, ~borders)
+    values = rng.random(cropmask.shape)
+    np.testing.assert_array_equal(kernels.gather(values, coordinates),
+                                  values[borders])
+
+  @parameterized.parameters((1, 2), (2, 1, 1.5))
+  def test_matches_numpy(self, *spacing_mm):
+    num_dims = len(spacing_mm)
+    shape = (14,) * num_dims
+    rng = np.random.default_rng(1)
+    mask_gt = np.zeros(shape, bool)
+    mask_pred = np.zeros(shape, bool)
+    mask_gt[(slice(2, 10),) * num_dims] = True
+    mask_pred[(slice(3, 12),) * num_dims] = True
+    mask_pred ^= rng.random(shape) > 0.9
+    for mask_b in (mask_pred, np.zeros(shape, bool)):
+      with mock.patch.object(kernels, "ENABLED", False):
+        expected = surface_distance.compute_surface_distances(
+            mask_gt, mask_b, spacing_mm)
+      with mock.patch.object(kernels, "ENABLED", True):
+        actual = surface_distance.compute_surface_distances(
+            mask_gt, mask_b, spacing_mm)
+      for key in expected:
+        np.testing.assert_array_equal(expected[key], actual[key])
+
+
+class SurfaceDistanceCompactTest(parameterized.TestCase):
+
+  @parameterized.product(spacing_mm=[(1, 2), (2, 1, 1.5)],
+                         bins=[(0.1, None), (0.05, 0.02), (1, 0.5)])
+  def test_matches_surface_distances(self, spacing_mm, bins):
+    bin_width_mm, relative_resolution = bins
+    num_dims = len(spacing_mm)
+    shape = (40,) * num_dims
+    mask_gt = np.zeros(shape, bool)
+    mask_pred = np.zeros(shape, bool)
+    mask_gt[(slice(5, 30),) * num_dims] = True
+    mask_pred[(slice(8, 31),) * num_dims] = True
+    mask_pred[(slice(35, 38),) * num_dims] = True
+    surface_distances = surface_distance.compute_surface_distances(
+        mask_gt, mask_pred, spacing_mm)
+    compact = surface_distance.compact_surface_distances(
+        surface_distances, bin_width_mm, relative_resolution)
+    np.testing.assert_allclose(
+        surface_distance.compute_average_surface_distance(compact),
+        surface_distance.compute_average_surface_distance(surface_distances))
+    for percent in (0, 50, 95, 100):
+      exact = surface_distance.compute_robust_hausdorff(surface_distances,
+                                                        percent)
+      resolution = max(bin_width_mm, (relative_resolution or 0) * exact)
+      binned = surface_distance.compute_robust_hausdorff(compact, percent)
+      self.assertBetween(binned, exact, exact + resolution)
+    # tolerances on a bin edge are exact
+    for tolerance_mm in (0, 2 * bin_width_mm):
+      np.testing.assert_allclose(
+          surface_distance.compute_surface_overlap_at_tolerance(
+              compact, tolerance_mm),
+          surface_distance.compute_surface_overlap_at_tolerance(
+              surface_distances, tolerance_mm))
+      np.testing.assert_allclose(
+          surface_distance.compute_surface_dice_at_tolerance(
+              compact, tolerance_mm),
+          surface_distance.compute_surface_dice_at_tolerance(
+              surface_distances, tolerance_mm))
+
+  def test_empty_mask(self):
+    mask_gt = np.zeros((20, 20), bool)
+    mask_gt[5:10, 5:10] = True
+    surface_distances = surface_distance.compute_surface_distances(
+        mask_gt, np.zeros((20, 20), bool), (1, 1))
+    compact = surface_distance.compact_surface_distances(surface_distances)
+    self.assertEqual(
+        surface_distance.compute_robust_hausdorff(compact, 95), np.inf)
+    self.assertEqual(surface_distance.compute_average_surface_distance(
+        compact)[0], np.inf)
+    with self.assertRaises(ValueError):
+      surface_distance.compact_surface_distances(surface_distances, 0)
+
+
+class SurfaceDistanceCoordinatesTest(parameterized.TestCase):
+
+  @parameterized.parameters((False, 1, 2), (False, 2, 1, 1.5),
+                            (True, 1, 2), (True, 2, 1, 1.5))
+  def test_coordinates(self, fused, *spacing_mm):
+    num_dims = len(spacing_mm)
+    shape = (16,) * num_dims
+    rng = np.random.default_rng(2)
+    mask_gt = np.zeros(shape, bool)
+    mask_pred = np.zeros(shape, bool)
+    mask_gt[(slice(3, 10),) * num_dims] = True
+    mask_pred[(slice(4, 12),) * num_dims] = True
+    mask_pred ^= rng.random(shape) > 0.95
+    with mock.patch.object(kernels, "ENABLED", fused):
+      expected = surface_distance.compute_surface_distances(
+          mask_gt, mask_pred, spacing_mm)
+      actual = surface_distance.compute_surface_distances(
+          mask_gt, mask_pred, spacing_mm, return_coordinates=True)
+    for key in expected:
+      np.testing.assert_array_equal(actual[key], expected[key])
+
+    # Each surfel is at the lower corner of the voxel at its coordinates, its
+    # distance is that to the closest surfel of the other surface
+    for side, other, direction in (("gt", "pred", "gt_to_pred"),
+                                   ("pred", "gt", "pred_to_gt")):
+      coordinates = actual["surfel_coordinates_" + side]
+      self.assertEqual(coordinates.dtype, np.int32)
+      self.assertLen(coordinates, len(actual["distances_" + direction]))
+      offsets = (coordinates[:, np.newaxis] -
+                 actual["surfel_coordinates_" + other]) * spacing_mm
+      np.testing.assert_allclose(
+          np.min(np.linalg.norm(offsets, axis=-1), axis=1),
+          actual["distances_" + direction])
+
+  def test_worst_surfels(self):
+    mask_gt = np.zeros((30, 30), bool)
+    mask_pred = np.zeros((30, 30), bool)
+    mask_gt[5:15, 5:15] = True
+    mask_pred[5:15, 5:15] = True
+    mask_pred[25, 26] = True
+    surface_distances = surface_distance.compute_surface_distances(
+        mask_gt, mask_pred, (1, 1), return_coordinates=True)
+    worst = surface_distance.compute_worst_surfels(surface_distances, 3)
+    self.assertLen(worst["distances_pred_to_gt"], 3)
+    self.assertTrue(np.all(np.diff(worst["distances_pred_to_gt"]) <= 0))
+    self.assertEqual(worst["distances_pred_to_gt"][0],
+                     surface_distances["distances_pred_to_gt"][-1])
+    # The corners of the stray voxel
+    self.assertContainsSubset(
+        [tuple(c) for c in worst["surfel_coordinates_pred"]],
+        [(25, 26), (25, 27), (26, 26), (26, 27)])
+    all_surfels = surface_distance.compute_worst_surfels(surface_distances,
+                                                         10000)
+    np.testing.assert_array_equal(
+        all_surfels["distances_gt_to_pred"],
+        surface_distances["distances_gt_to_pred"][::-1])
+
+    empty = surface_distance.compute_surface_distances(
+        np.zeros((5, 5), bool), np.zeros((5, 5), bool), (1, 1),
+        return_coordinates=True)
+    self.assertEqual(empty["surfel_coordinates_gt"].shape, (0, 2))
+    self.assertEmpty(surface_distance.compute_worst_surfels(
+        empty)["surfel_coordinates_gt"])
+    with self.assertRaises(ValueError):
+      surface_distance.compute_worst_surfels(
+          surface_distance.compute_surface_distances(mask_gt, mask_pred,
+                                                     (1, 1)))
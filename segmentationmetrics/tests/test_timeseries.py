@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from segmentationmetrics import (SegmentationMetrics, frame_metrics,
+                                 temporal_summary)
+from skimage.morphology import ball
+
+
+class TestFrameMetrics:
+    n_frames = 4
+    truth = np.zeros((n_frames, 32, 32, 32))
+    prediction = np.zeros((n_frames, 32, 32, 32))
+    for t in range(n_frames):
+        r = 6 + t
+        truth[t, 16 - r:17 + r, 16 - r:17 + r, 16 - r:17 + r] = ball(r)
+        prediction[t, 17 - r:18 + r, 16 - r:17 + r, 15 - r:16 + r] = ball(r)
+    prediction[2] = 0  # An empty prediction
+
+    @pytest.mark.parametrize('workers, executor', [(1, 'thread'),
+                                                   (2, 'thread'),
+                                                   (2, 'process')])
+    def test_matches_single_frames(self, workers, executor):
+        metrics = frame_metrics(self.prediction, self.truth, (1, 1, 2),
+                                workers=workers, executor=executor)
+        for t in range(self.n_frames):
+            sm = SegmentationMetrics(self.prediction[t], self.truth[t],
+                                     (1, 1, 2))
+            assert {key: value[t] for key, value in metrics.items()} == \
+                pytest.approx(sm.get_dict(), nan_ok=True)
+
+    def test_summary(self):
+        metrics = frame_metrics(self.prediction, self.truth, (1, 1, 1),
+                                symmetric=False)
+        assert metrics['mean_surface_distance'].shape == (self.n_frames, 2)
+        summary = temporal_summary(metrics)
+        assert type(summary) == pd.DataFrame
+        assert summary.loc['true_volume', 'Max Frame'] == 3
+        assert summary.loc['dice', 'Min Frame'] == 2
+        assert summary.loc['dice', 'Mean'] == pytest.approx(
+            np.mean(metrics['dice']))
+        assert 'mean_surface_distance_1' in summary.index
+
+    def test_raises_on_invalid_input(self):
+        with pytest.raises(ValueError):
+            frame_metrics(self.prediction[0], self.truth[0], (1, 1, 1))
+        with pytest.raises(ValueError):
+            frame_metrics(self.prediction, self.truth, (1, 1, 1),
+                          executor='gpu')
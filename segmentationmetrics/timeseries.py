@@ -0,0 +1,166 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from . import surface_distance as sd
+from .metrics import (_as_bool_mask, _dice, _jaccard, _sensitivity,
+                      _specificity, _precision, _accuracy)
+
+
+def frame_metrics(prediction, truth, zoom, percentile=95, symmetric=True,
+                  workers=None, executor='thread'):
+    """
+    Calculate the segmentation accuracy metrics of every frame of a time
+    series of 3D masks.
+
+    The masks are validated and thresholded once, the overlap counts and
+    bounding boxes of all frames come from axis reductions over the whole
+    series and each frame's surface distances are computed on its own
+    bounding box only, spread across a pool of workers.
+
+    Parameters
+    ----------
+    prediction : np.ndarray
+        A (T, X, Y, Z) array of bools or ints (0 and 1) representing the
+        predicted mask of each frame.
+    truth : np.ndarray
+        A (T, X, Y, Z) array of bools or ints (0 and 1) representing the
+        ground truth mask of each frame.
+    zoom : tuple
+        The length of each spatial voxel dimension in millimeters.
+    percentile : int, default 95
+        The percentile of surface distances to define as the Hausdorff
+        distance.
+    symmetric : bool, default True
+        Whether to calculate the symmetric mean surface distance.
+    workers : int, optional
+        The number of workers to spread the frames across. Defaults to the
+        executor's own default, 1 computes the frames in turn.
+    executor : {'thread', 'process'}, default 'thread'
+        Whether to use a pool of threads or of processes.
+
+    Returns
+    -------
+    metrics : dict
+        The same keys as ``SegmentationMetrics.get_dict`` with an array
+        holding the score of each frame.
+    """
+    if prediction.ndim != 4 or prediction.shape != truth.shape:
+        raise ValueError('Time series metrics need a pair of 4D masks of the '
+                         'same shape, not {} and {}.'.format(prediction.shape,
+                                                             truth.shape))
+    if len(zoom) != 3:
+        raise ValueError('zoom should give the length of the 3 spatial voxel '
+                         'dimensions, not {}.'.format(zoom))
+    if executor not in ('thread', 'process'):
+        raise ValueError("executor should be 'thread' or 'process', not "
+                         "{!r}.".format(executor))
+    prediction = _as_bool_mask(prediction)
+    truth = _as_bool_mask(truth)
+
+    tp = np.count_nonzero(prediction & truth, axis=(1, 2, 3))
+    fp = np.count_nonzero(prediction, axis=(1, 2, 3)) - tp
+    fn = np.count_nonzero(truth, axis=(1, 2, 3)) - tp
+    tn = np.prod(prediction.shape[1:]) - tp - fp - fn
+    counts = {'tp': tp, 'fp': fp, 'fn': fn, 'tn': tn}
+
+    # Crop every frame to its own bounding box so the workers only get the
+    # region that matters
+    frames = [(prediction[t][box], truth[t][box], tuple(zoom), percentile)
+              for t, box in enumerate(_frame_bounding_boxes(prediction,
+                                                            truth))]
+    if workers == 1:
+        surface_metrics = list(map(_frame_surface_metrics, frames))
+    else:
+        pool = ThreadPoolExecutor if executor == 'thread' else \
+            ProcessPoolExecutor
+        with pool(max_workers=workers) as ex:
+            surface_metrics = list(ex.map(_frame_surface_metrics, frames))
+    msd = np.array([m[0] for m in surface_metrics])
+    hausdorff_distance = np.array([m[1] for m in surface_metrics])
+    if symmetric:
+        msd = np.mean(msd, axis=1)
+
+    true_volume = (tp + fn) * np.prod(zoom) / 1000
+    predicted_volume = (tp + fp) * np.prod(zoom) / 1000
+    return {'dice': _dice(**counts),
+            'jaccard': _jaccard(**counts),
+            'sensitivity': _sensitivity(**counts),
+            'specificity': _specificity(**counts),
+            'precision': _precision(**counts),
+            'accuracy': _accuracy(**counts),
+            'mean_surface_distance': msd,
+            'hausdorff_distance': hausdorff_distance,
+            'volume_difference': predicted_volume - true_volume,
+            'true_volume': true_volume,
+            'predicted_volume': predicted_volume}
+
+
+def temporal_summary(metrics):
+    """
+    Summarise per-frame metrics over time.
+
+    Parameters
+    ----------
+    metrics : dict
+        Per-frame metrics, as returned by ``frame_metrics``.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        The mean, standard deviation, minimum and maximum of each metric over
+        all frames (ignoring NaNs) and the frames where the minimum and
+        maximum occur.
+    """
+    rows = {}
+    for key, values in metrics.items():
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim != 1:
+            # e.g. asymmetric mean surface distances, one column per direction
+            for i, column in enumerate(values.T):
+                rows['{}_{}'.format(key, i)] = column
+        else:
+            rows[key] = values
+    summary = {}
+    for key, values in rows.items():
+        finite = ~np.isnan(values)
+        if not finite.any():
+            summary[key] = [np.nan] * 4 + [-1, -1]
+            continue
+        summary[key] = [np.nanmean(values), np.nanstd(values),
+                        np.nanmin(values), np.nanmax(values),
+                        int(np.nanargmin(values)), int(np.nanargmax(values))]
+    return pd.DataFrame.from_dict(summary, orient='index',
+                                  columns=['Mean', 'Std', 'Min', 'Max',
+                                           'Min Frame', 'Max Frame'])
+
+
+def _frame_bounding_boxes(prediction, truth):
+    """
+    The bounding box of the union of the masks in each frame as a tuple of
+    slices, from projections of the whole series.
+    """
+    # Project out the last axis once and reuse it for the first two axes
+    proj_xy = np.any(prediction, axis=3) | np.any(truth, axis=3)
+    projections = [np.any(proj_xy, axis=2), np.any(proj_xy, axis=1),
+                   np.any(prediction, axis=(1, 2)) |
+                   np.any(truth, axis=(1, 2))]
+    boxes = []
+    for t in range(prediction.shape[0]):
+        box = []
+        for proj in projections:
+            idx = np.flatnonzero(proj[t])
+            if len(idx) == 0:
+                # An empty frame, keep a single voxel to get empty results
+                idx = [0]
+            box.append(slice(idx[0], idx[-1] + 1))
+        boxes.append(tuple(box))
+    return boxes
+
+
+def _frame_surface_metrics(args):
+    prediction, truth, zoom, percentile = args
+    surface_dist = sd.compute_surface_distances(prediction, truth, zoom)
+    return (sd.compute_average_surface_distance(surface_dist),
+            sd.compute_robust_hausdorff(surface_dist, percentile))
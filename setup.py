@@ -20,6 +20,7 @@ setup(
     python_requires='>=3.9, <4',
     packages=find_packages(),
     install_requires=requirements,
+    extras_require={'numba': ['numba']},
     include_package_data=True,
 
     classifiers=[